@@ -0,0 +1,262 @@
+from util import *
+from travelRequests import TravelRequests
+from insertionHeuristic import InsertionHeuristic, PICKUP
+from model import SolutionStatistics
+import bisect
+import random
+
+# adaptive large neighborhood search (ALNS) for instances too large for the models, e.g. a city with thousands of requests per day.
+# it starts from the insertion heuristic and repeatedly removes requests from the line-based schedules (destroy) and inserts them again (repair).
+# operators are drawn by roulette wheel with weights adapted to their success, worse solutions are accepted by simulated annealing.
+# a destroyed or repaired schedule is checked bus by bus on the leg lists, an insertion only simulates the legs it changes
+
+# scores of the operators of an iteration: new best solution, improvement of the current solution, accepted worse solution
+SCORES = (33, 9, 13)
+SEGMENT_LENGTH = 100 # iterations between two weight updates
+REACTION_FACTOR = 0.1
+FINAL_TEMPERATURE_RATIO = 0.002 # temperature at the end of the search relative to the start
+
+class ALNSSolver(InsertionHeuristic, SolutionStatistics):
+    NAME = "ALNS"
+
+    def __init__(self, requests: TravelRequests, num_busses: int, Q_max: int, boarding_time: float, timeframe: float, alpha: float, beta: float,
+                 speed: float = 1, t_turn: float = 0.5, obj_weights: List[float] = [10,1], time_limit: float = 60, max_iterations: Optional[int] = None,
+                 max_removal: int = 40, insertion_window: Optional[float] = 60, seed: int = 0) -> None:
+        # time_limit in seconds, max_removal: max. number of requests removed per iteration,
+        # insertion_window: requests are only inserted after legs that end at most this long before their earliest pick-up (None: anywhere)
+        super().__init__(requests, num_busses=num_busses, Q_max=Q_max, boarding_time=boarding_time, timeframe=timeframe, alpha=alpha, beta=beta,
+                         speed=speed, t_turn=t_turn, obj_weights=obj_weights, insertion_window=insertion_window)
+        self.time_limit = time_limit
+        self.max_iterations = max_iterations
+        self.max_removal = max_removal
+        self.random = random.Random(seed)
+
+        self.destroy_operators = {"request_relocate": self._requestRelocate, "subline_swap": self._sublineSwap, "direction_flip": self._directionFlip}
+        self.repair_operators = {"greedy": self._greedyRepair, "random_order": self._randomRepair}
+
+    def solve(self):
+        start_time = datetime.datetime.now()
+        super().solve()
+        self.initial_objective = self.objective
+
+        current = best = self._snapshot()
+        current_objective = best_objective = self._objective()
+        # a solution 5% worse than the start solution is accepted with probability 1/2 at the beginning
+        start_temperature = max(0.05 * abs(current_objective) / math.log(2), 1)
+
+        self.destroy_weights = {name: 1.0 for name in self.destroy_operators}
+        self.repair_weights = {name: 1.0 for name in self.repair_operators}
+        scores = {name: 0 for name in itertools.chain(self.destroy_operators, self.repair_operators)}
+        uses = {name: 0 for name in scores}
+
+        self.iterations = 0
+        while self.bus_of:
+            progress = (datetime.datetime.now() - start_time).total_seconds() / self.time_limit
+            if self.max_iterations is not None:
+                progress = max(progress, self.iterations / self.max_iterations)
+            if progress >= 1:
+                break
+            self.iterations += 1
+            temperature = start_temperature * FINAL_TEMPERATURE_RATIO ** progress
+
+            destroy = self._roulette(self.destroy_weights)
+            repair = self._roulette(self.repair_weights)
+            num_removed = self.random.randint(min(2, len(self.bus_of)), min(len(self.bus_of), max(2, min(self.max_removal, len(self.bus_of) // 3))))
+            removed = self._removeRequests(self.destroy_operators[destroy](num_removed))
+            # rejected requests get another chance as well
+            removed_set = set(removed)
+            unserved = [r for r in range(self.num_requests) if (r not in self.bus_of) and (r not in removed_set) and (self.origins[r] != self.destinations[r])]
+            self.repair_operators[repair](removed + self.random.sample(unserved, min(len(unserved), num_removed)))
+
+            objective = self._objective()
+            score = 0
+            if objective > best_objective + EPSILON:
+                score = SCORES[0]
+                best, best_objective = self._snapshot(), objective
+                current, current_objective = best, objective
+            elif objective > current_objective + EPSILON:
+                score = SCORES[1]
+                current, current_objective = self._snapshot(), objective
+            elif objective > current_objective - EPSILON:
+                current, current_objective = self._snapshot(), objective
+            elif self.random.random() < math.exp((objective - current_objective) / temperature):
+                score = SCORES[2]
+                current, current_objective = self._snapshot(), objective
+            else:
+                self._restore(current)
+
+            for name in (destroy, repair):
+                scores[name] += score
+                uses[name] += 1
+            if self.iterations % SEGMENT_LENGTH == 0:
+                for weights in (self.destroy_weights, self.repair_weights):
+                    for name in weights:
+                        if uses[name] > 0:
+                            weights[name] = (1 - REACTION_FACTOR) * weights[name] + REACTION_FACTOR * scores[name] / uses[name]
+                        scores[name], uses[name] = 0, 0
+
+        self._restore(best)
+        self._summarize()
+        self.calculateStatistics()
+
+        end_time = datetime.datetime.now()
+        self.runtime = (end_time - start_time).total_seconds()
+        return self
+
+    def _objective(self) -> float:
+        total_distance = sum(ends[-1][3] for ends in self.ends if ends)
+        return sum((self.obj_weights[0] + self.obj_weights[1] * self.c_direct[r]) * self.demands[r] for r in self.bus_of) - self.obj_weights[1] * total_distance
+
+    def _snapshot(self) -> tuple:
+        # legs are never changed in place, copying the lists per bus is enough
+        return (list(self.routes), list(self.ends), list(self.end_times), dict(self.bus_of))
+
+    def _restore(self, snapshot: tuple):
+        routes, ends, end_times, bus_of = snapshot
+        self.routes, self.ends, self.end_times, self.bus_of = list(routes), list(ends), list(end_times), dict(bus_of)
+
+    def _roulette(self, weights: dict) -> str:
+        return self.random.choices(list(weights), weights=list(weights.values()))[0]
+
+    def _usedBusses(self) -> List[int]:
+        return [k for k, legs in enumerate(self.routes) if legs]
+
+    def _requestRelocate(self, num_removed: int) -> List[int]:
+        # random requests, repaired at their best position on any bus
+        return self.random.sample(list(self.bus_of), num_removed)
+
+    def _sublineSwap(self, num_removed: int) -> List[int]:
+        # a leg and a leg of another bus in the same direction at the same time, so the repair can exchange passengers between both sublines
+        requests = set()
+        used_busses = self._usedBusses()
+        for _ in range(num_removed):
+            if len(requests) >= num_removed:
+                break
+            k = self.random.choice(used_busses)
+            j = self.random.randrange(len(self.routes[k]))
+            direction, stops = self.routes[k][j]
+            requests.update(stop[4] for stop in stops)
+
+            start = self.end_times[k][j-1] if j > 0 else 0
+            overlapping = []
+            for other in used_busses:
+                i = bisect.bisect_left(self.end_times[other], start)
+                if (other != k) and (i < len(self.routes[other])) and (self.routes[other][i][0] == direction) and ((i == 0) or (self.end_times[other][i-1] <= self.end_times[k][j])):
+                    overlapping.append((other, i))
+            if overlapping:
+                other, i = self.random.choice(overlapping)
+                requests.update(stop[4] for stop in self.routes[other][i][1])
+        return list(requests)
+
+    def _directionFlip(self, num_removed: int) -> List[int]:
+        # two consecutive legs of a bus, the repair can serve the second direction first
+        requests = set()
+        used_busses = self._usedBusses()
+        for _ in range(num_removed):
+            if len(requests) >= num_removed:
+                break
+            k = self.random.choice(used_busses)
+            j = self.random.randrange(max(1, len(self.routes[k]) - 1))
+            for direction, stops in self.routes[k][j:j+2]:
+                requests.update(stop[4] for stop in stops)
+        return list(requests)
+
+    def _greedyRepair(self, requests: List[int]):
+        for r in sorted(requests, key=lambda r: (self.e_pickup[r], self.l_dropoff[r], r)):
+            self._insert(r)
+
+    def _randomRepair(self, requests: List[int]):
+        requests = list(requests)
+        self.random.shuffle(requests)
+        for r in requests:
+            self._insert(r)
+
+    def _removeRequests(self, requests: List[int]) -> List[int]:
+        # removing stops can make the schedule of a bus infeasible for other passengers, they are removed as well. returns all removed requests
+        requests_per_bus = {}
+        for r in requests:
+            requests_per_bus.setdefault(self.bus_of.pop(r), set()).add(r)
+
+        removed = []
+        for k, bus_requests in requests_per_bus.items():
+            dropped = set(bus_requests)
+            legs, ends = self._dropInfeasible(k, self.routes[k], dropped)
+            for r in dropped - bus_requests:
+                del self.bus_of[r]
+            self._setRoute(k, legs, ends)
+            removed.extend(dropped)
+        return removed
+
+    def calculateStatistics(self):
+        # same definitions as in the Subline-Based model
+        avg_waiting_time = 0
+        avg_ride_time = 0
+        avg_transportation_time = 0
+        empty_mileage = 0
+        pax_km_driven = 0
+        pax_km_booked = sum(self.c[self.origins[r]][self.destinations[r]] * self.demands[r] for r in self.accepted)
+
+        if not self.accepted:
+            super().calculateStatistics()
+            return
+
+        for k, legs in enumerate(self.routes):
+            if not legs:
+                continue
+            pickup_time = {}
+            for r, kind, station, time in self.getStopTimes(k, legs):
+                if kind == "pickup":
+                    pickup_time[r] = time
+                    continue
+                avg_ride_time += self.demands[r] * (time - pickup_time[r])
+                avg_transportation_time += self.demands[r] * (time - self.e_pickup[r])
+                if self.service_promises[r][0]:
+                    avg_waiting_time += self.demands[r] * (pickup_time[r] - self.e_pickup[r])
+                elif self.service_promises[r][1]:
+                    avg_waiting_time += self.demands[r] * (self.l_dropoff[r] - time)
+
+            state = self.initial_states[k]
+            for direction, stops in legs:
+                # the bus is empty between two legs
+                station, _, _, distance = self._transition(state, direction, direction * stops[0][0])
+                empty_mileage += distance - (0 if state is None else state[3])
+                load = 0
+                for (position, kind, _, _, r) in stops:
+                    if direction * position != station:
+                        if load == 0:
+                            empty_mileage += self.c[station][direction * position]
+                        else:
+                            pax_km_driven += self.c[station][direction * position] * load
+                        station = direction * position
+                    load += self.demands[r] if kind == PICKUP else -self.demands[r]
+                state = self._serveLeg(state, direction, stops)
+
+        self.avg_waiting_time = round(avg_waiting_time / self.num_pax_accepted, 2)
+        self.avg_ride_time = round(avg_ride_time / self.num_pax_accepted, 2)
+        self.avg_transportation_time = round(avg_transportation_time / self.num_pax_accepted, 2)
+
+        if self.total_distance == 0:
+            self.pooling_factor = 0
+            self.avg_detour_factor = 0
+            self.mean_occupancy = 0
+            self.share_empty_mileage = 0
+            self.system_efficiency = 0
+        else:
+            self.pooling_factor = pax_km_booked / self.total_distance
+            self.avg_detour_factor = pax_km_driven / pax_km_booked
+            self.mean_occupancy = pax_km_driven / (self.total_distance - empty_mileage)
+            self.share_empty_mileage = empty_mileage / self.total_distance
+            self.system_efficiency = pax_km_booked / self.total_distance
+
+            if abs(self.system_efficiency - 1/ self.avg_detour_factor * self.mean_occupancy * (1 - self.share_empty_mileage)) > EPSILON:
+                raise ValueError("Error in system efficiency!")
+
+    def printSolution(self, print_routes: bool = False):
+        super().printSolution(print_routes=print_routes)
+        print("Iterations:", self.iterations)
+        print("Objective value of the insertion heuristic:", round(self.initial_objective, 2))
+        print("Operator weights:", {name: round(weight, 2) for name, weight in itertools.chain(self.destroy_weights.items(), self.repair_weights.items())})
+        print(SEPERATOR)
+        print("STATISTICS")
+        print(SEPERATOR)
+        self._printStatistics()
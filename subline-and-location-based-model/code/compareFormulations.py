@@ -0,0 +1,70 @@
+from util import *
+from darpModel import DARPModel
+from sublineModel import SublineModel
+from sublineMatrixModel import SublineMatrixModel
+from travelRequests import TravelRequests
+
+# compare the bilinear and the linearized formulations, with global and with tightened big M's: bound of the root relaxation of the solve, build and solve time
+
+station_file = None
+distance_matrix_file = None
+
+parser = argparse.ArgumentParser("compareFormulations.py")
+parser.add_argument("requests", help="Path to request files.", type=str)
+parser.add_argument("instance_mode", help="1: discrete line, 2: station locations, 3: distance matrix.", type=int, default=1,choices=[1,2,3])
+parser.add_argument("--station_locations", help="Path to location / distance file name, in .txt format.", type=str, nargs="?", required=False)
+parser.add_argument("--model", help="Formulation to compare.", type=str, default="subline", choices=["subline", "subline_matrix", "location"])
+parser.add_argument("--time_limit", help="Time limit per solve in minutes.", type=float, default=60)
+args = parser.parse_args()
+
+if not os.path.exists(args.requests):
+    raise ValueError("Path to request files does not exist.")
+if (args.instance_mode == 2) or (args.instance_mode == 3):
+    if args.station_locations is None:
+        raise ValueError("Expected a location file when selecting instance_mode == {}.".format(args.instance_mode))
+    if not os.path.exists(args.station_locations):
+        raise ValueError("Path to location file does not exist.")
+    if args.instance_mode == 2:
+        station_file = args.station_locations
+    else:
+        distance_matrix_file = args.station_locations
+
+obj_weights = [10,1]
+speed = 1
+time_to_turn = 0.5
+consider_shortcuts = True
+linearizations = [None, "big_M", "indicator"]
+big_M_variants = {"global": False, "tightened": True}
+
+output_path = "output/"
+
+results = []
+for request_name in sorted(os.listdir(args.requests)):
+    request_file = os.path.join(args.requests, request_name)
+    # the location file may sit in the folder of the requests
+    if (args.station_locations is not None) and (os.path.abspath(request_file) == os.path.abspath(args.station_locations)):
+        continue
+
+    parsed_requests = TravelRequests()
+    number_of_busses, max_time_in_minutes, bus_capacity, number_of_stations, service_time, alpha, beta = parsed_requests.read_file(
+        instance_file=request_file, consider_shortcuts=consider_shortcuts, station_location_file=station_file, distance_matrix_file=distance_matrix_file)
+
+    for linearization, (big_M, tighten_big_M) in itertools.product(linearizations, big_M_variants.items()):
+        model_class = {"subline": SublineModel, "subline_matrix": SublineMatrixModel, "location": DARPModel}[args.model]
+        model = model_class(requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses, timeframe=max_time_in_minutes,
+                            boarding_time=service_time, Q_max=bus_capacity, speed=speed, t_turn=time_to_turn, alpha=alpha, beta=beta)
+        model.createModel(obj_weights=obj_weights, linearization=linearization, tighten_big_M=tighten_big_M)
+        model.optimize(verbose=False, params={"TimeLimit": args.time_limit * 60})
+
+        results.append({"instance": request_name, "linearization": str(linearization), "big M": big_M, "root bound": model.root_bound,
+                        "objective": model.model.ObjVal if model.model.SolCount > 0 else None, "MIP Gap": model.model.MIPGap if model.model.SolCount > 0 else None,
+                        "Buildtime": model.Buildtime, "Runtime": model.model.Runtime})
+        print(SEPERATOR)
+        print(results[-1])
+
+results = pd.DataFrame(results)
+print(SEPERATOR)
+print(results.pivot(index="instance", columns=["linearization", "big M"], values=["root bound", "Runtime"]))
+
+os.makedirs(output_path, exist_ok=True)
+results.to_csv(os.path.join(output_path, "{0}_linearization.csv".format(args.model)), index=False)
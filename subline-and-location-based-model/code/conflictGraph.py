@@ -0,0 +1,116 @@
+from util import *
+from travelRequests import TravelRequests
+
+# pairs of requests that can never share a vehicle (or a service) because of their time windows, and the maximal cliques of these conflicts.
+# a pair is checked on a relaxation of both models: the bus is at the station of a stop for at least the boarding time afterwards and needs
+# the shortest travel time between two stations, turns and the order of stops at the same station are ignored.
+# the four stops of a pair are checked for all pairs at once, the pairs are processed in blocks of rows to bound the memory
+
+BLOCK_SIZE = 256 # rows of the pair matrices computed at once
+MAX_CLIQUES = 10000 # the enumeration of maximal cliques stops after this many cliques
+
+# stops of a pair (p,r): 0 = pick-up of p, 1 = drop-off of p, 2 = pick-up of r, 3 = drop-off of r
+# orders in which one vehicle can serve both requests, each request is picked up before it is dropped off
+STOP_ORDERS = [(0,1,2,3), (0,2,1,3), (0,2,3,1), (2,0,1,3), (2,0,3,1), (2,3,0,1)]
+
+class ConflictGraph:
+    def __init__(self, travel_requests: TravelRequests, pickup_windows: np.ndarray, dropoff_windows: np.ndarray, speed: float, boarding_time: float) -> None:
+        # pickup_windows, dropoff_windows: [earliest, latest] per request
+        self.num_requests = travel_requests.num_requests
+        self.boarding_time = boarding_time
+
+        self.origins = travel_requests.request_origins
+        self.destinations = travel_requests.request_destinations
+        self.ascending = self.origins < self.destinations
+
+        pickup_windows = np.asarray(pickup_windows, dtype=float).reshape(-1, 2)
+        dropoff_windows = np.asarray(dropoff_windows, dtype=float).reshape(-1, 2)
+        # per request and stop (pick-up, drop-off)
+        self.stations = np.stack([self.origins, self.destinations], axis=1)
+        self.earliest = np.stack([pickup_windows[:,0], dropoff_windows[:,0]], axis=1)
+        self.latest = np.stack([pickup_windows[:,1], dropoff_windows[:,1]], axis=1)
+
+        self.travel_times = self._shortest_travel_times(travel_requests.distances) * speed
+
+    def _shortest_travel_times(self, distances: np.ndarray) -> np.ndarray:
+        # with shortcuts the distances need not be a metric, a bus may be faster via other stations. station 0 does not exist
+        times = np.array(distances, dtype=float)
+        stations = np.arange(1, len(times))
+        inner = times[1:,1:]
+        np.fill_diagonal(inner, 0)
+        for k in range(len(inner)):
+            inner = np.minimum(inner, inner[:, k, None] + inner[None, k, :])
+        times[np.ix_(stations, stations)] = inner
+        return times
+
+    def _pair_stops(self, rows: np.ndarray) -> tuple:
+        # station, earliest and latest time of the four stops of all pairs (p,r) with p in rows, shape (len(rows), num_requests, 4)
+        columns = np.arange(self.num_requests)
+        shape = (len(rows), self.num_requests, 2)
+        stops = []
+        for attribute in [self.stations, self.earliest, self.latest]:
+            stops.append(np.concatenate([np.broadcast_to(attribute[rows, None, :], shape), np.broadcast_to(attribute[None, columns, :], shape)], axis=2))
+        return tuple(stops)
+
+    def _sequence_is_feasible(self, stations: np.ndarray, earliest: np.ndarray, latest: np.ndarray) -> np.ndarray:
+        # earliest time of each stop when the stops are visited in the order of the last axis
+        time = earliest[..., 0]
+        feasible = time <= latest[..., 0] + EPSILON
+        for k in range(1, stations.shape[-1]):
+            previous, current = stations[..., k-1], stations[..., k]
+            separation = np.where(previous != current, self.boarding_time + self.travel_times[previous, current], 0)
+            time = np.maximum(earliest[..., k], time + separation)
+            feasible &= time <= latest[..., k] + EPSILON
+        return feasible
+
+    def vehicle_conflicts(self) -> np.ndarray:
+        # conflicts[p,r]: no vehicle can serve p and r, in any order
+        conflicts = np.zeros((self.num_requests, self.num_requests), dtype=bool)
+        for start in range(0, self.num_requests, BLOCK_SIZE):
+            rows = np.arange(start, min(start + BLOCK_SIZE, self.num_requests))
+            stations, earliest, latest = self._pair_stops(rows)
+            feasible = np.zeros(stations.shape[:2], dtype=bool)
+            for order in STOP_ORDERS:
+                order = list(order)
+                feasible |= self._sequence_is_feasible(stations[..., order], earliest[..., order], latest[..., order])
+            conflicts[rows] = ~feasible
+        np.fill_diagonal(conflicts, False)
+        return conflicts
+
+    def service_conflicts(self) -> np.ndarray:
+        # conflicts[p,r]: p and r cannot share a service. a service visits the stations in the order of its direction,
+        # stops at the same station in the order of their earliest time. requests of opposite directions always conflict
+        conflicts = np.zeros((self.num_requests, self.num_requests), dtype=bool)
+        for start in range(0, self.num_requests, BLOCK_SIZE):
+            rows = np.arange(start, min(start + BLOCK_SIZE, self.num_requests))
+            stations, earliest, latest = self._pair_stops(rows)
+            position = np.where(self.ascending[rows, None, None], stations, -stations)
+            order = np.lexsort((earliest, position), axis=-1)
+            feasible = self._sequence_is_feasible(np.take_along_axis(stations, order, axis=-1), np.take_along_axis(earliest, order, axis=-1),
+                                                  np.take_along_axis(latest, order, axis=-1))
+            feasible &= self.ascending[rows, None] == self.ascending[None, :]
+            conflicts[rows] = ~feasible
+        np.fill_diagonal(conflicts, False)
+        return conflicts
+
+    def maximal_cliques(self, conflicts: np.ndarray, requests: Optional[List[int]] = None) -> List[List[int]]:
+        # maximal cliques with at least two requests (Bron-Kerbosch with pivoting), restricted to the given requests
+        if requests is None:
+            requests = range(self.num_requests)
+        requests = list(requests)
+        sub_conflicts = conflicts[np.ix_(requests, requests)]
+        neighbours = {requests[a]: {requests[b] for b in np.flatnonzero(sub_conflicts[a])} for a in range(len(requests))}
+
+        cliques = []
+        stack = [(set(), {r for r in requests if neighbours[r]}, set())]
+        while stack and (len(cliques) < MAX_CLIQUES):
+            clique, candidates, excluded = stack.pop()
+            if not candidates and not excluded:
+                cliques.append(sorted(clique))
+                continue
+            pivot = max(candidates | excluded, key=lambda r: len(neighbours[r] & candidates))
+            for r in list(candidates - neighbours[pivot]):
+                stack.append((clique | {r}, candidates & neighbours[r], excluded & neighbours[r]))
+                candidates.remove(r)
+                excluded.add(r)
+        return [clique for clique in cliques if len(clique) >= 2]
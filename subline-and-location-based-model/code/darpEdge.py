@@ -10,12 +10,13 @@ class DarpEdge:
         self._set_direction()
     
     def _set_direction(self) -> None:
-        if self._from.direction != self._to.direction:
+        from_direction, to_direction = self._from.direction, self._to.direction
+        if from_direction != to_direction:
             self.direction = "T"
-        elif self._from.direction is not None:
-            self.direction = self._from.direction
-        elif self._to.direction is not None:
-            self.direction = self._to.direction
+        elif from_direction is not None:
+            self.direction = from_direction
+        elif to_direction is not None:
+            self.direction = to_direction
         else:
             self.direction = None
 
@@ -1,6 +1,6 @@
 from util import *
 from travelRequests import TravelRequests
-from darpNode import DarpNode
+from darpNode import DarpNode, DarpNodeTable, TYPE_CODES, DIRECTION_CODES
 from darpEdge import DarpEdge
 
 class DarpGraph:
@@ -15,7 +15,7 @@ class DarpGraph:
         self.num_bus_stations = travel_requests.num_stations
         self.max_time = max_time
 
-        self.time_windows = travel_requests.generate_time_windows(travel_speed = speed, boarding_time = boarding_time,
+        self.time_windows = travel_requests.time_window_arrays(travel_speed = speed, boarding_time = boarding_time,
                                                                   max_time = max_time, alpha = alpha, beta = beta)
         self.distances = travel_requests.distances
         self.request_direct_distances = travel_requests.direct_distances
@@ -31,11 +31,9 @@ class DarpGraph:
 
         self.request_nodes = self.P + self.D + self.P_bar + self.D_bar
 
-        self.nodes = self.request_nodes + [self.start_depot, self.end_depot]
-
-        self._set_names()
         self.nodes_by_label = {i.name : i for i in self.nodes}
 
+        self._calculate_pair_table()
         self.generate_edges()
         self.eliminate_infeasible_edges()
         self._generate_edge_distances()
@@ -50,107 +48,98 @@ class DarpGraph:
         self.num_nodes = 4*self.num_requests + 2
 
     def generate_new_node_groups(self):
-        self.P = []
-        self.D = []
-        self.P_bar = []
-        self.D_bar = []
-        self.F = []
-        self.R = []
-
-        for idx, request in enumerate(self.travel_requests):
-            # (extended) physical stations
-            origin_station, destination_station = request[:2]
-            extended_origin_station = 2*self.num_bus_stations - origin_station + 1
-            extended_destination_station = 2*self.num_bus_stations - destination_station + 1
-
-            if origin_station < destination_station:
-                origin = DarpNode(darp_station = origin_station, bus_station = origin_station, type = "o", corresponding_request=idx, direction = "F")
-                destination = DarpNode(darp_station = destination_station, bus_station=destination_station, type = "d", corresponding_request=idx, direction = "F")
-                origin_bar = DarpNode(darp_station=extended_origin_station, bus_station=origin_station, type="o_bar", corresponding_request=idx, direction = "R")
-                destination_bar = DarpNode(darp_station=extended_destination_station, bus_station=destination_station, type="d_bar", corresponding_request=idx, direction = "R")
-
-                self.F += [origin, destination]
-                self.R += [origin_bar, destination_bar]
-
-            elif origin_station > destination_station:
-                origin = DarpNode(darp_station=extended_origin_station, bus_station=origin_station, type = "o", corresponding_request=idx, direction = "R")
-                destination = DarpNode(darp_station=extended_destination_station, bus_station=destination_station, type = "d", corresponding_request=idx, direction = "R")
-                origin_bar = DarpNode(darp_station=origin_station, bus_station=origin_station, type = "o_bar", corresponding_request=idx, direction = "F")
-                destination_bar = DarpNode(darp_station=destination_station, bus_station=destination_station, type = "d_bar", corresponding_request=idx, direction = "F")
-
-                self.F += [origin_bar, destination_bar]
-                self.R += [origin, destination]
-
-            elif origin_station == destination_station:
-                # add to F per default, but notify user
-                warnings.warn("Request {0} has same origin and destination at {1}. Added to F per default".format(idx, origin_station))
-                origin = DarpNode(darp_station=origin_station, bus_station = origin_station, type = "o", corresponding_request=idx, direction = "F")
-                destination = DarpNode(darp_station=destination_station, bus_station=destination_station, type = "d", corresponding_request=idx, direction = "F")
-                origin_bar = DarpNode(darp_station=extended_origin_station, bus_station=origin_station, type="o_bar", corresponding_request=idx, direction = "R")
-                destination_bar = DarpNode(darp_station=extended_destination_station, bus_station=destination_station, type="d_bar", corresponding_request=idx, direction = "R")
-
-                self.F += [origin, destination]
-                self.R += [origin_bar, destination_bar]
-                
-            self.P.append(origin)
-            self.D.append(destination)
-            self.P_bar.append(origin_bar)
-            self.D_bar.append(destination_bar)
-
-    def _set_names(self):
-        for idx, node in enumerate(self.nodes):
-            node.name = idx                         
+        # all nodes are rows of one DarpNodeTable (row = name), the node lists hold views on it
+        n = self.num_requests
+        self.node_table = DarpNodeTable(self.num_nodes)
+        self.nodes = [DarpNode(self.node_table, idx) for idx in range(self.num_nodes)]
+
+        # (extended) physical stations
+        requests = np.arange(n)
+        origin_stations = np.array([request[ORIGIN_IDX] for request in self.travel_requests], dtype=np.int64).reshape(-1)
+        destination_stations = np.array([request[DESTINATION_IDX] for request in self.travel_requests], dtype=np.int64).reshape(-1)
+        extended_origin_stations = 2*self.num_bus_stations - origin_stations + 1
+        extended_destination_stations = 2*self.num_bus_stations - destination_stations + 1
+
+        for idx in np.flatnonzero(origin_stations == destination_stations):
+            # add to F per default, but notify user
+            warnings.warn("Request {0} has same origin and destination at {1}. Added to F per default".format(idx, origin_stations[idx]))
+        forward = origin_stations <= destination_stations
+        direction = np.where(forward, DIRECTION_CODES["F"], DIRECTION_CODES["R"])
+        direction_bar = np.where(forward, DIRECTION_CODES["R"], DIRECTION_CODES["F"])
+
+        table = self.node_table
+        table.set_nodes(self.P_idx, np.where(forward, origin_stations, extended_origin_stations), origin_stations, requests, "o", direction)
+        table.set_nodes(self.D_idx, np.where(forward, destination_stations, extended_destination_stations), destination_stations, requests, "d", direction)
+        table.set_nodes(self.P_bar_idx, np.where(forward, extended_origin_stations, origin_stations), origin_stations, requests, "o_bar", direction_bar)
+        table.set_nodes(self.D_bar_idx, np.where(forward, extended_destination_stations, destination_stations), destination_stations, requests, "d_bar", direction_bar)
+
+        self.P = self.nodes[:n]
+        self.D = self.nodes[n:2*n]
+        self.P_bar = self.nodes[2*n:3*n]
+        self.D_bar = self.nodes[3*n:4*n]
+
+        # per request its two nodes of the direction, in the order of the requests
+        P_idx, D_idx, P_bar_idx, D_bar_idx = (np.array(indices, dtype=np.int64) for indices in [self.P_idx, self.D_idx, self.P_bar_idx, self.D_bar_idx])
+        forward_nodes = np.where(forward[:, None], np.stack([P_idx, D_idx], axis=1), np.stack([P_bar_idx, D_bar_idx], axis=1)).ravel()
+        reverse_nodes = np.where(forward[:, None], np.stack([P_bar_idx, D_bar_idx], axis=1), np.stack([P_idx, D_idx], axis=1)).ravel()
+        self.F = [self.nodes[idx] for idx in forward_nodes]
+        self.R = [self.nodes[idx] for idx in reverse_nodes]
 
     def generate_depots(self):
-        self.start_depot = DarpNode(darp_station=None, bus_station=None, type = "start_depot", corresponding_request=None, direction=None)
+        self.node_table.set_nodes(self.start_depot_idx, darp_station=None, bus_station=None, request=None, type="start_depot", direction=None)
+        self.start_depot = self.nodes[self.start_depot_idx]
         self.start_depot.e = 0
         self.start_depot.l = max([node.l for node in self.P]) - self.time_to_depots
 
-        self.end_depot = DarpNode(darp_station=None, bus_station=None, type = "end_depot", corresponding_request=None, direction=None)
+        self.node_table.set_nodes(self.end_depot_idx, darp_station=None, bus_station=None, request=None, type="end_depot", direction=None)
+        self.end_depot = self.nodes[self.end_depot_idx]
         self.end_depot.e = 0
         self.end_depot.l = max([node.l for node in self.D_bar]) + self.time_to_depots
 
     def _assign_time_to_stations(self):
-        for idx in range(self.num_requests):
-            request_origin_time_window, request_destination_time_window, service_promise_made = self.time_windows[idx]
+        table = self.node_table
+        origin_time_windows = self.time_windows["pick_up"]
+        destination_time_windows = self.time_windows["drop_off"]
+        service_promises_made = self.time_windows["service_promise"]
 
-            self.P[idx].e = request_origin_time_window[0]
-            self.P[idx].l = request_origin_time_window[1]
-            if service_promise_made[0]:
-                self.P[idx].has_departure_service_promise = True
+        table.e[self.P_idx] = origin_time_windows[:, 0]
+        table.l[self.P_idx] = origin_time_windows[:, 1]
+        table.has_departure_service_promise[self.P_idx] = service_promises_made[:, 0]
 
-            self.D[idx].e = request_destination_time_window[0]
-            self.D[idx].l = request_destination_time_window[1]
-            if service_promise_made[1]:
-                self.D[idx].has_arrival_service_promise = True
+        table.e[self.D_idx] = destination_time_windows[:, 0]
+        table.l[self.D_idx] = destination_time_windows[:, 1]
+        table.has_arrival_service_promise[self.D_idx] = service_promises_made[:, 1]
 
-            self.P_bar[idx].e = max(0, request_origin_time_window[0] - self.t_turn)
-            self.P_bar[idx].l = request_origin_time_window[1] - self.t_turn
+        table.e[self.P_bar_idx] = np.maximum(0, origin_time_windows[:, 0] - self.t_turn)
+        table.l[self.P_bar_idx] = origin_time_windows[:, 1] - self.t_turn
 
-            self.D_bar[idx].e = request_destination_time_window[0] + self.boarding_time + self.t_turn
-            self.D_bar[idx].l = min(self.max_time, request_destination_time_window[1] + self.boarding_time + self.t_turn)
+        table.e[self.D_bar_idx] = destination_time_windows[:, 0] + self.boarding_time + self.t_turn
+        table.l[self.D_bar_idx] = np.minimum(self.max_time, destination_time_windows[:, 1] + self.boarding_time + self.t_turn)
 
     def _add_edge(self, u, v) -> None:
-        edge = DarpEdge(u,v)
-        if edge.label not in self.edge_labels:
-            self.edge_labels.add(edge.label)
-            self.edges.append(edge)
+        if v.name not in self.successors[u.name]:
+            edge = DarpEdge(u,v)
+            self.successors[u.name][v.name] = edge
+            self.predecessors[v.name][u.name] = edge
             self.edges_by_label[edge.label] = edge
 
-    def _remove_edge(self, u, v):
-        for edge in self.edges:
-            if edge == (u,v):
-                self.edges.remove(edge)
-                self.edge_labels.remove(edge.label)
+    def _remove_edge(self, u, v) -> None:
+        edge = self.successors[u.name].pop(v.name, None)
+        if edge is not None:
+            del self.predecessors[v.name][u.name]
+            del self.edges_by_label[edge.label]
 
     def generate_edges(self):
-        self.edges = []
-        self.edge_labels = set()
+        # adjacency keyed by node name, edges_by_label keeps the insertion order of the edges
+        self.successors = {node.name: {} for node in self.nodes}
+        self.predecessors = {node.name: {} for node in self.nodes}
         self.edges_by_label = {}
 
+        attributes = self._node_attributes(self.nodes)
+        infeasible = self._time_infeasibility_mask(attributes, np.array(self.P_idx, dtype=np.int64), np.array(self.D_idx, dtype=np.int64))
+        if infeasible.any():
+            raise ValueError("The edge connecting origin and destination of request {0} is time infeasible.".format(np.flatnonzero(infeasible)[0]))
         for request_idx in range(self.num_requests):
-            if self._is_time_infeasible(self.nodes_by_label[request_idx], self.nodes_by_label[self.D_idx[request_idx]]):
-                raise ValueError("The edge connecting origin and destination of request {0} is time infeasible.".format(request_idx))
             self._add_edge(self.nodes_by_label[request_idx], self.nodes_by_label[self.D_idx[request_idx]])
 
         self._add_preceeding_edges(self.R)
@@ -173,95 +162,138 @@ class DarpGraph:
         for (d, d_bar) in zip (self.D, self.D_bar):
             self._add_edge(d, d_bar)
 
-        for (v,w) in itertools.combinations(self.P,2):
-            if v == w:
-                if v.e < w.e:
-                    self._add_edge(v, w)
-                elif v.e > w.e:
-                    self._add_edge(w, v)
-
-        for (v,w) in itertools.combinations(self.D, 2):
-            if v == w:
-                if v.l < w.l:
-                    self._add_edge(v, w)
-                elif v.l > w.l:
-                    self._add_edge(w, v)
+        self._add_edges_between_requests_at_same_station(self.P, key = "e")
+        self._add_edges_between_requests_at_same_station(self.D, key = "l")
+
+    def _node_attributes(self, vertices):
+        # columns of the node table for the given nodes, used to screen all pairs at once
+        rows = np.fromiter((v.name for v in vertices), dtype=np.int64, count=len(vertices))
+        table = self.node_table
+        return {"darp_station": table.darp_station[rows],
+                "bus_station": table.bus_station[rows],
+                "request": table.request[rows],
+                "direction": table.direction[rows],
+                "type": table.type[rows],
+                "depot": table.is_depot(rows),
+                "service_time": table.service_time(self.boarding_time, rows),
+                "e": table.e[rows],
+                "l": table.l[rows]}
+
+    def _travel_time_between(self, attributes, v_idx, w_idx):
+        # counterpart of travel_time for arrays of node indices
+        same_direction = attributes["direction"][v_idx] == attributes["direction"][w_idx]
+        distances = self.distances[attributes["bus_station"][v_idx], attributes["bus_station"][w_idx]]
+        travel_times = np.where(same_direction, distances * self.speed, self.t_turn)
+        return np.where(attributes["depot"][v_idx] | attributes["depot"][w_idx], 0, travel_times)
+
+    def _time_infeasibility_mask(self, attributes, v_idx, w_idx):
+        # the arc (v,w) cannot be used in time: earliest start at v plus service and travel time is after the latest start at w
+        return (attributes["e"][v_idx] + attributes["service_time"][v_idx] + self._travel_time_between(attributes, v_idx, w_idx)) > attributes["l"][w_idx]
+
+    def _time_feasibility_mask(self, attributes):
+        # all pairs of the given nodes
+        nodes = np.arange(len(attributes["type"]))
+        return ~self._time_infeasibility_mask(attributes, nodes[:, None], nodes[None, :])
+
+    def _add_edges_from_mask(self, vertices, mask):
+        # arcs ruled out by the pair table are not created, eliminate_infeasible_edges would remove them again
+        v_idx, w_idx = np.nonzero(mask)
+        names = np.fromiter((v.name for v in vertices), dtype=np.int64, count=len(vertices))
+        kept = ~self._dominated_mask(self._node_attributes(self.nodes), names[v_idx], names[w_idx])
+        for (v, w) in zip(v_idx[kept], w_idx[kept]):
+            self._add_edge(vertices[v], vertices[w])
 
     def _add_preceeding_edges(self, vertices):
-        for (v,w) in itertools.permutations(vertices, 2):
-            if (v.type != "o_bar") and (w.type != "d_bar") and (v < w) and (not self._is_time_infeasible(v,w)) and (v.request != w.request):
-                self._add_edge(v, w)
+        attributes = self._node_attributes(vertices)
+        mask = (attributes["type"] != TYPE_CODES["o_bar"])[:, None] & (attributes["type"] != TYPE_CODES["d_bar"])[None, :]
+        mask &= attributes["darp_station"][:, None] < attributes["darp_station"][None, :]
+        mask &= attributes["request"][:, None] != attributes["request"][None, :]
+        mask &= self._time_feasibility_mask(attributes)
+        self._add_edges_from_mask(vertices, mask)
 
     def _add_edges_at_same_station(self, vertices):
-        for (v,w) in itertools.permutations(vertices, 2):
-            if (v.type != "o_bar") and (w.type != "d_bar") and not (v.type == "o" and w.type == "d") and (v == w) and (not self._is_time_infeasible(v,w)) and (v.request != w.request):
-                self._add_edge(v,w)
+        attributes = self._node_attributes(vertices)
+        mask = (attributes["type"] != TYPE_CODES["o_bar"])[:, None] & (attributes["type"] != TYPE_CODES["d_bar"])[None, :]
+        mask &= ~((attributes["type"] == TYPE_CODES["o"])[:, None] & (attributes["type"] == TYPE_CODES["d"])[None, :])
+        mask &= attributes["darp_station"][:, None] == attributes["darp_station"][None, :]
+        mask &= attributes["request"][:, None] != attributes["request"][None, :]
+        mask &= self._time_feasibility_mask(attributes)
+        self._add_edges_from_mask(vertices, mask)
+
+    def _add_edges_between_requests_at_same_station(self, vertices, key: str):
+        # nodes of the same type at the same station are ordered by their time window
+        attributes = self._node_attributes(vertices)
+        times = attributes[key]
+        mask = np.triu(attributes["darp_station"][:, None] == attributes["darp_station"][None, :], k = 1)
+        mask &= times[:, None] != times[None, :]
+        for (v_idx, w_idx) in zip(*np.nonzero(mask)):
+            if times[v_idx] < times[w_idx]:
+                self._add_edge(vertices[v_idx], vertices[w_idx])
+            else:
+                self._add_edge(vertices[w_idx], vertices[v_idx])
 
     def eliminate_infeasible_edges(self):
-        for (i,j) in self.edges:
-            if self._is_time_infeasible(i,j):
-                self._remove_edge(i,j)
-
-        for o in self.P:
-            # arcs (i,j) and (j, i+n) removed if infeasible
-            all_outgoing_edges = [(i,j) for (i,j) in self.edges if i.name == o]
-            for (i,j) in all_outgoing_edges:
-                if (self.travel_time(i,j) + self.boarding_time + self.travel_time(j, self.M+i) > self.max_time):
-                    self._remove_edge(i,j)
-                    self._remove_edge(j, self.M + i)
-            
-            # arcs (i, n+j) removed if j -> i -> n+j -> n+i infeasible
-            all_edges_to_dropoffs = [(i,j) for (i,j) in self.edges if (i.name == o) and (j.type == "d")]
-            for (i,j_dropoff) in all_edges_to_dropoffs:
-                j = self.nodes_by_label[j_dropoff.request]
-                i_dropoff = self.nodes_by_label[i.name + self.M]
-                path = (j, i, j_dropoff, i_dropoff)
-                if self._path_is_infeasible(path): 
-                    self._remove_edge(i, j_dropoff)
-
-            # arcs (i,j) removed if (i -> j -> n+i -> n+j) and (i -> j -> n+j -> n+i) ininfeasible
-            all_edges_to_pickups = [(i,j) for (i,j) in self.edges if (i.name == o) and (j.type == "o")]
-            for (i,j) in all_edges_to_pickups:
-                i_dropoff = self.nodes_by_label[i.name + self.M]
-                j_dropoff = self.nodes_by_label[j.name + self.M]
-                path_1 = (i,j,i_dropoff,j_dropoff)
-                path_2 = (i,j,j_dropoff,i_dropoff)
-                if self._path_is_infeasible(path_1) and self._path_is_infeasible(path_2):
-                    self._remove_edge(i,j)
-
-            # arcs (n+i, j) removed if i -> i+n -> j -> j+n infeasible
-            all_edges_from_dropoffs = [(i,j) for (i,j) in self.edges if (j.name == o) and (i.type == "d")]
-            for (i_dropoff,j) in all_edges_from_dropoffs:
-                i = self.nodes_by_label[i_dropoff.request]
-                j_dropoff = self.nodes_by_label[j.name + self.M]
-                path = (i, i_dropoff, j, j_dropoff)
-                if self._path_is_infeasible(path):
-                    self._remove_edge(i_dropoff, j)
-        
-        for d in self.D:
-            # arcs (n+i, n+j) removed if (i->j->n+i->n+j) and (j->i->n+i->n+j) infeasible
-            all_edges_to_dropoffs = [(i,j) for (i,j) in self.edges if (i.name == d) and (j.type == "d")]
-            for (i_dropoff, j_dropoff) in all_edges_to_dropoffs:
-                i = self.nodes_by_label[i_dropoff.request]
-                j = self.nodes_by_label[j_dropoff.request]
-                path_1 = (i,j,i_dropoff,j_dropoff)
-                path_2 = (j,i,i_dropoff,j_dropoff)
-                if self._path_is_infeasible(path_1) and self._path_is_infeasible(path_2):
-                    self._remove_edge(i_dropoff, j_dropoff)
-
-    def _path_is_infeasible(self, path):
-        T = [path[0].e]
-        for idx in range(1, len(path) - 1):
-            start, end = path[idx, idx+1]
-            T_start = max(end.e, T[-1] + self.boarding_time + self.travel_time(start, end))
-            if T_start > end.l: return True
-        return False
-            
-    def _is_time_infeasible(self, i, j):
-        if i.type in ["o", "d"]:
-            return (i.e + self.boarding_time + self.travel_time(i,j)) > j.l
-        else:
-            return (i.e + self.travel_time(i,j)) > j.l
+        labels = list(self.edges_by_label)
+        attributes = self._node_attributes(self.nodes)
+        u, v = (np.fromiter((label[idx] for label in labels), dtype=np.int64, count=len(labels)) for idx in range(2))
+        infeasible = self._time_infeasibility_mask(attributes, u, v) | self._dominated_mask(attributes, u, v)
+        for idx in np.flatnonzero(infeasible):
+            self._remove_edge(*self.edges_by_label[labels[idx]])
+
+    def _calculate_pair_table(self):
+        # earliest-arrival propagation along the classic DARP paths, for all pairs of requests at once
+        attributes = self._node_attributes(self.request_nodes)
+        n = self.num_requests
+        i, j = np.arange(n)[:, None], np.arange(n)[None, :]
+        request_nodes = np.arange(len(self.request_nodes))[None, :]
+
+        self.pair_table = {
+            "i,j,n+i,n+j": self._path_is_feasible(attributes, (i, j, n+i, n+j)),
+            "i,j,n+j,n+i": self._path_is_feasible(attributes, (i, j, n+j, n+i)),
+            "i,n+i,j,n+j": self._path_is_feasible(attributes, (i, n+i, j, n+j)),
+            "i,v,n+i": self._path_is_feasible(attributes, (i, request_nodes, n+i)) # v is any request node
+        }
+
+        # requests i and j can be served by the same vehicle in at least one order
+        self.pair_compatibility = self.pair_table["i,j,n+i,n+j"] | self.pair_table["i,j,n+j,n+i"] | self.pair_table["i,n+i,j,n+j"]
+        self.pair_compatibility |= self.pair_compatibility.T
+        np.fill_diagonal(self.pair_compatibility, True)
+
+    def _path_is_feasible(self, attributes, path) -> np.ndarray:
+        # path is a sequence of (broadcastable) node index arrays
+        T_start = attributes["e"][path[0]]
+        feasible = np.ones(np.broadcast_shapes(*[np.shape(v) for v in path]), dtype=bool)
+        for start, end in zip(path[:-1], path[1:]):
+            T_start = np.maximum(attributes["e"][end], T_start + attributes["service_time"][start] + self._travel_time_between(attributes, start, end))
+            feasible &= T_start <= attributes["l"][end]
+        return feasible
+
+    def _dominated_mask(self, attributes, u, v) -> np.ndarray:
+        # arcs (u,v) that cannot be part of any feasible route according to the pair table
+        n = self.num_requests
+        request_arc = ~(attributes["depot"][u] | attributes["depot"][v])
+        # the depots index row / column 0 of the pair table, their arcs are never dominated
+        u, v = np.where(request_arc, u, 0), np.where(request_arc, v, 0)
+        i, j = attributes["request"][u], attributes["request"][v]
+        u_type, v_type = attributes["type"][u], attributes["type"][v]
+        o, d = TYPE_CODES["o"], TYPE_CODES["d"]
+        via_v = self.pair_table["i,v,n+i"]
+        ij_in_order, ij_crossed, ij_one_after_another = self.pair_table["i,j,n+i,n+j"], self.pair_table["i,j,n+j,n+i"], self.pair_table["i,n+i,j,n+j"]
+
+        # i -> v -> n+i infeasible
+        dominated = (u_type == o) & (v != i + n) & ~via_v[i, v]
+        # j -> u -> n+j infeasible
+        dominated |= (v_type == d) & (u != j) & ~via_v[j, u]
+        # i -> j -> n+i -> n+j and i -> j -> n+j -> n+i infeasible
+        between_requests = (u_type == o) & (v_type == o) & ~(ij_in_order[i,j] | ij_crossed[i,j])
+        # j -> i -> n+j -> n+i infeasible
+        between_requests |= (u_type == o) & (v_type == d) & ~ij_in_order[j,i]
+        # i -> n+i -> j -> n+j infeasible
+        between_requests |= (u_type == d) & (v_type == o) & ~ij_one_after_another[i,j]
+        # i -> j -> n+i -> n+j and j -> i -> n+i -> n+j infeasible
+        between_requests |= (u_type == d) & (v_type == d) & ~(ij_in_order[i,j] | ij_crossed[j,i])
+        dominated |= (i != j) & between_requests
+        return request_arc & dominated
 
     def travel_time(self, v: DarpNode, w: DarpNode):
         if (v == self.start_depot) or (w == self.end_depot):
@@ -278,8 +310,14 @@ class DarpGraph:
             return self.distances[v.bus_station][w.bus_station]
         
     def _generate_edge_distances(self):
-        for e in self.edges:
-            e.distance = self.travel_distance(e._from, e._to)
+        # counterpart of travel_distance for all edges at once
+        edges = list(self.edges_by_label.values())
+        table = self.node_table
+        u, v = (np.fromiter((label[idx] for label in self.edges_by_label), dtype=np.int64, count=len(edges)) for idx in range(2))
+        driving = ~(table.is_depot(u) | table.is_depot(v)) & (table.direction[u] == table.direction[v])
+        distances = np.where(driving, self.distances[table.bus_station[u], table.bus_station[v]], 0).tolist()
+        for e, distance in zip(edges, distances):
+            e.distance = distance
     
     def get_directional_nodesets(self, as_labels = False):
         if as_labels:
@@ -287,8 +325,27 @@ class DarpGraph:
         else:
             return self.F, self.R
     
+    def get_successors(self, v: DarpNode, type: Optional[str] = None) -> List[DarpNode]:
+        return [self.nodes_by_label[j] for j in self.successors[v.name] if (type is None) or (self.nodes_by_label[j].type == type)]
+
+    def get_predecessors(self, v: DarpNode, type: Optional[str] = None) -> List[DarpNode]:
+        return [self.nodes_by_label[i] for i in self.predecessors[v.name] if (type is None) or (self.nodes_by_label[i].type == type)]
+
+    def get_adjacency(self):
+        # outgoing and incoming neighbours per node, given as labels
+        return {i: list(neighbours) for i, neighbours in self.successors.items()}, \
+               {j: list(neighbours) for j, neighbours in self.predecessors.items()}
+
+    def get_csr(self):
+        # compressed sparse row export: the successors of node i are indices[indptr[i]:indptr[i+1]]
+        indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(self.successors[i]) for i in range(self.num_nodes)])
+        indices = np.fromiter((j for i in range(self.num_nodes) for j in self.successors[i]), dtype=np.int64, count=indptr[-1])
+        distances = np.fromiter((e.distance for i in range(self.num_nodes) for e in self.successors[i].values()), dtype=float, count=indptr[-1])
+        return indptr, indices, distances
+
     def get_edge_distances(self):
-        return {e.label: e.distance for e in self.edges}
+        return {label: e.distance for label, e in self.edges_by_label.items()}
     
     def get_edges(self):
-        return [e.label for e in self.edges]
\ No newline at end of file
+        return list(self.edges_by_label)
@@ -2,6 +2,8 @@ from util import *
 from model import Model
 from darpGraph import DarpGraph
 from travelRequests import TravelRequests
+from insertionHeuristic import PICKUP
+from conflictGraph import ConflictGraph
 
 class DARPModel(Model):
     def __init__(self, boarding_time = 3, *args, **kwargs):
@@ -10,7 +12,7 @@ class DARPModel(Model):
         super().__init__(*args, **kwargs)
 
     def _initModel(self): 
-        return gp.Model(self.name)
+        return gp.Model(self.name, env=self.env)
 
     def _calculateConstants(self):
         self.n = self.requests.num_requests
@@ -20,6 +22,7 @@ class DARPModel(Model):
         self.nodes = Graph.nodes
         self.asc_nodes, self.desc_nodes = Graph.get_directional_nodesets(as_labels=True)
         self.edges = Graph.get_edges()
+        self.outgoing_nodes, self.incoming_nodes = Graph.get_adjacency()
 
         # calculate parameters
         self.K = range(self.num_busses)
@@ -39,9 +42,10 @@ class DARPModel(Model):
         assert self.num_busses > 0
 
         # define subsets of edges
+        asc_nodes, desc_nodes = set(self.asc_nodes), set(self.desc_nodes)
         self.edges_from_P_to_HR = [(i,j) for (i,j) in self.edges if (i in self.P) and (j in self.H_R)]
-        self.turn_edges = [(i,j) for (i,j) in self.edges if (i in self.asc_nodes) and 
-                       (j in self.desc_nodes)] + [(i,j) for (i,j) in self.edges if (i in self.desc_nodes) and (j in self.asc_nodes)] # turn-around edges
+        self.turn_edges = [(i,j) for (i,j) in self.edges if (i in asc_nodes) and 
+                       (j in desc_nodes)] + [(i,j) for (i,j) in self.edges if (i in desc_nodes) and (j in asc_nodes)] # turn-around edges
         self.edges_from_N_to_N = [(i,j) for (i,j) in self.edges if (i in self.N) and (j in self.N)]
 
         if len(self.edges_from_P_to_HR) == 0: raise ValueError("No edges from P to H_R found.")
@@ -57,17 +61,18 @@ class DARPModel(Model):
         # direct drive distance and time
         self.c = Graph.get_edge_distances()
         self.c_direct = Graph.request_direct_distances
-        self.t = {e: self.t_turn if e in self.turn_edges else self.c[e] * self.speed for e in self.c}
+        turn_edges = set(self.turn_edges)
+        self.t = {e: self.t_turn if e in turn_edges else self.c[e] * self.speed for e in self.c}
 
         # time windows
-        self.e = [node.e for node in Graph.nodes]
-        self.l = [node.l for node in Graph.nodes]
+        self.e = Graph.node_table.e.tolist()
+        self.l = Graph.node_table.l.tolist()
 
         # num pax boarding
         self.q = np.zeros(self.num_nodes_incl_depots)
         for i in self.P:
-            self.q[i] = 1 # P
-            self.q[i + self.n] = -1 # D
+            self.q[i] = self.requests.demands[i] # P
+            self.q[i + self.n] = -self.requests.demands[i] # D
 
         # service duration (only for stations in P and D)
         self.b = np.zeros(self.num_nodes_incl_depots) 
@@ -79,88 +84,313 @@ class DARPModel(Model):
         for i in self.P:
             self.L_max[i] = self.alpha * self.t[i, i+self.n]
 
-    def createModel(self, obj_weights:List[float], **kwargs):
+    def createModel(self, obj_weights:List[float], aggregate_vehicles: bool = False, linearization: Optional[str] = None, tighten_big_M: bool = False, warm_start: bool = False,
+                    lazy_constraints: bool = False, user_cuts: bool = False, clique_cuts: bool = False, **kwargs):
+        # lazy_constraints: the load and time precedence constraints along the arcs are separated in a callback, user_cuts: also at the tree nodes
+        # clique_cuts: at most one request of a set of pairwise conflicting requests per bus
         start_time = datetime.datetime.now()
         self.objWeights=obj_weights
+        self.aggregate_vehicles = aggregate_vehicles
+        self.familyBuildtimes = {}
+        self._setLazyConstraints(lazy_constraints, user_cuts)
+        if clique_cuts and aggregate_vehicles:
+            raise ValueError("Clique cuts need the arc variables per bus, they are not available with aggregate_vehicles.")
+
+        self._setLinearization(linearization)
+        if tighten_big_M:
+            self._tightenBigM()
 
         # define variables
-        self.x = self.model.addVars(self.edges, self.K, vtype=GRB.BINARY,name="x") # decision variable
+        if self.aggregate_vehicles:
+            self.x = self.model.addVars(self.edges, vtype=GRB.BINARY, name="x") # decision variable, aggregated over all busses
+            self.x[self.start_depot, self.end_depot].VType = GRB.INTEGER # number of unused busses
+            self.x[self.start_depot, self.end_depot].UB = self.num_busses
+            self.v = self.model.addVars(self.num_nodes, vtype=GRB.CONTINUOUS, name="v", ub=self.num_nodes) # label of the route visiting station i
+        else:
+            self.x = self.model.addVars(self.edges, self.K, vtype=GRB.BINARY,name="x") # decision variable
+            self.B_start_depot = self.model.addVars(self.K, vtype=GRB.CONTINUOUS, name = "B_delta_s", ub = self.max_travel_minutes) # service start time for each bus at start depot
+            self.B_end_depot = self.model.addVars(self.K, vtype=GRB.CONTINUOUS, name = "B_delta_e", ub = self.max_travel_minutes) # service start time for each bus at end depot
         self.L = self.model.addVars(self.n, vtype=GRB.CONTINUOUS, name="L", ub=self.max_travel_minutes) # ride time of request i
         self.B = self.model.addVars(self.num_nodes_incl_depots, vtype=GRB.CONTINUOUS, name="B", ub=self.max_travel_minutes) # service start time at station i
-        self.B_start_depot = self.model.addVars(self.K, vtype=GRB.CONTINUOUS, name = "B_delta_s", ub = self.max_travel_minutes) # service start time for each bus at start depot
-        self.B_end_depot = self.model.addVars(self.K, vtype=GRB.CONTINUOUS, name = "B_delta_e", ub = self.max_travel_minutes) # service start time for each bus at end depot
         self.Q = self.model.addVars(self.num_nodes, vtype=GRB.CONTINUOUS, name="Q", ub=self.Q_max) # passenger load after departing station i
         self.z = self.model.addVars(self.K, vtype=GRB.BINARY, name="z") # if bus b is used or not
         
-        # define objective function
-        self._setObjective()
-
-        for o in self.N:
-            incoming_edges_to_o = [(i,j) for (i,j) in self.edges if j == o]
-            outgoing_edges_from_o = [(i,j) for (i,j) in self.edges if i == o]
-            for k in self.K:
-                self.model.addConstr((gp.quicksum(self.x[j,i,k] for (j,i) in incoming_edges_to_o) - gp.quicksum(self.x[i,j,k] for (i,j) in outgoing_edges_from_o)) == 0, name = "arc_flow_" + str(k)) # arc flow constr.
-
-            outgoing_nodes_from_o = [j for (i,j) in outgoing_edges_from_o]
-            self.model.addConstr(self.Q[o] <= self.Q_max * gp.quicksum(self.x[o,j,k] for j in outgoing_nodes_from_o for k in self.K), name = "ensure_empty_if_not_used") #ensure busses are empty if not driving
-            
-        for o in self.N:
-            incoming_nodes_to_o = [i for (i,j) in self.edges if j == o]
-            outgoing_nodes_from_o = [j for (i,j) in self.edges if i == o]
-
-            max_for_lower_bound_on_B_per_j = {j: max(0, self.e[j] - self.e[o] + self.b[j] + self.t[j,o]) for j in incoming_nodes_to_o}
-            self.model.addConstr(self.B[o] >= self.e[o] + gp.quicksum(max_for_lower_bound_on_B_per_j[j] * self.x[j,o,k] for j in incoming_nodes_to_o for k in self.K), name = "strenghten_lb_at_B") # strengthened lower bound on start of service time
-
-            max_for_upper_bound_on_B_per_j = {j: max(0, self.l[o] - self.l[j] + self.b[o] + self.t[o,j]) for j in outgoing_nodes_from_o}
-            self.model.addConstr(self.B[o] <= self.l[o] -  gp.quicksum(max_for_upper_bound_on_B_per_j[j] * self.x[o,j,k] for j in outgoing_nodes_from_o for k in self.K), name = "strenghten_ub_at_B") # strengthened upper bound on start of service time
+        self._calculateIncidences()
 
-        for (i,j) in self.turn_edges:
-            self.model.addConstr(self.Q[i] <= self.Q_max * (1 - gp.quicksum(self.x[i,j,k] for k in self.K)), name = "load_when_turning_is_zero_1") # load when turning is zero
-            self.model.addConstr(self.Q[i] >= -self.Q_max * (1 - gp.quicksum(self.x[i,j,k] for k in self.K)), name = "load_when_turning_is_zero_2") # load when turning is zero
-
-        for k in self.K[:-1]:
-            self.model.addConstr(self.z[k] >= self.z[k+1], name = "symm_breaking") # symmetry breaking
-
-        for o in self.P:
-            outgoing_edges = [(i,j) for (i,j) in self.edges if i == o]
-            self.model.addConstr(gp.quicksum(self.x[i,j,k] for (i,j) in outgoing_edges for k in self.K) <= 1, name = "serve_request_max_once")
-            self.model.addConstr(self.L[o] == self.B[o+self.n] - (self.B[o] + self.b[o]), name="ride_time") # ride time per request
-            self.model.addConstr(self.L[o] >= self.t[o, o+self.n], name = "min_ride_time") # min ride time
-            self.model.addConstr(self.L[o] <= self.L_max[o], name = "max_ride_time") # max. ride time
-
-        for (i,j) in self.edges_from_N_to_N:
-            self.model.addConstr(self.Q[j] >= (self.Q[i] + self.q[j]) * gp.quicksum(self.x[i,j,k] for k in self.K), name="load_when_leaving") # load upon leaving each station
-            self.model.addConstr(self.B[j] >= (self.B[i] + self.b[i] + self.t[i,j]) * gp.quicksum(self.x[i,j,k] for k in self.K), name="min_dep_time") # min departure time at each station
-
-        for k in self.K:
-            self.model.addConstr(gp.quicksum(self.x[self.start_depot,j,k] for j in self.stations_after_start_depot) == 1, name = "buses_leave_depot") # busses leave the depot
-            self.model.addConstr(gp.quicksum(self.x[i,self.end_depot,k] for i in self.stations_before_end_depot) == 1, name = "buses_enter_depot") # busses end at depot
-            self.model.addConstr(self.z[k] >= (1/(len(self.N)**2)) * gp.quicksum(self.x[i,j,k] for (i,j) in self.edges_from_N_to_N), name="connect_z") # connect variable z
-            self.model.addConstr(1 - gp.quicksum(self.x[i,j,k] for (i,j) in self.edges_from_N_to_N) <= self.big_M * self.x[self.start_depot, self.end_depot, k], name="ensure_depot_to_depot") # ensure bus only goes from start_depot to end_depot if no other node is visited
-            for o in self.P:
-                self.model.addConstr(gp.quicksum(self.x[i,j,k] for (i,j) in self.edges if i==o) - gp.quicksum(self.x[i,j,k] for (i,j) in self.edges if i==self.n+o) == 0, name = "pickup_and_deliver") # every customer picked up is also delivered
-                
-            for i in [*self.P, *self.P_bar]:
-                self.model.addConstr(self.Q[i] >= self.q[i] * self.x[self.start_depot, i, k], name = "load_leaving_depot") # load upon leaving start depot
-                self.model.addConstr(self.B[i] >= (self.B_start_depot[k] + self.b[self.start_depot] + self.t[self.start_depot, i]) * self.x[self.start_depot, i, k], name = "B_after_depot") # start of service time after leaving the start depot
+        # define objective function
+        with self._timeFamily("objective"):
+            self._setObjective()
+
+        with self._timeFamily("ensure_empty_if_not_used"):
+            self.model.addConstrs((self.Q[o] <= self.Q_max * self._arc_usage_sum(self.outgoing_edges[o]) for o in self.N), name = "ensure_empty_if_not_used") #ensure busses are empty if not driving
+
+        with self._timeFamily("strenghten_B"):
+            self.model.addConstrs((self.B[o] >= self.e[o] + self._arc_usage_sum(self.incoming_edges[o], [max(0, self.e[j] - self.e[o] + self.b[j] + self.t[j,o]) for (j,_) in self.incoming_edges[o]])
+                                   for o in self.N), name = "strenghten_lb_at_B") # strengthened lower bound on start of service time
+            self.model.addConstrs((self.B[o] <= self.l[o] - self._arc_usage_sum(self.outgoing_edges[o], [max(0, self.l[o] - self.l[j] + self.b[o] + self.t[o,j]) for (_,j) in self.outgoing_edges[o]])
+                                   for o in self.N), name = "strenghten_ub_at_B") # strengthened upper bound on start of service time
+
+        with self._timeFamily("load_when_turning_is_zero"):
+            for (i,j) in self.turn_edges:
+                self._addLazyConstr(self.Q[i] - self.Q_max * (1 - self._arc_usage(i,j)), name = "load_when_turning_is_zero_1") # load when turning is zero
+                self._addLazyConstr(-self.Q[i] - self.Q_max * (1 - self._arc_usage(i,j)), name = "load_when_turning_is_zero_2") # load when turning is zero
+
+        with self._timeFamily("symm_breaking"):
+            self.model.addConstrs((self.z[k] >= self.z[k+1] for k in self.K[:-1]), name = "symm_breaking") # symmetry breaking
+
+        with self._timeFamily("ride_time"):
+            self.model.addConstrs((self._arc_usage_sum(self.outgoing_edges[o]) <= 1 for o in self.P), name = "serve_request_max_once")
+            self.model.addConstrs((self.L[o] == self.B[o+self.n] - (self.B[o] + self.b[o]) for o in self.P), name="ride_time") # ride time per request
+            self.model.addConstrs((self.L[o] >= self.t[o, o+self.n] for o in self.P), name = "min_ride_time") # min ride time
+            self.model.addConstrs((self.L[o] <= self.L_max[o] for o in self.P), name = "max_ride_time") # max. ride time
+
+        with self._timeFamily("load_when_leaving"):
+            for (i,j) in self.edges_from_N_to_N:
+                self._addConditionalConstr(self._arc_variables(i,j), self.Q[j], self.Q[i] + self.q[j], 
+                                           big_M = self.Q_max + self.q[j], name="load_when_leaving", lazy=True) # load upon leaving each station
+        with self._timeFamily("min_dep_time"):
+            for (i,j) in self.edges_from_N_to_N:
+                self._addConditionalConstr(self._arc_variables(i,j), self.B[j], self.B[i] + self.b[i] + self.t[i,j], 
+                                           big_M = max(0, self.l[i] + self.b[i] + self.t[i,j] - self.e[j]), name="min_dep_time", lazy=True) # min departure time at each station
+
+        if self.aggregate_vehicles:
+            self._addAggregatedRoutingConstraints()
+        else:
+            self._addRoutingConstraints()
 
-            for i in [*self.D, *self.D_bar]:
-                self.model.addConstr(0 >= (self.Q[i] + self.q[self.end_depot]) * self.x[i, self.end_depot, k], name="load_entering_depot") # load upon entering end depot
-                self.model.addConstr(self.B_end_depot[k] >= (self.B[i] + self.b[i] + self.t[i, self.end_depot]) * self.x[i, self.end_depot, k], name = "B_entering_depot") # start of service time when entering the end depot
+        if clique_cuts:
+            with self._timeFamily("clique_cuts"):
+                self._addCliqueCuts()
 
         self.model.update()
+        self._prepareLazyConstraints()
 
         end_time = datetime.datetime.now()
         self.Buildtime = (end_time - start_time).total_seconds()
 
+        if warm_start:
+            self._warmStart()
+
+    def _addCliqueCuts(self):
+        conflict_graph = ConflictGraph(self.requests, pickup_windows=[(self.e[i], self.l[i]) for i in self.P], dropoff_windows=[(self.e[i], self.l[i]) for i in self.D],
+                                       speed=self.speed, boarding_time=self.boarding_time)
+        self.cliques = conflict_graph.maximal_cliques(conflict_graph.vehicle_conflicts())
+        for clique in self.cliques:
+            self.model.addConstrs((gp.quicksum(self.x[i,j,k] for o in clique for (i,j) in self.outgoing_edges[o]) <= 1 for k in self.K), name="clique")
+
+    def _warmStart(self):
+        self.heuristic = self._insertionHeuristic().solve()
+        self._setStartFromHeuristic(self.heuristic)
+
+    def _setStartFromHeuristic(self, heuristic):
+        # routing part of the MIP start, Gurobi completes the times and loads
+        routes = []
+        for legs in heuristic.routes:
+            if not legs:
+                continue
+            route = self._heuristicRoute(legs)
+            if any(edge not in self.arc_variables for edge in zip(route[:-1], route[1:])):
+                warnings.warn("A bus route of the insertion heuristic uses an edge which is not part of the graph, it is left out of the MIP start.")
+                continue
+            routes.append(route)
+
+        x_start = dict.fromkeys(self.x.keys(), 0)
+        if self.aggregate_vehicles:
+            for route in routes:
+                for (i,j) in zip(route[:-1], route[1:]):
+                    x_start[i,j] += 1
+            x_start[self.start_depot, self.end_depot] = self.num_busses - len(routes)
+        else:
+            for k in self.K:
+                for (i,j) in (zip(routes[k][:-1], routes[k][1:]) if k < len(routes) else [(self.start_depot, self.end_depot)]):
+                    x_start[i,j,k] = 1
+        self._setStartValues(self.x, x_start)
+        self._setStartValues(self.z, {k: int(k < len(routes)) for k in self.K})
+
+    def requestSchedule(self) -> dict:
+        schedule = {}
+        B = self._solutionValues(self.B).tolist()
+        for k, path in self._calculatePath().items():
+            for (i,j) in path:
+                if j in self.P:
+                    schedule[j] = (k, B[j], B[j + self.n])
+        return schedule
+
+    def _heuristicRoute(self, legs: List[tuple]) -> List[int]:
+        # nodes visited by one bus, the bus turns after a drop-off (d -> d_bar) or before a pick-up (o_bar -> o)
+        route = [self.start_depot]
+        for j, (direction, stops) in enumerate(legs):
+            if j > 0:
+                last_direction, last_stops = legs[j-1]
+                last_request, next_request = last_stops[-1][4], stops[0][4]
+                if direction == last_direction:
+                    route += [last_request + 3*self.n, next_request + 2*self.n]
+                elif (stops[0][0] * direction - last_stops[-1][0] * last_direction) * last_direction > 0:
+                    route.append(next_request + 2*self.n)
+                else:
+                    route.append(last_request + 3*self.n)
+            route += [r if kind == PICKUP else r + self.n for (_, kind, _, _, r) in stops]
+        route.append(self.end_depot)
+        return route
+
+    def _tightenBigM(self):
+        # propagate time windows along the arcs and ride times, all big M's below are computed from e and l. the per-arc big M's already
+        # use the node windows of the graph, which are nearly consistent: on the benchmark instances the propagation narrows only a few
+        # latest times, so in practice this option only replaces the big M of the depot-to-depot arc and leaves the root bound unchanged
+        e, l = self._propagateTimeWindows()
+        self.e = e.tolist()
+        self.l = l.tolist()
+
+        # at most one arc leaves the start depot per bus
+        self.big_M = 1
+
+    def _propagateTimeWindows(self):
+        e = np.array(self.e, dtype=float)
+        l = np.array(self.l, dtype=float)
+
+        # B_j >= B_i + b_i + t_ij if arc (i,j) is used, the busses leave and enter the depots during [0, max_travel_minutes]
+        edges = np.array(self.edges)
+        duration = self.b[edges[:,0]] + np.array([self.t[edge] for edge in self.edges])
+        depots = np.array([self.start_depot, self.end_depot])
+        e[depots] = 0
+        l[depots] = self.max_travel_minutes
+
+        # B_{n+i} - B_i lies in [b_i + t_{i,n+i}, b_i + L_max[i]] for every request, used or not
+        pickups = np.array(self.P)
+        dropoffs = pickups + self.n
+        min_ride = self.b[pickups] + np.array([self.t[i, i+self.n] for i in self.P])
+        max_ride = self.b[pickups] + self.L_max
+
+        for _ in range(self.num_nodes_incl_depots):
+            earliest_arrival = np.full(self.num_nodes_incl_depots, np.inf)
+            np.minimum.at(earliest_arrival, edges[:,1], e[edges[:,0]] + duration)
+            latest_departure = np.full(self.num_nodes_incl_depots, -np.inf)
+            np.maximum.at(latest_departure, edges[:,0], l[edges[:,1]] - duration)
+            earliest_arrival[depots] = -np.inf
+            latest_departure[depots] = np.inf
+
+            new_e = np.maximum(e, earliest_arrival)
+            new_l = np.minimum(l, latest_departure)
+            new_e[dropoffs] = np.maximum(new_e[dropoffs], new_e[pickups] + min_ride)
+            new_e[pickups] = np.maximum(new_e[pickups], new_e[dropoffs] - max_ride)
+            new_l[pickups] = np.minimum(new_l[pickups], new_l[dropoffs] - min_ride)
+            new_l[dropoffs] = np.minimum(new_l[dropoffs], new_l[pickups] + max_ride)
+
+            if np.array_equal(new_e, e) and np.array_equal(new_l, l):
+                break
+            e, l = new_e, new_l
+
+        # a request with an empty window cannot be served, its B's keep the original time windows
+        empty = np.zeros(self.num_nodes_incl_depots, dtype=bool)
+        empty[:self.num_nodes] = e[:self.num_nodes] > l[:self.num_nodes] + EPSILON
+        for requests in [pickups, dropoffs, pickups + 2*self.n, dropoffs + 2*self.n]:
+            empty[requests] |= empty[pickups] | empty[dropoffs] | empty[pickups + 2*self.n] | empty[dropoffs + 2*self.n]
+        empty[depots] = True
+        e[empty] = np.array(self.e, dtype=float)[empty]
+        l[empty] = np.array(self.l, dtype=float)[empty]
+        return e, l
+
+    def _calculateIncidences(self):
+        # variables of every edge and incoming / outgoing edges of every node, looked up once per model
+        if self.aggregate_vehicles:
+            self.arc_variables = {(i,j): [self.x[i,j]] for (i,j) in self.edges}
+        else:
+            self.arc_variables = {(i,j): [self.x[i,j,k] for k in self.K] for (i,j) in self.edges}
+        self.outgoing_edges = {o: [(o,j) for j in self.outgoing_nodes.get(o, [])] for o in self.H_R}
+        self.incoming_edges = {o: [(i,o) for i in self.incoming_nodes.get(o, [])] for o in self.H_R}
+
+    def _arc_usage(self, i, j):
+        # number of busses driving along edge (i,j)
+        return self._arc_usage_sum([(i,j)])
+
+    def _arc_usage_sum(self, edges: List[tuple], coefficients: List[float] = None):
+        # (weighted) number of busses driving along the given edges
+        if coefficients is None:
+            coefficients = itertools.repeat(1)
+        weights, variables = [], []
+        for edge, coefficient in zip(edges, coefficients):
+            weights += [coefficient] * len(self.arc_variables[edge])
+            variables += self.arc_variables[edge]
+        return gp.LinExpr(weights, variables)
+
+    def _arc_variables(self, i, j):
+        return self.arc_variables[i,j]
+
+    def _flow_balance(self, o, k):
+        # inflow - outflow of bus k at station o
+        incoming = [self.x[i,o,k] for (i,_) in self.incoming_edges[o]]
+        outgoing = [self.x[o,j,k] for (_,j) in self.outgoing_edges[o]]
+        return gp.LinExpr([1] * len(incoming) + [-1] * len(outgoing), incoming + outgoing)
+
+    def _addRoutingConstraints(self):
+        edge_variables_from_N_to_N = {k: [self.x[i,j,k] for (i,j) in self.edges_from_N_to_N] for k in self.K}
+
+        with self._timeFamily("arc_flow"):
+            self.model.addConstrs((self._flow_balance(o,k) == 0 for o in self.N for k in self.K), name = "arc_flow") # arc flow constr.
+
+        with self._timeFamily("depots"):
+            self.model.addConstrs((gp.quicksum(self.x[self.start_depot,j,k] for j in self.stations_after_start_depot) == 1 for k in self.K), name = "buses_leave_depot") # busses leave the depot
+            self.model.addConstrs((gp.quicksum(self.x[i,self.end_depot,k] for i in self.stations_before_end_depot) == 1 for k in self.K), name = "buses_enter_depot") # busses end at depot
+            self.model.addConstrs((self.z[k] >= (1/(len(self.N)**2)) * gp.LinExpr([1] * len(edge_variables_from_N_to_N[k]), edge_variables_from_N_to_N[k]) for k in self.K), name="connect_z") # connect variable z
+            self.model.addConstrs((1 - gp.LinExpr([1] * len(edge_variables_from_N_to_N[k]), edge_variables_from_N_to_N[k]) <= self.big_M * self.x[self.start_depot, self.end_depot, k] for k in self.K), 
+                                  name="ensure_depot_to_depot") # ensure bus only goes from start_depot to end_depot if no other node is visited
+
+        with self._timeFamily("pickup_and_deliver"):
+            self.model.addConstrs((gp.quicksum(self.x[o,j,k] for (_,j) in self.outgoing_edges[o]) - gp.quicksum(self.x[self.n+o,j,k] for (_,j) in self.outgoing_edges[self.n+o]) == 0 
+                                   for k in self.K for o in self.P), name = "pickup_and_deliver") # every customer picked up is also delivered
+
+        with self._timeFamily("leaving_depot"):
+            for k in self.K:
+                for i in [*self.P, *self.P_bar]:
+                    self.model.addConstr(self.Q[i] >= self.q[i] * self.x[self.start_depot, i, k], name = "load_leaving_depot") # load upon leaving start depot
+                    self._addConditionalConstr([self.x[self.start_depot, i, k]], self.B[i], self.B_start_depot[k] + self.b[self.start_depot] + self.t[self.start_depot, i],
+                                               big_M = max(0, self.max_travel_minutes + self.b[self.start_depot] + self.t[self.start_depot, i] - self.e[i]), name = "B_after_depot") # start of service time after leaving the start depot
+
+        with self._timeFamily("entering_depot"):
+            for k in self.K:
+                for i in [*self.D, *self.D_bar]:
+                    self._addConditionalConstr([self.x[i, self.end_depot, k]], gp.LinExpr(0), self.Q[i] + self.q[self.end_depot],
+                                               big_M = self.Q_max + self.q[self.end_depot], name="load_entering_depot") # load upon entering end depot
+                    self._addConditionalConstr([self.x[i, self.end_depot, k]], self.B_end_depot[k], self.B[i] + self.b[i] + self.t[i, self.end_depot],
+                                               big_M = self.l[i] + self.b[i] + self.t[i, self.end_depot], name = "B_entering_depot") # start of service time when entering the end depot
+
+    def _addAggregatedRoutingConstraints(self):
+        # vehicle-index-free routing: pickup and drop-off are kept on the same route by labelling every route
+        # with the first station after the start depot, cf. Furtado, Munari and Morabito (2017)
+        with self._timeFamily("arc_flow"):
+            self.model.addConstrs((self._arc_usage_sum(self.incoming_edges[o]) - self._arc_usage_sum(self.outgoing_edges[o]) == 0 for o in self.N), name = "arc_flow") # arc flow constr.
+
+        with self._timeFamily("depots"):
+            self.model.addConstr(gp.quicksum(self.x[self.start_depot,j] for j in self.stations_after_start_depot) == self.num_busses, name = "buses_leave_depot") # busses leave the depot
+            self.model.addConstr(gp.quicksum(self.x[i,self.end_depot] for i in self.stations_before_end_depot) == self.num_busses, name = "buses_enter_depot") # busses end at depot
+            self.model.addConstr(self.z.sum() == self.num_busses - self.x[self.start_depot, self.end_depot], name="connect_z") # fleet size given by the flow out of the start depot
+
+        with self._timeFamily("pickup_and_deliver"):
+            self.model.addConstrs((self._arc_usage_sum(self.outgoing_edges[o]) - self._arc_usage_sum(self.outgoing_edges[self.n+o]) == 0 for o in self.P), name = "pickup_and_deliver") # every customer picked up is also delivered
+            self.model.addConstrs((self.v[o] == self.v[self.n+o] for o in self.P), name = "pickup_and_deliver_on_same_route") # every customer is delivered by the bus that picked them up
+
+        with self._timeFamily("leaving_depot"):
+            first_stations = [*self.P, *self.P_bar]
+            self.model.addConstrs((self.Q[i] >= self.q[i] * self.x[self.start_depot, i] for i in first_stations), name = "load_leaving_depot") # load upon leaving start depot
+            self.model.addConstrs((self.v[i] >= i * self.x[self.start_depot, i] for i in first_stations), name = "route_label_lb") # route is labelled by its first station
+            self.model.addConstrs((self.v[i] <= i + self.num_nodes * (1 - self.x[self.start_depot, i]) for i in first_stations), name = "route_label_ub")
+
+        with self._timeFamily("propagate_route_label"):
+            self.model.addConstrs((self.v[j] >= self.v[i] - self.num_nodes * (1 - self.x[i,j]) for (i,j) in self.edges_from_N_to_N), name = "propagate_route_label_1") # label is passed on along the route
+            self.model.addConstrs((self.v[j] <= self.v[i] + self.num_nodes * (1 - self.x[i,j]) for (i,j) in self.edges_from_N_to_N), name = "propagate_route_label_2")
+
+        with self._timeFamily("entering_depot"):
+            for i in [*self.D, *self.D_bar]:
+                self._addConditionalConstr([self.x[i, self.end_depot]], gp.LinExpr(0), self.Q[i] + self.q[self.end_depot],
+                                           big_M = self.Q_max + self.q[self.end_depot], name="load_entering_depot") # load upon entering end depot
+                self.model.addConstr(self.B[i] + (self.b[i] + self.t[i, self.end_depot]) * self.x[i, self.end_depot] <= self.max_travel_minutes, name = "B_entering_depot") # start of service time when entering the end depot
+
     def _setObjective(self):
-        self.num_pax_accepted = gp.quicksum(self.x[i,j,k] for k in self.K for (i,j) in self.edges_from_P_to_HR)
-        self.total_distance = gp.quicksum(self.c[(i,j)] * self.x[i,j,k] for k in self.K for (i,j) in self.edges)
+        self.num_pax_accepted = self._arc_usage_sum(self.edges_from_P_to_HR, [self.q[o] for (o,_) in self.edges_from_P_to_HR])
+        self.total_distance = self._arc_usage_sum(self.edges, [self.c[(i,j)] for (i,j) in self.edges])
 
-        self.pax_km = gp.LinExpr()
-        for o in self.P:
-            outgoing_nodes_from_i = [j for (i,j) in self.edges if i==o]
-            self.pax_km += self.c_direct[o] * gp.quicksum(self.x[o, j, k] for j in outgoing_nodes_from_i for k in self.K)
+        pickup_edges = [(o,j) for o in self.P for (_,j) in self.outgoing_edges[o]]
+        self.pax_km = self._arc_usage_sum(pickup_edges, [self.c_direct[o] * self.q[o] for (o,_) in pickup_edges])
 
         self.saved_distance = self.pax_km - self.total_distance
 
@@ -186,6 +416,11 @@ class DARPModel(Model):
             self.num_pax_accepted = self.num_pax_accepted.getValue()
             self.total_distance = self.total_distance.getValue()
             self.pax_km = self.pax_km.getValue()
+
+            # one query per variable block, the postprocessing reads the values from these lists
+            self.B_values = self._solutionValues(self.B).tolist()
+            self.Q_values = self._solutionValues(self.Q).tolist()
+            self.z_values = self._solutionValues(self.z).tolist()
             
             self.paths = self._calculatePath()
             self.next_nodes_path = self._calculateLinkedPath()
@@ -204,6 +439,8 @@ class DARPModel(Model):
             verboseprint("Objective Value:", self.model.getObjective().getValue())
             verboseprint(SEPERATOR)
             verboseprint("Buildtime:", round(self.Buildtime,4))
+            verboseprint("Buildtime per constraint family:", {name: round(seconds, 4) for name, seconds in self.familyBuildtimes.items()})
+            self._printCuts(verboseprint)
             verboseprint("Runtime:", round(self.model.Runtime, 4))
             verboseprint("MIP Gap:", self.model.MIPGap)
             verboseprint(SEPERATOR)
@@ -248,9 +485,9 @@ class DARPModel(Model):
         for i in self.P:
             if i in self.visited_nodes:
                 if isvalid(self.waiting_time_per_pax[i]):
-                    avg_waiting_time += self.waiting_time_per_pax[i]
-                avg_ride_time += self.B[i + self.n].X - self.departure_times[i]
-                avg_transportation_time += self.B[i + self.n].X - self.e[i]
+                    avg_waiting_time += self.q[i] * self.waiting_time_per_pax[i]
+                avg_ride_time += self.q[i] * (self.B_values[i + self.n] - self.departure_times[i])
+                avg_transportation_time += self.q[i] * (self.B_values[i + self.n] - self.nodes[i].e)
 
         self.avg_waiting_time = round(avg_waiting_time / self.num_pax_accepted, 2)
         self.avg_ride_time = round(avg_ride_time / self.num_pax_accepted, 2)
@@ -261,13 +498,13 @@ class DARPModel(Model):
                 i,j = e
                 if self.loads[i] == 0:
                     empty_mileage += self.c[e]
-            if self.z[k].X > 0.9:
+            if self.z_values[k] > 0.9:
                 self.num_vehicles += 1
 
         for i in self.P:
             if i in self.visited_nodes:
                 pax_km_booked += self.q[i] * self.c[(i, i+self.n)]
-                pooling_factor += self.c[(i, i + self.n)]
+                pooling_factor += self.q[i] * self.c[(i, i + self.n)]
 
                 k = self.pax_to_bus[i]
 
@@ -305,7 +542,7 @@ class DARPModel(Model):
     def _calculateDepartureTimes(self):
         departure_time = {i.name: None for i in self.nodes}
         for i in self.visited_nodes:
-            departure_time[i] = self.B[i].X + self.b[i]
+            departure_time[i] = self.B_values[i] + self.b[i]
             
         return departure_time
 
@@ -314,9 +551,9 @@ class DARPModel(Model):
     	
         for request in self.P:
             if self.nodes[request].has_departure_service_promise:
-                waiting_time[request] = round(self.B[request].X - self.nodes[request].e, 2)
+                waiting_time[request] = round(self.B_values[request] - self.nodes[request].e, 2)
             elif self.nodes[request + self.n].has_arrival_service_promise:
-                waiting_time[request] = round(self.nodes[request + self.n].l - self.B[request + self.n].X, 2)
+                waiting_time[request] = round(self.nodes[request + self.n].l - self.B_values[request + self.n], 2)
             else:
                 waiting_time[request] = None
 
@@ -325,31 +562,58 @@ class DARPModel(Model):
                     raise ValueError("Waiting time of request {0} is negative.".format(request))
         return waiting_time
     
-    def sortEdgesByStationOrder(self, edges: np.array) -> np.array:
-        # add first edge
-        sorted_edges = [(i,j) for (i,j) in edges if i == self.start_depot]
-        if len(sorted_edges) != 1:
+    def sortEdgesByStationOrder(self, edges: List[tuple]) -> List[tuple]:
+        # follow the linked successors from the start depot, outgoing[i] is the position of the edge leaving node i
+        if [i for (i,j) in edges].count(self.start_depot) != 1:
             raise ValueError("Edgelist missing single edge from start depot.")
-        edges.remove(sorted_edges[0])
+        outgoing = np.full(self.num_nodes_incl_depots, -1)
+        outgoing[[i for (i,j) in edges]] = np.arange(len(edges))
 
-        while len(edges) > 0:
-            start_station = sorted_edges[-1][1]
-            next_edge = [(i,j) for (i,j) in edges if i == start_station][0]
-            sorted_edges.append(next_edge)
-            edges.remove(next_edge)
-        
+        sorted_edges = [edges[outgoing[self.start_depot]]]
+        while (len(sorted_edges) < len(edges)) and (outgoing[sorted_edges[-1][1]] >= 0):
+            sorted_edges.append(edges[outgoing[sorted_edges[-1][1]]])
+
+        if len(sorted_edges) < len(edges):
+            raise ValueError("Edgelist contains edges that are not on the path from the start depot.")
         if sorted_edges[-1][1] != self.end_depot:
             raise ValueError("Edgelist missing edge to the end depot.")
         return sorted_edges
 
     def _calculatePath(self):
+        if self.aggregate_vehicles:
+            return self._decomposePath()
+
+        edges = {k: [] for k in self.K}
+        for (i,j,k) in self._selectedKeys(self.x):
+            edges[k].append((i,j))
+
         path = {}
         for k in self.K:
-            edges = [(i,j) for (i,j) in self.edges if round(self.x[i,j,k].X,0) == 1]
-            sorted_edges = self.sortEdgesByStationOrder(edges=edges)
+            sorted_edges = self.sortEdgesByStationOrder(edges=edges[k])
             path[k] = sorted_edges
         return path
     
+    def _decomposePath(self):
+        # split the aggregated arc flow into one path per bus, unused busses drive from depot to depot
+        used_edges = [(i,j) for (i,j) in self._selectedKeys(self.x) if (i,j) != (self.start_depot, self.end_depot)]
+        next_station = {i: j for (i,j) in used_edges if i != self.start_depot}
+        first_stations = [j for (i,j) in used_edges if i == self.start_depot]
+        if len(first_stations) > self.num_busses:
+            raise ValueError("More paths leave the start depot than busses are available.")
+
+        path = {}
+        for k in self.K:
+            if k >= len(first_stations):
+                path[k] = [(self.start_depot, self.end_depot)]
+                continue
+            path[k] = [(self.start_depot, first_stations[k])]
+            while path[k][-1][1] != self.end_depot:
+                i = path[k][-1][1]
+                if i not in next_station:
+                    raise ValueError("Path of bus {0} does not end at the end depot.".format(k))
+                path[k].append((i, next_station[i]))
+        return path
+
     def _calculateLinkedPath(self):
         linked_path = {}
         for k in self.K:
@@ -371,13 +635,13 @@ class DARPModel(Model):
     def _calculateServiceTimes(self):
         service_time_by_bus = {}
         for k in self.K:
-            service_time_by_bus[k] = {i: round(self.B[i].X, 4) for i in self.visited_nodes_by_bus[k]}
+            service_time_by_bus[k] = {i: round(self.B_values[i], 4) for i in self.visited_nodes_by_bus[k]}
         return service_time_by_bus
 
     def _calculateLoad(self):
         load = {self.start_depot:0, self.end_depot:0}
         for k in self.K:
-            load |= {i: round(self.Q[i].X) for i in self.visited_nodes_by_bus[k] if i not in [self.start_depot,self.end_depot]}
+            load |= {i: round(self.Q_values[i]) for i in self.visited_nodes_by_bus[k] if i not in [self.start_depot,self.end_depot]}
         return load
     
     def _prepareOutput(self, id):
@@ -385,7 +649,7 @@ class DARPModel(Model):
         self.num_empty_services = None
         self.activeServices = None
 
-        self.total_waiting_time = sum(filter(None, self.waiting_time_per_pax.values()))
+        self.total_waiting_time = sum(self.q[i] * waiting_time for i, waiting_time in self.waiting_time_per_pax.items() if waiting_time)
         if self.num_pax_accepted == 0:
             self.avg_waiting_time = 0
         else:
@@ -1,46 +1,117 @@
 from util import *
 from typing import Optional
 
+NODE_TYPES = ["o", "d", "o_bar", "d_bar", "start_depot", "end_depot"]
+TYPE_CODES = {type: code for code, type in enumerate(NODE_TYPES)}
+DIRECTIONS = [None, "F", "R"]
+DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+class DarpNodeTable:
+    # structure-of-arrays storage of all nodes of the Location-Based graph, row = node name. stations and requests are -1 for the depots
+    def __init__(self, num_nodes: int) -> None:
+        self.darp_station = np.full(num_nodes, -1, dtype=np.int64)
+        self.bus_station = np.full(num_nodes, -1, dtype=np.int64)
+        self.request = np.full(num_nodes, -1, dtype=np.int64)
+        self.type = np.zeros(num_nodes, dtype=np.int8)
+        self.direction = np.zeros(num_nodes, dtype=np.int8)
+        self.e = np.full(num_nodes, np.nan)
+        self.l = np.full(num_nodes, np.nan)
+        self.has_arrival_service_promise = np.zeros(num_nodes, dtype=bool)
+        self.has_departure_service_promise = np.zeros(num_nodes, dtype=bool)
+
+    def __len__(self):
+        return len(self.type)
+
+    def set_nodes(self, rows, darp_station, bus_station, request, type: str, direction) -> None:
+        # direction: "F", "R" or None, or an array of direction codes
+        if type not in TYPE_CODES:
+            raise ValueError("DARP Node type of {} was not recognized.".format(type))
+        self.darp_station[rows] = -1 if darp_station is None else darp_station
+        self.bus_station[rows] = -1 if bus_station is None else bus_station
+        self.request[rows] = -1 if request is None else request
+        self.type[rows] = TYPE_CODES[type]
+        self.direction[rows] = DIRECTION_CODES[direction] if (direction is None) or isinstance(direction, str) else direction
+
+    def is_depot(self, rows = slice(None)) -> np.ndarray:
+        return self.type[rows] >= TYPE_CODES["start_depot"]
+
+    def service_time(self, boarding_time: float, rows = slice(None)) -> np.ndarray:
+        # the boarding time is spent at the nodes where passengers get on or off
+        return np.where(self.type[rows] <= TYPE_CODES["d"], boarding_time, 0.0)
+
 class DarpNode:
-    def __init__(self, darp_station: int, bus_station: Optional[int], corresponding_request: Optional[int], type: str, direction = Optional[str]) -> None:
-        self._validate_type(type)
-
-        if not (darp_station is None) and not isinstance(darp_station, int):
-            raise TypeError("Bus station of Location-Based node must be an integer.")
-
-        self.darp_station = darp_station
-        self.bus_station = bus_station
-        self.request = corresponding_request
-        self.direction = direction
-        self.e = None
-        self.l = None
-        self.type = type
-        self.name = None
-        self.has_arrival_service_promise = False
-        self.has_departure_service_promise = False
-
-    def _validate_type(self, type):
-        if type not in ["o", "d", "o_bar", "d_bar", "start_depot", "end_depot"]:
-            raise ValueError("DARP Node type of {} was not recognized.".format(self.type))
-        
+    # view on one row of a DarpNodeTable
+    __slots__ = ("table", "name")
+
+    def __init__(self, table: DarpNodeTable, name: int) -> None:
+        self.table = table
+        self.name = name
+
+    @staticmethod
+    def _optional(value) -> Optional[int]:
+        return None if value < 0 else int(value)
+
+    @property
+    def darp_station(self) -> Optional[int]:
+        return self._optional(self.table.darp_station[self.name])
+
+    @property
+    def bus_station(self) -> Optional[int]:
+        return self._optional(self.table.bus_station[self.name])
+
+    @property
+    def request(self) -> Optional[int]:
+        return self._optional(self.table.request[self.name])
+
+    @property
+    def type(self) -> str:
+        return NODE_TYPES[self.table.type[self.name]]
+
+    @property
+    def direction(self) -> Optional[str]:
+        return DIRECTIONS[self.table.direction[self.name]]
+
+    @property
+    def e(self) -> float:
+        return float(self.table.e[self.name])
+
+    @e.setter
+    def e(self, value: float) -> None:
+        self.table.e[self.name] = value
+
+    @property
+    def l(self) -> float:
+        return float(self.table.l[self.name])
+
+    @l.setter
+    def l(self, value: float) -> None:
+        self.table.l[self.name] = value
+
+    @property
+    def has_arrival_service_promise(self) -> bool:
+        return bool(self.table.has_arrival_service_promise[self.name])
+
+    @property
+    def has_departure_service_promise(self) -> bool:
+        return bool(self.table.has_departure_service_promise[self.name])
+
     def is_depot(self):
-        return (self.type in ["start_depot", "end_depot"])
-        
+        return bool(self.table.type[self.name] >= TYPE_CODES["start_depot"])
+
     def __eq__(self, other):
         if isinstance(other, DarpNode):
             return self.darp_station == other.darp_station
         return False
-    
+
     def __lt__(self, other):
         if isinstance(other, DarpNode):
             return self.darp_station < other.darp_station
         return False
-    
+
     def __gt__(self, other):
         if isinstance(other, DarpNode):
             return self.darp_station > other.darp_station
         return False
-    
+
     def __sub__(self, other):
         return self.darp_station - other.darp_station
-        
\ No newline at end of file
@@ -0,0 +1,195 @@
+from util import *
+from model import Model
+from insertionHeuristic import ASC, DESC, DROPOFF, PICKUP
+import subprocess
+import tempfile
+
+# decomposition mode for large instances: the ascending and the descending requests are solved as two independent problems (same model, all busses)
+# in parallel processes. the legs of both solutions are stitched into bus rotations by a small turn matching problem, requests lost on the way are
+# inserted by the insertion heuristic. the combined plan is loaded into the full model with all integer variables fixed, so its postprocessing
+# works as after a regular solve. the result is a feasible plan of the full model, optimality is not guaranteed.
+# the subproblems run as "python directionDecomposition.py <job> <result>": multiprocessing would import main.py again in spawned processes
+
+def solveDirection(job: dict) -> dict:
+    # runs in the worker process, exceptions are sent back as a failed result
+    result = {"schedule": {}}
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            model = job["model_class"](**job["model_args"])
+            model.createModel(**job["options"])
+            model.optimize(verbose=False, params=job["params"])
+            result.update({"status": model.model.Status, "Runtime": model.model.Runtime})
+            if model.model.SolCount > 0:
+                result.update({"objective": model.model.ObjVal, "schedule": model.requestSchedule()})
+    except Exception as e:
+        result.update({"status": "error", "error": repr(e)})
+    return result
+
+class DirectionDecomposition:
+    def __init__(self, model: Model, options: dict):
+        # model: the full model, created by createModel(**options). both directions are solved with the same options
+        self.model = model
+        self.options = options
+        self.planner = model._insertionHeuristic()
+
+    def solve(self, verbose = True, params: dict = None):
+        verboseprint = print if verbose else lambda *a, **k: None
+        start_time = datetime.datetime.now()
+
+        self.results = self._solveDirections(params or {})
+        legs = self._legs(self.results["asc"]["schedule"], ASC) + self._legs(self.results["desc"]["schedule"], DESC)
+        rotations = self._matchTurns(legs)
+        self.num_legs = len(legs)
+        self.num_rotations = len(rotations)
+        self.num_inserted = self._buildPlan(legs, rotations)
+
+        end_time = datetime.datetime.now()
+        self.Runtime = (end_time - start_time).total_seconds()
+
+        verboseprint("Direction decomposition:")
+        for name, result in self.results.items():
+            verboseprint("{0}: status {1}, objective {2}, runtime {3}".format(name, result.get("status"), result.get("objective"), result.get("Runtime")))
+        verboseprint("Legs: {0}, bus rotations: {1}, requests inserted afterwards: {2}".format(self.num_legs, self.num_rotations, self.num_inserted))
+        verboseprint("Objective value of the combined plan:", round(self.planner.objective, 2))
+        verboseprint("Runtime:", round(self.Runtime, 3), "s")
+        verboseprint(SEPERATOR)
+
+        self.model.optimizeFixed(self.planner, verbose=verbose, params=params)
+
+    def _modelArgs(self, requests) -> dict:
+        return {"requests": requests, "num_stations": self.model.num_stations, "num_busses": self.model.num_busses, "Q_max": self.model.Q_max,
+                "timeframe": self.model.max_travel_minutes, "alpha": self.model.alpha, "beta": self.model.beta, "speed": self.model.speed,
+                "t_turn": self.model.t_turn, "boarding_time": self.model.boarding_time}
+
+    def _solveDirections(self, params: dict) -> dict:
+        # both subproblems share the cores
+        threads = params.get("Threads") or os.cpu_count() or 1
+        params = dict(params, Threads=max(1, threads // 2))
+        requests = self.model.requests
+
+        results = {}
+        running = {}
+        with tempfile.TemporaryDirectory() as work_dir:
+            for name, indices in [("asc", requests.asc_requests), ("desc", requests.desc_requests)]:
+                if not indices:
+                    results[name] = {"status": None, "schedule": {}}
+                    continue
+                job = {"model_class": type(self.model), "model_args": self._modelArgs(requests.subset(indices)), "options": self.options, "params": params}
+                job_file = os.path.join(work_dir, name + "_job.pickle")
+                result_file = os.path.join(work_dir, name + "_result.pickle")
+                with open(job_file, "wb") as file:
+                    pickle.dump(job, file)
+                process = subprocess.Popen([sys.executable, os.path.abspath(__file__), job_file, result_file], stdout=subprocess.DEVNULL)
+                running[name] = (process, indices, result_file)
+
+            for name, (process, indices, result_file) in running.items():
+                process.wait()
+                if not os.path.exists(result_file):
+                    # the worker died without reporting, e.g. killed or crashed inside the solver
+                    results[name] = {"status": "crashed", "error": "exit code {0}".format(process.returncode), "schedule": {}}
+                    continue
+                with open(result_file, "rb") as file:
+                    result = pickle.load(file)
+                # the requests of a subproblem are numbered in the order of indices
+                result["schedule"] = {indices[r]: value for r, value in result["schedule"].items()}
+                results[name] = result
+        return results
+
+    def _legs(self, schedule: dict, direction: int) -> List[tuple]:
+        # (direction, stops, time of the first stop, end of the last stop) per leg. the stops of a bus are sorted by time,
+        # a new leg starts whenever the bus drives backwards, i.e. it turned twice in between
+        legs = []
+        stops_per_bus = {}
+        for r, (k, pickup_time, dropoff_time) in schedule.items():
+            stops_per_bus.setdefault(k, []).append((pickup_time, PICKUP, r))
+            stops_per_bus.setdefault(k, []).append((dropoff_time, DROPOFF, r))
+
+        for k, stops in sorted(stops_per_bus.items()):
+            leg = []
+            for time, kind, r in sorted(stops):
+                position = direction * (self.planner.origins[r] if kind == PICKUP else self.planner.destinations[r])
+                if leg and (position < leg[-1][1][0]):
+                    legs.append(self._leg(direction, leg))
+                    leg = []
+                leg.append((time, (position, kind, self.planner.e_pickup[r], self.planner.l_dropoff[r], r)))
+            legs.append(self._leg(direction, leg))
+        return [leg for leg in legs if leg[1]]
+
+    def _leg(self, direction: int, leg: List[tuple]) -> tuple:
+        # requests without both stops in the leg are left to the insertion heuristic
+        requests = [stop[4] for _, stop in leg]
+        stops = sorted(stop for _, stop in leg if requests.count(stop[4]) == 2)
+        return (direction, stops, leg[0][0], leg[-1][0] + self.planner.b)
+
+    def _matchTurns(self, legs: List[tuple]) -> List[List[int]]:
+        # rotations of legs, each rotation is driven by one bus. a leg can follow another one if the bus gets there in time, the turn matching
+        # keeps the most valuable legs (objective of their passengers) and minimizes the empty drives in between
+        planner = self.planner
+        values = []
+        for direction, stops, start, end in legs:
+            requests = {stop[4] for stop in stops}
+            distance = sum(planner.c[abs(i[0])][abs(j[0])] for (i,j) in zip(stops[:-1], stops[1:]))
+            values.append(sum((planner.obj_weights[0] + planner.obj_weights[1] * planner.c_direct[r]) * planner.demands[r] for r in requests) - planner.obj_weights[1] * distance)
+
+        pairs = {}
+        for a, (direction_a, stops_a, start_a, end_a) in enumerate(legs):
+            state = (direction_a * stops_a[-1][0], end_a, 0 if direction_a == ASC else 1, 0)
+            for b, (direction_b, stops_b, start_b, end_b) in enumerate(legs):
+                if (a == b) or (start_b < end_a):
+                    continue
+                transition = planner._transition(state, direction_b, direction_b * stops_b[0][0])
+                if (transition is not None) and (transition[1] <= start_b + EPSILON):
+                    pairs[a,b] = transition[3]
+
+        matching = gp.Model("turn matching", env=self.model.env)
+        matching.setParam("OutputFlag", 0)
+        used = matching.addVars(len(legs), vtype=GRB.BINARY, name="used")
+        follows = matching.addVars(pairs.keys(), vtype=GRB.BINARY, name="follows")
+        matching.addConstrs((follows.sum(a, "*") <= used[a] for a in range(len(legs))), name="one_successor")
+        matching.addConstrs((follows.sum("*", b) <= used[b] for b in range(len(legs))), name="one_predecessor")
+        # every rotation needs a bus
+        matching.addConstr(used.sum() - follows.sum() <= planner.num_busses, name="num_busses")
+        matching.setObjective(gp.quicksum(values[a] * used[a] for a in range(len(legs))) - planner.obj_weights[1] * follows.prod(pairs), GRB.MAXIMIZE)
+        matching.optimize()
+
+        successor = {a: b for (a,b), var in follows.items() if var.X > 0.5}
+        first_legs = [a for a in range(len(legs)) if (used[a].X > 0.5) and (a not in successor.values())]
+        matching.dispose()
+
+        rotations = []
+        for a in sorted(first_legs, key=lambda a: legs[a][2]):
+            rotations.append([a])
+            while rotations[-1][-1] in successor:
+                rotations[-1].append(successor[rotations[-1][-1]])
+        return rotations
+
+    def _buildPlan(self, legs: List[tuple], rotations: List[List[int]]) -> int:
+        # rotations are assigned to the busses in the order of their start, requests the timing of the model does not allow are dropped.
+        # afterwards all requests without a bus are offered to the insertion heuristic, returns the number of requests it inserts
+        planner = self.planner
+        planner._reset()
+        for k, rotation in enumerate(rotations):
+            rotation_legs, ends = planner._dropInfeasible(k, [legs[a][:2] for a in rotation], set())
+            planner._setRoute(k, rotation_legs, ends)
+            for direction, stops in rotation_legs:
+                for stop in stops:
+                    planner.bus_of[stop[4]] = k
+
+        num_inserted = 0
+        for r in sorted(range(planner.num_requests), key=lambda r: (planner.e_pickup[r], planner.l_dropoff[r], r)):
+            if (r not in planner.bus_of) and (planner.origins[r] != planner.destinations[r]):
+                num_inserted += planner._insert(r)
+        planner._summarize()
+        return num_inserted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("directionDecomposition.py")
+    parser.add_argument("job", help="Subproblem written by DirectionDecomposition, in .pickle format.", type=str)
+    parser.add_argument("result", help="Path of the result, in .pickle format.", type=str)
+    args = parser.parse_args()
+
+    with open(args.job, "rb") as file:
+        job = pickle.load(file)
+    result = solveDirection(job)
+    with open(args.result, "wb") as file:
+        pickle.dump(result, file)
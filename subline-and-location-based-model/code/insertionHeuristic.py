@@ -0,0 +1,289 @@
+from util import *
+from travelRequests import TravelRequests
+import bisect
+
+# constructive insertion heuristic: the requests are inserted one at a time into line-based bus schedules.
+# a schedule is a list of legs, each leg drives in one direction along the line and the bus is empty when it turns between two legs.
+# the timing follows the services of the Subline-Based model (ascending and descending services alternate, one turn between two services),
+# so the plan is feasible for both models. it is used as a MIP start via createModel(warm_start=True) or on its own.
+
+ASC = 1
+DESC = -1
+DROPOFF = 0 # drop-offs before pick-ups at the same station
+PICKUP = 1
+
+class InsertionHeuristic:
+    NAME = "Insertion heuristic"
+
+    def __init__(self, requests: TravelRequests, num_busses: int, Q_max: int, boarding_time: float, timeframe: float, alpha: float, beta: float,
+                 speed: float = 1, t_turn: float = 0.5, obj_weights: List[float] = [10,1], num_services: Optional[int] = None, horizon: Optional[float] = None,
+                 start_stations: Optional[List[Optional[int]]] = None, insertion_window: Optional[float] = None) -> None:
+        # num_services: max. number of services per bus as in the Subline-Based model, horizon: latest time a bus finishes (default: timeframe),
+        # start_stations: station per bus where its first (ascending) service starts, None if the bus may start anywhere,
+        # insertion_window: a request is only inserted after legs that end at most this long before its earliest pick-up (None: anywhere)
+        self.num_requests = requests.num_requests
+        self.num_busses = num_busses
+        self.Q_max = Q_max
+        self.b = boarding_time
+        self.t_turn = t_turn
+        self.obj_weights = obj_weights
+        self.num_services = num_services
+        self.horizon = timeframe if horizon is None else horizon
+        self.start_stations = [None] * num_busses if start_stations is None else start_stations
+        self.insertion_window = insertion_window
+
+        self.origins = [r[ORIGIN_IDX] for r in requests.requests]
+        self.destinations = [r[DESTINATION_IDX] for r in requests.requests]
+        self.c = requests.distances.tolist()
+        self.t = (requests.distances * speed).tolist()
+        self.c_direct = requests.direct_distances.tolist()
+        self.demands = list(requests.demands)
+
+        time_windows = requests.time_window_arrays(travel_speed=speed, boarding_time=boarding_time, max_time=timeframe, alpha=alpha, beta=beta)
+        self.e_pickup, self.l_pickup = time_windows["pick_up"].T.tolist()
+        self.e_dropoff, self.l_dropoff = time_windows["drop_off"].T.tolist()
+        self.max_ride_time = [alpha * self.t[o][d] for (o,d) in zip(self.origins, self.destinations)]
+        self.service_promises = time_windows["service_promise"].tolist()
+
+    def solve(self):
+        start_time = datetime.datetime.now()
+
+        self._reset()
+        for r in sorted(range(self.num_requests), key=lambda r: (self.e_pickup[r], self.l_dropoff[r], r)):
+            if self.origins[r] != self.destinations[r]:
+                self._insert(r)
+        self._summarize()
+
+        end_time = datetime.datetime.now()
+        self.runtime = (end_time - start_time).total_seconds()
+        return self
+
+    def _reset(self):
+        # legs: (direction, stops) per bus, ends: (station, time, service, distance) after each leg, end_times: time of ends for bisection
+        self.routes = [[] for _ in range(self.num_busses)]
+        self.ends = [[] for _ in range(self.num_busses)]
+        self.end_times = [[] for _ in range(self.num_busses)]
+        self.bus_of = {}
+        # a bus with a given start station is there at time 0, at the beginning of its first service
+        self.initial_states = [None if station is None else (station, 0, 0, 0) for station in self.start_stations]
+
+    def _summarize(self):
+        self.accepted = sorted(self.bus_of)
+        self.rejected = [r for r in range(self.num_requests) if r not in self.bus_of]
+        self.total_distance = sum(ends[-1][3] for ends in self.ends if ends)
+        self.num_pax_accepted = sum(self.demands[r] for r in self.accepted)
+        self.pax_km = sum(self.c_direct[r] * self.demands[r] for r in self.accepted)
+        self.objective = self.obj_weights[0] * self.num_pax_accepted + self.obj_weights[1] * (self.pax_km - self.total_distance)
+
+    def _insert(self, r: int) -> bool:
+        direction = ASC if self.origins[r] < self.destinations[r] else DESC
+        pickup = (direction * self.origins[r], PICKUP, self.e_pickup[r], self.l_dropoff[r], r)
+        dropoff = (direction * self.destinations[r], DROPOFF, self.e_pickup[r], self.l_dropoff[r], r)
+
+        best_increase, best_legs, best_bus = None, None, None
+        last_used = max((k for k, legs in enumerate(self.routes) if legs), default=-1)
+        for k, legs in enumerate(self.routes):
+            # legs finishing long before r's earliest pick-up are not tried
+            first = 0 if self.insertion_window is None else bisect.bisect_left(self.end_times[k], self.e_pickup[r] - self.insertion_window)
+            for j in range(first, len(legs) + 1):
+                # the bus reaches leg j too late for r, and every later leg too
+                if (j > 0) and (self.ends[k][j-1][1] > self.l_pickup[r]):
+                    break
+
+                # r gets a leg of its own before leg j
+                candidates = [(legs[:j] + [(direction, [pickup, dropoff])] + legs[j:], 1)]
+                # r joins leg j
+                if (j < len(legs)) and (legs[j][0] == direction):
+                    stops = list(legs[j][1])
+                    bisect.insort(stops, pickup)
+                    bisect.insort(stops, dropoff)
+                    candidates.append((legs[:j] + [(direction, stops)] + legs[j+1:], 0))
+
+                for new_legs, offset in candidates:
+                    increase = self._distanceIncrease(k, new_legs, j, offset)
+                    if (increase is not None) and ((best_increase is None) or (increase < best_increase)):
+                        best_increase, best_legs, best_bus = increase, new_legs, k
+            if not legs and (k > last_used) and ((self.start_stations[k] is None) or (self.start_stations[k+1:] == self.start_stations[k:-1])):
+                # the remaining busses are unused and cannot start anywhere else, so the busses are used in order
+                break
+
+        if (best_increase is None) or ((self.obj_weights[0] + self.obj_weights[1] * self.c_direct[r]) * self.demands[r] - self.obj_weights[1] * best_increase <= 0):
+            return False
+        self._setRoute(best_bus, best_legs, self._simulate(best_bus, best_legs))
+        self.bus_of[r] = best_bus
+        return True
+
+    def _setRoute(self, k: int, legs: List[tuple], ends: List[tuple]):
+        # legs and stops are replaced, never changed in place, so copies of self.routes share them
+        self.routes[k] = legs
+        self.ends[k] = ends
+        self.end_times[k] = [state[1] for state in ends]
+
+    def _dropInfeasible(self, k: int, legs: List[tuple], dropped: set) -> tuple:
+        # legs of bus k without the requests in dropped. a request the schedule fails on is dropped as well until the schedule is feasible,
+        # e.g. a passenger picked up earlier without the dropped stops whose ride time is exceeded when the bus waits later on
+        while True:
+            legs = self._mergeLegs([(direction, [stop for stop in stops if stop[4] not in dropped]) for direction, stops in legs])
+            failed = []
+            ends = self._simulate(k, legs, failed)
+            if ends is not None:
+                return legs, ends
+            dropped.add(failed[0])
+
+    def _mergeLegs(self, legs: List[tuple]) -> List[tuple]:
+        # drops empty legs, two legs in the same direction become one if the bus does not have to drive back in between
+        merged = []
+        for direction, stops in legs:
+            if not stops:
+                continue
+            if merged and (merged[-1][0] == direction) and (stops[0][0] >= merged[-1][1][-1][0]):
+                merged[-1] = (direction, sorted(merged[-1][1] + stops))
+            else:
+                merged.append((direction, stops))
+        return merged
+
+    def _distanceIncrease(self, k: int, legs: List[tuple], first: int, offset: int) -> Optional[float]:
+        # new legs of bus k: legs before first are unchanged, legs after first are the old legs shifted by offset. returns None if infeasible
+        old_ends = self.ends[k]
+        state = old_ends[first-1] if first > 0 else self.initial_states[k]
+        for j in range(first, len(legs)):
+            # the bus reaches an unchanged leg as before, nothing changes from here on
+            if (j > first) and (j-1-offset >= 0) and (state[:3] == old_ends[j-1-offset][:3]):
+                return state[3] - old_ends[j-1-offset][3]
+            state = self._serveLeg(state, *legs[j])
+            if state is None:
+                return None
+        if not self._isFinished(state):
+            return None
+        return state[3] - (old_ends[-1][3] if old_ends else 0)
+
+    def _simulate(self, k: int, legs: List[tuple], failed: Optional[list] = None) -> Optional[List[tuple]]:
+        # ends of every leg, None if infeasible. failed receives a request the schedule fails on
+        ends = []
+        state = self.initial_states[k]
+        for direction, stops in legs:
+            state = self._serveLeg(state, direction, stops, failed=failed)
+            if state is None:
+                return None
+            ends.append(state)
+        if ends and not self._isFinished(state):
+            if failed is not None:
+                failed.append(legs[-1][1][0][4])
+            return None
+        return ends
+
+    def _transition(self, state: Optional[tuple], direction: int, first_station: int) -> Optional[tuple]:
+        # the empty bus drives from the end of its last leg to the first stop of the next leg
+        if state is None:
+            # the first service is ascending, a bus starting with a descending leg turns at its first stop
+            if direction == ASC:
+                return (first_station, 0, 0, 0)
+            return (first_station, self.t_turn, 1, 0)
+
+        station, time, service, distance = state
+        last_direction = ASC if service % 2 == 0 else DESC
+        if direction == last_direction:
+            # empty service in between: turn, drive back to the first stop and turn again
+            if (first_station - station) * direction >= 0:
+                return None
+            return (first_station, time + 2 * self.t_turn + self.t[station][first_station], service + 2, distance + self.c[station][first_station])
+
+        # turn at the outermost of both stations
+        turn_station = first_station if (first_station - station) * last_direction > 0 else station
+        return (first_station, time + self.t[station][turn_station] + self.t_turn + self.t[turn_station][first_station], service + 1,
+                distance + self.c[station][turn_station] + self.c[turn_station][first_station])
+
+    def _serveLeg(self, state: Optional[tuple], direction: int, stops: List[tuple], stop_times: Optional[list] = None, failed: Optional[list] = None) -> Optional[tuple]:
+        state = self._transition(state, direction, direction * stops[0][0])
+        if (state is None) or ((self.num_services is not None) and (state[2] >= self.num_services)):
+            if failed is not None:
+                failed.append(stops[0][4])
+            return None
+        station, time, service, distance = state
+
+        load = 0
+        pickup_time = {}
+        for (position, kind, _, _, r) in stops:
+            if direction * position != station:
+                time += self.t[station][direction * position]
+                distance += self.c[station][direction * position]
+                station = direction * position
+
+            if kind == PICKUP:
+                start = max(time, self.e_pickup[r])
+                load += self.demands[r]
+                if (start > self.l_pickup[r]) or (load > self.Q_max):
+                    if failed is not None:
+                        failed.append(r)
+                    return None
+                pickup_time[r] = start
+            else:
+                start = max(time, self.e_dropoff[r])
+                load -= self.demands[r]
+                if (start > self.l_dropoff[r]) or (start - self.b - pickup_time[r] > self.max_ride_time[r]):
+                    if failed is not None:
+                        failed.append(r)
+                    return None
+            time = start + self.b
+            if stop_times is not None:
+                stop_times.append((r, "pickup" if kind == PICKUP else "dropoff", station, start))
+        return (station, time, service, distance)
+
+    def _isFinished(self, state: tuple) -> bool:
+        # a bus of the Subline-Based model turns once per remaining service
+        station, time, service, distance = state
+        if self.num_services is not None:
+            time += (self.num_services - 1 - service) * self.t_turn
+        return time <= self.horizon
+
+    def getServices(self, k: int, legs: List[tuple]) -> List[tuple]:
+        # services of the Subline-Based model driven by bus k: visited stations and assigned requests per service.
+        # every service but the last one given ends with a turn at its last station
+        services = [] if self.start_stations[k] is None else [([self.start_stations[k]], [])]
+        for direction, stops in legs:
+            first_station = direction * stops[0][0]
+            if not services:
+                if direction == DESC:
+                    services.append(([first_station], []))
+                services.append(([first_station], []))
+            else:
+                stations = services[-1][0]
+                last_direction = ASC if (len(services) - 1) % 2 == 0 else DESC
+                if direction == last_direction:
+                    services.append(([stations[-1], first_station], []))
+                    services.append(([first_station], []))
+                else:
+                    turn_station = first_station if (first_station - stations[-1]) * last_direction > 0 else stations[-1]
+                    if turn_station != stations[-1]:
+                        stations.append(turn_station)
+                    services.append(([turn_station] if turn_station == first_station else [turn_station, first_station], []))
+
+            stations, assigned = services[-1]
+            for (position, kind, _, _, r) in stops:
+                if direction * position != stations[-1]:
+                    stations.append(direction * position)
+                if kind == PICKUP:
+                    assigned.append(r)
+        return services
+
+    def getStopTimes(self, k: int, legs: List[tuple]) -> List[tuple]:
+        # (request, pickup / dropoff, station, start of service) for every stop of bus k
+        stop_times = []
+        state = self.initial_states[k]
+        for direction, stops in legs:
+            state = self._serveLeg(state, direction, stops, stop_times)
+        return stop_times
+
+    def printSolution(self, print_routes: bool = True):
+        print(self.NAME + ":")
+        print("Objective value:", round(self.objective, 2))
+        print("Number of passengers served overall:", self.num_pax_accepted, "of", sum(self.demands))
+        print("Total distance:", round(self.total_distance, 2))
+        print("Busses used:", sum(1 for legs in self.routes if legs))
+        print("Runtime:", round(self.runtime, 3), "s")
+        if not print_routes:
+            return
+        for k, legs in enumerate(self.routes):
+            if not legs:
+                continue
+            print("Bus", k, ":", ", ".join("{0} {1} at {2} ({3})".format(kind, r, station, round(time, 1)) for (r, kind, station, time) in self.getStopTimes(k, legs)))
@@ -1,7 +1,12 @@
 from util import *
 from darpModel import DARPModel
 from sublineModel import SublineModel
+from sublineMatrixModel import SublineMatrixModel
 from travelRequests import TravelRequests
+from insertionHeuristic import InsertionHeuristic
+from alnsSolver import ALNSSolver
+from directionDecomposition import DirectionDecomposition
+from sublineColumnGeneration import SublineColumnGeneration
 
 station_file = None
 distance_matrix_file = None
@@ -31,6 +36,8 @@ input_folder = args.requests
 
 # settings
 TESTING = True # toggle to change verbose setting
+RUN_HEURISTIC = False # insertion heuristic on its own
+RUN_ALNS = False # adaptive large neighborhood search, for instances too large for the models
 RUN_LOCATION_MODEL = True
 RUN_SUBLINE_MODEL = True
 
@@ -43,9 +50,22 @@ obj_weights = [10,1] # w_1: accepted passengers, w_2: saved distance
 speed = 1
 time_to_turn = 0.5
 consider_shortcuts = True
+aggregate_vehicles = False # Location-Based model: aggregate arc variables over all busses
+linearization = None # both models: None (bilinear), "big_M" or "indicator"
+tighten_big_M = False # both models: compute a big M per constraint from the time windows
+matrix_api = False # Subline-Based model: build the model with Gurobi's matrix API
+warm_start = False # both models: MIP start from the insertion heuristic
+lazy_constraints = False # both models: capacity, load and ordering constraints are added in a callback when violated (not combined with matrix_api)
+user_cuts = False # both models, with lazy_constraints: violated ones are also cut off at the tree nodes
+clique_cuts = False # both models: clique inequalities of requests that cannot share a bus / service (not combined with matrix_api or aggregate_vehicles)
+column_generation = False # Subline-Based model: branch-and-price over bus rotations (not combined with matrix_api, warm_start or decomposition)
+decomposition = False # both models: solve ascending and descending requests in parallel and stitch the solutions (heuristic, for large instances)
+aggregate_requests = False # all solvers: identical requests become one request with the summed demand, served as a whole
+instance_cache = None # directory of compiled instances, e.g. "cache/": repeated runs load the parsed instance instead of the text files
 
 time_limit_in_minutes = 60
 time_limit = time_limit_in_minutes * 60
+alns_time_limit_in_minutes = 5
 
 output_path = "output/"
 
@@ -62,7 +82,31 @@ for request_name in os.listdir(args.requests):
     # parse requests
     parsed_requests = TravelRequests()
     number_of_busses, max_time_in_minutes, bus_capacity, number_of_stations, service_time, alpha, beta = parsed_requests.read_file(
-        instance_file=request_file, consider_shortcuts=consider_shortcuts, station_location_file=station_file, distance_matrix_file=distance_matrix_file)
+        instance_file=request_file, consider_shortcuts=consider_shortcuts, station_location_file=station_file, distance_matrix_file=distance_matrix_file,
+        instance_cache=instance_cache)
+    if aggregate_requests:
+        num_original_requests = parsed_requests.num_requests
+        parsed_requests, _ = parsed_requests.aggregate_identical()
+        print("Aggregated {0} requests into {1} requests.".format(num_original_requests, parsed_requests.num_requests))
+        print(SEPERATOR)
+
+    # insertion heuristic
+    if RUN_HEURISTIC:
+        print("Running the insertion heuristic.")
+        print(SEPERATOR)
+        heuristic = InsertionHeuristic(requests=parsed_requests, num_busses=number_of_busses, Q_max=bus_capacity, boarding_time=service_time, timeframe=max_time_in_minutes,
+                                       alpha=alpha, beta=beta, speed=speed, t_turn=time_to_turn, obj_weights=obj_weights).solve()
+        heuristic.printSolution()
+        print(SEPERATOR)
+
+    # adaptive large neighborhood search
+    if RUN_ALNS:
+        print("Running the ALNS.")
+        print(SEPERATOR)
+        alns = ALNSSolver(requests=parsed_requests, num_busses=number_of_busses, Q_max=bus_capacity, boarding_time=service_time, timeframe=max_time_in_minutes,
+                          alpha=alpha, beta=beta, speed=speed, t_turn=time_to_turn, obj_weights=obj_weights, time_limit=alns_time_limit_in_minutes * 60).solve()
+        alns.printSolution()
+        print(SEPERATOR)
 
     # Location-Based model
     if RUN_LOCATION_MODEL:
@@ -70,8 +114,13 @@ for request_name in os.listdir(args.requests):
         print(SEPERATOR)
         DARP = DARPModel(requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses, timeframe=max_time_in_minutes,
                             boarding_time=service_time, Q_max=bus_capacity, speed=speed, t_turn=time_to_turn, alpha=alpha, beta=beta)
-        DARP.createModel(obj_weights=obj_weights)
-        DARP.optimize(verbose=TESTING, params={"TimeLimit": time_limit})
+        location_options = {"obj_weights": obj_weights, "aggregate_vehicles": aggregate_vehicles, "linearization": linearization, "tighten_big_M": tighten_big_M, "warm_start": warm_start,
+                            "lazy_constraints": lazy_constraints, "user_cuts": user_cuts, "clique_cuts": clique_cuts}
+        DARP.createModel(**location_options)
+        if decomposition:
+            DirectionDecomposition(DARP, options=location_options).solve(verbose=TESTING, params={"TimeLimit": time_limit})
+        else:
+            DARP.optimize(verbose=TESTING, params={"TimeLimit": time_limit})
         DARP.postprocessing(verbose=TESTING)
         if not TESTING:
             DARP.detailed_file(path=output_path, instance=request_name)
@@ -83,11 +132,19 @@ for request_name in os.listdir(args.requests):
         print("Running the Subline-Based model.")
         print(SEPERATOR)
 
-        subline = SublineModel(requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses,
+        subline_class = SublineMatrixModel if matrix_api else SublineModel
+        if column_generation:
+            subline_class = SublineColumnGeneration
+        subline = subline_class(requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses,
                                 boarding_time = service_time, timeframe=max_time_in_minutes, Q_max=bus_capacity, 
                                 speed=speed, t_turn=time_to_turn, alpha=alpha, beta=beta)
-        subline.createModel(obj_weights=obj_weights)
-        subline.optimize(verbose=TESTING, params={"TimeLimit": time_limit})
+        subline_options = {"obj_weights": obj_weights, "linearization": linearization, "tighten_big_M": tighten_big_M, "warm_start": warm_start, "lazy_constraints": lazy_constraints, "user_cuts": user_cuts,
+                           "clique_cuts": clique_cuts}
+        subline.createModel(**subline_options)
+        if decomposition:
+            DirectionDecomposition(subline, options=subline_options).solve(verbose=TESTING, params={"TimeLimit": time_limit})
+        else:
+            subline.optimize(verbose=TESTING, params={"TimeLimit": time_limit})
         subline.postprocessing(verbose=TESTING)
         if not TESTING:
             subline.detailed_file(path=output_path, instance=request_name)
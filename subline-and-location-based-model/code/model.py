@@ -1,10 +1,37 @@
 from util import *
 from travelRequests import TravelRequests
+from insertionHeuristic import InsertionHeuristic
 
-class Model:
+MAX_CUTS_PER_NODE = 50 # most violated lazy constraints added as user cuts per node relaxation
+
+class SolutionStatistics:
+    # statistics shared by the models and the ALNS, calculateStatistics is overwritten to compute them from a solution
+
+    def calculateStatistics(self):
+        self.avg_waiting_time = 0
+        self.avg_ride_time = 0
+        self.avg_transportation_time = 0
+        self.avg_detour_factor = 0
+        self.mean_occupancy = 0
+        self.share_empty_mileage = 0
+        self.system_efficiency = 0
+        self.pooling_factor = 0
+
+    def _printStatistics(self):
+        print("Average waiting time: {0}".format(self.avg_waiting_time))
+        print("Average ride time (of solution): {0}".format(self.avg_ride_time))
+        print("Average transportation time: {0}".format(self.avg_transportation_time))
+
+        print("Average detour factor: {0}".format(self.avg_detour_factor))
+        print("Mean occupancy: {0:g}".format(self.mean_occupancy))
+        print("Share empty mileage: {0:g}".format(self.share_empty_mileage))
+        print("System efficiency: {0:g}".format(self.system_efficiency))
+        print("Pooling factor: {0:g}".format(self.pooling_factor))
+
+class Model(SolutionStatistics):
 
     def __init__(self, requests: TravelRequests, num_stations: int, num_busses: int, Q_max: int, timeframe:float, alpha:int, beta:int,
-              speed:float = 1, t_turn:float = 0.5) -> None:
+              speed:float = 1, t_turn:float = 0.5, env: gp.Env = None) -> None:
         self.requests = requests
         self.num_stations = num_stations
         self.num_busses = num_busses
@@ -22,6 +49,12 @@ class Model:
         self.speed = speed
         self.t_turn = t_turn
 
+        self.familyBuildtimes = {}
+        self._setLazyConstraints(False)
+        self.cliques = []
+        # optional Gurobi environment shared by several models, e.g. by the solver service
+        self.env = env
+
         self._calculateConstants()
         self.model = self._initModel()
     
@@ -35,7 +68,23 @@ class Model:
             for key, value in params.items():
                 self.model.setParam(key, value)
 
-        self.model.optimize()  
+        # bound of the first relaxation solved at the root node, recorded by the callback
+        self.root_bound = None
+        if self.lazy_constrs:
+            self.model.setParam("LazyConstraints", 1)
+            if self.user_cuts:
+                # cuts are formulated in the original variables
+                self.model.setParam("PreCrush", 1)
+        self.model.optimize(self._callback)
+        if (self.root_bound is None) and (self.model.Status == GRB.OPTIMAL):
+            # solved before a root relaxation, e.g. in presolve
+            self.root_bound = self.model.ObjBound
+
+    def _callback(self, model: gp.Model, where: int):
+        if (where == GRB.Callback.MIPNODE) and (self.root_bound is None) and (model.cbGet(GRB.Callback.MIPNODE_NODCNT) == 0) and (model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL):
+            self.root_bound = model.cbGet(GRB.Callback.MIPNODE_OBJBND)
+        if self.lazy_constrs:
+            self._separate(model, where)
 
     def _initModel(self):
         pass
@@ -52,29 +101,135 @@ class Model:
     def _setObjective(self):
         pass
 
-    def postprocessing(self):
+    def _setLazyConstraints(self, lazy_constraints: bool, user_cuts: bool = False):
+        # lazy_constraints: the constraint families added by _addLazyConstr are left out of the model and only added when a new incumbent violates them,
+        # user_cuts: violated ones are also added as cuts to the relaxations of the tree nodes
+        self.lazy_constraints = lazy_constraints
+        self.user_cuts = user_cuts and lazy_constraints
+        self.lazy_constrs = []
+        self.num_lazy_added = 0
+        self.num_cuts_added = 0
+
+    def _addLazyConstr(self, expr: gp.LinExpr, name: str):
+        # expr <= 0
+        if self.lazy_constraints and (expr.size() > 0):
+            self.lazy_constrs.append((expr, name))
+        else:
+            self.model.addConstr(expr <= 0, name=name)
+
+    def _prepareLazyConstraints(self):
+        # the rows of all lazy constraints as one array of (variable, coefficient) entries, the callback checks them all at once
+        if not self.lazy_constrs:
+            return
+        self.model.update()
+        self.model_vars = self.model.getVars()
+        indices, coefficients, starts = [], [], []
+        for expr, name in self.lazy_constrs:
+            starts.append(len(indices))
+            for i in range(expr.size()):
+                indices.append(expr.getVar(i).index)
+                coefficients.append(expr.getCoeff(i))
+        self.lazy_indices = np.array(indices)
+        self.lazy_coefficients = np.array(coefficients)
+        self.lazy_starts = np.array(starts)
+        self.lazy_constants = np.array([expr.getConstant() for expr, name in self.lazy_constrs])
+        self.lazy_added = np.zeros(len(self.lazy_constrs), dtype=bool)
+
+    def _separate(self, model: gp.Model, where: int):
+        if where == GRB.Callback.MIPSOL:
+            values = np.array(model.cbGetSolution(self.model_vars))
+        elif self.user_cuts and (where == GRB.Callback.MIPNODE) and (model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL):
+            values = np.array(model.cbGetNodeRel(self.model_vars))
+        else:
+            return
+
+        violation = np.add.reduceat(self.lazy_coefficients * values[self.lazy_indices], self.lazy_starts) + self.lazy_constants
+        if where == GRB.Callback.MIPSOL:
+            # every violated constraint is added, an incumbent must satisfy all of them
+            for row in np.flatnonzero((violation > EPSILON) & ~self.lazy_added):
+                model.cbLazy(self.lazy_constrs[row][0] <= 0)
+                self.lazy_added[row] = True
+                self.num_lazy_added += 1
+        else:
+            violated = np.flatnonzero((violation > EPSILON) & ~self.lazy_added)
+            for row in violated[np.argsort(-violation[violated])][:MAX_CUTS_PER_NODE]:
+                model.cbCut(self.lazy_constrs[row][0] <= 0)
+                self.num_cuts_added += 1
+
+    def _printCuts(self, verboseprint):
+        if self.lazy_constraints:
+            verboseprint("Lazy constraints: {0} left out of the model, {1} added in the callback, {2} user cuts".format(len(self.lazy_constrs), self.num_lazy_added, self.num_cuts_added))
+        if self.cliques:
+            verboseprint("Clique cuts: {0} cliques of conflicting requests, largest with {1} requests".format(len(self.cliques), max(len(clique) for clique in self.cliques)))
+
+    def _insertionHeuristic(self) -> InsertionHeuristic:
+        # insertion heuristic with the parameters of this model, its plans are feasible for the model
+        return InsertionHeuristic(requests=self.requests, num_busses=self.num_busses, Q_max=self.Q_max, boarding_time=self.boarding_time, timeframe=self.max_travel_minutes,
+                                  alpha=self.alpha, beta=self.beta, speed=self.speed, t_turn=self.t_turn, obj_weights=self.objWeights, **self._heuristicOptions())
+
+    def _heuristicOptions(self) -> dict:
+        return {}
+
+    def _setStartFromHeuristic(self, heuristic: InsertionHeuristic):
         pass
 
-    def calculateStatistics(self):
-        self.avg_waiting_time = 0
-        self.avg_ride_time = 0
-        self.avg_transportation_time = 0
-        self.avg_detour_factor = 0
-        self.mean_occupancy = 0
-        self.share_empty_mileage = 0
-        self.system_efficiency = 0
-        self.pooling_factor = 0
-
-    def _printStatistics(self):
-        print("Average waiting time: {0}".format(self.avg_waiting_time))
-        print("Average ride time (of solution): {0}".format(self.avg_ride_time))
-        print("Average transportation time: {0}".format(self.avg_transportation_time))
+    def requestSchedule(self) -> dict:
+        # bus, pick-up time and drop-off time of every request served in the current solution
+        return {}
+
+    def optimizeFixed(self, heuristic: InsertionHeuristic, verbose = True, params: dict = None):
+        # solves the model with all integer variables fixed to the plan of the heuristic, afterwards the postprocessing reports the plan
+        self._setStartFromHeuristic(heuristic)
+        self.model.update()
+        for var in self.model.getVars():
+            if (var.VType != GRB.CONTINUOUS) and (var.Start != GRB.UNDEFINED):
+                var.LB = var.Start
+                var.UB = var.Start
+        self.optimize(verbose=verbose, params=params)
+
+    def _setStartValues(self, variables: gp.tupledict, values: dict):
+        # MIP start for all given variables at once
+        self.model.setAttr("Start", list(variables.values()), [values[key] for key in variables.keys()])
+
+    def _solutionValues(self, variables: gp.tupledict) -> np.ndarray:
+        # values of all given variables in the current solution with one attribute query, in the order of the keys
+        return np.array(self.model.getAttr("X", list(variables.values())))
+
+    def _selectedKeys(self, variables: gp.tupledict) -> List:
+        # keys of the binary variables set in the current solution, in the order of the keys
+        keys = list(variables.keys())
+        return [keys[idx] for idx in np.flatnonzero(np.rint(self._solutionValues(variables)) == 1)]
+
+    def _setLinearization(self, linearization: Optional[str]):
+        # None: bilinear constraints, "big_M": big M per constraint, "indicator": indicator constraints
+        if linearization not in [None, "big_M", "indicator"]:
+            raise ValueError("Linearization {0} was not recognized.".format(linearization))
+        self.linearization = linearization
+
+    @contextlib.contextmanager
+    def _timeFamily(self, name: str):
+        # accumulate the build time per constraint family
+        start_time = datetime.datetime.now()
+        yield
+        end_time = datetime.datetime.now()
+        self.familyBuildtimes[name] = self.familyBuildtimes.get(name, 0) + (end_time - start_time).total_seconds()
+
+    def _addConditionalConstr(self, binary_variables: List, lhs, rhs, big_M: float, name: str, lazy: bool = False):
+        # enforce lhs >= rhs if one of the binary variables is set, at most one of them may be set
+        num_used = gp.LinExpr([1] * len(binary_variables), binary_variables)
+        if lazy and self.lazy_constraints:
+            # lazy constraints have to be linear, they always use the big M
+            self._addLazyConstr(rhs - big_M * (1 - num_used) - lhs, name=name)
+        elif self.linearization is None:
+            self.model.addConstr(lhs >= rhs * num_used, name=name)
+        elif self.linearization == "big_M":
+            self.model.addConstr(lhs >= rhs - big_M * (1 - num_used), name=name)
+        else:
+            for var in binary_variables:
+                self.model.addConstr((var == 1) >> (lhs - rhs >= 0), name=name)
 
-        print("Average detour factor: {0}".format(self.avg_detour_factor))
-        print("Mean occupancy: {0:g}".format(self.mean_occupancy))
-        print("Share empty mileage: {0:g}".format(self.share_empty_mileage))
-        print("System efficiency: {0:g}".format(self.system_efficiency))
-        print("Pooling factor: {0:g}".format(self.pooling_factor))
+    def postprocessing(self):
+        pass
 
     def detailed_file(self, path, instance:str):
         output_path = os.path.join(path, "instance" + "_details.txt")
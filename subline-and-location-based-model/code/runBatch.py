@@ -0,0 +1,126 @@
+from util import *
+from darpModel import DARPModel
+from sublineModel import SublineModel
+from travelRequests import TravelRequests
+import multiprocessing
+import multiprocessing.connection
+
+# batch mode of main.py: every instance x model pair is solved in its own process, the cores are split between the running jobs.
+# a crashing job is recorded as failed and the remaining jobs continue, results are appended to the results table as soon as a job finishes
+
+RESULT_COLUMNS = ["instance", "model", "status", "objective", "MIP Gap", "Buildtime", "Runtime", "passengers accepted", "distance", "busses", "error"]
+
+obj_weights = [10,1]
+speed = 1
+time_to_turn = 0.5
+consider_shortcuts = True
+
+def solveJob(job: dict, threads: int, time_limit: float, connection):
+    # runs in the worker process, exceptions are sent back as a failed result
+    result = {"instance": job["instance"], "model": job["model"]}
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            parsed_requests = TravelRequests()
+            number_of_busses, max_time_in_minutes, bus_capacity, number_of_stations, service_time, alpha, beta = parsed_requests.read_file(
+                instance_file=job["request_file"], consider_shortcuts=consider_shortcuts, station_location_file=job["station_file"], distance_matrix_file=job["distance_matrix_file"],
+                instance_cache=job["instance_cache"])
+
+            model_class = SublineModel if job["model"] == "subline" else DARPModel
+            model = model_class(requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses, timeframe=max_time_in_minutes,
+                                boarding_time=service_time, Q_max=bus_capacity, speed=speed, t_turn=time_to_turn, alpha=alpha, beta=beta)
+            model.createModel(obj_weights=obj_weights)
+            model.optimize(verbose=False, params={"TimeLimit": time_limit, "Threads": threads})
+
+            result.update({"status": model.model.Status, "Buildtime": model.Buildtime, "Runtime": model.model.Runtime})
+            if model.model.SolCount > 0:
+                model.postprocessing(verbose=False)
+                result.update({"objective": model.model.ObjVal, "MIP Gap": model.model.MIPGap, "passengers accepted": model.num_pax_accepted,
+                               "distance": model.total_distance, "busses": model.z.sum().getValue()})
+    except Exception as e:
+        result.update({"status": "error", "error": repr(e)})
+    connection.send(result)
+    connection.close()
+
+def writeResult(result: dict, results_file: str):
+    row = pd.DataFrame([result], columns=RESULT_COLUMNS)
+    row.to_csv(results_file, mode="a", header=False, index=False)
+
+def runBatch(jobs: List[dict], num_workers: int, time_limit: float, results_file: str) -> pd.DataFrame:
+    # each job gets an equal share of the cores, at least one thread
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    # spawn: Gurobi environments must not be inherited by forked children
+    context = multiprocessing.get_context("spawn")
+
+    # start a new results table, rows are appended as the jobs finish
+    pd.DataFrame(columns=RESULT_COLUMNS).to_csv(results_file, index=False)
+
+    pending = list(reversed(jobs))
+    running = {}
+    results = []
+    while pending or running:
+        while pending and len(running) < num_workers:
+            job = pending.pop()
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=solveJob, args=(job, threads, time_limit, sender), daemon=True)
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, job, receiver)
+
+        for sentinel in multiprocessing.connection.wait(list(running)):
+            process, job, receiver = running.pop(sentinel)
+            process.join()
+            try:
+                result = receiver.recv()
+            except EOFError:
+                # the worker died without reporting, e.g. killed or crashed inside the solver
+                result = {"instance": job["instance"], "model": job["model"], "status": "crashed", "error": "exit code {0}".format(process.exitcode)}
+            receiver.close()
+
+            writeResult(result, results_file)
+            results.append(result)
+            print(SEPERATOR)
+            print("Finished {0} ({1}): status {2}, objective {3}".format(result["instance"], result["model"], result.get("status"), result.get("objective")))
+
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+if __name__ == "__main__":
+    station_file = None
+    distance_matrix_file = None
+
+    parser = argparse.ArgumentParser("runBatch.py")
+    parser.add_argument("requests", help="Path to request files.", type=str)
+    parser.add_argument("instance_mode", help="1: discrete line, 2: station locations, 3: distance matrix.", type=int, default=1,choices=[1,2,3])
+    parser.add_argument("--station_locations", help="Path to location / distance file name, in .txt format.", type=str, nargs="?", required=False)
+    parser.add_argument("--models", help="Formulations to solve.", type=str, nargs="+", default=["location", "subline"], choices=["location", "subline"])
+    parser.add_argument("--jobs", help="Number of jobs solved concurrently.", type=int, default=max(1, (os.cpu_count() or 1) // 4))
+    parser.add_argument("--time_limit", help="Time limit per solve in minutes.", type=float, default=60)
+    parser.add_argument("--output", help="Results table, in .csv format.", type=str, default=os.path.join("output", "batch_results.csv"))
+    parser.add_argument("--instance_cache", help="Directory of compiled instances, reused by later sweeps.", type=str, default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.requests):
+        raise ValueError("Path to request files does not exist.")
+    if (args.instance_mode == 2) or (args.instance_mode == 3):
+        if args.station_locations is None:
+            raise ValueError("Expected a location file when selecting instance_mode == {}.".format(args.instance_mode))
+        if not os.path.exists(args.station_locations):
+            raise ValueError("Path to location file does not exist.")
+        if (args.instance_mode == 2):
+            station_file = args.station_locations
+        else:
+            distance_matrix_file = args.station_locations
+    if args.jobs < 1:
+        raise ValueError("At least one job has to run at a time.")
+
+    jobs = [{"instance": request_name, "model": model, "request_file": os.path.join(args.requests, request_name),
+             "station_file": station_file, "distance_matrix_file": distance_matrix_file, "instance_cache": args.instance_cache}
+            for request_name in sorted(os.listdir(args.requests)) if request_name != args.station_locations
+            for model in args.models]
+
+    output_folder = os.path.dirname(args.output)
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+
+    results = runBatch(jobs, num_workers=args.jobs, time_limit=args.time_limit * 60, results_file=args.output)
+    print(SEPERATOR)
+    print(results[["instance", "model", "status", "objective", "MIP Gap", "Runtime"]].to_string(index=False))
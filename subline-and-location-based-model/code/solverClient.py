@@ -0,0 +1,37 @@
+import argparse
+import json
+import urllib.request
+import urllib.error
+
+# test client for solverService.py: sends one instance in the usual request / location / distance formats and prints the returned solution
+
+def solve(url: str, payload: dict) -> dict:
+    request = urllib.request.Request(url + "/solve", data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+
+def readText(path: str) -> str:
+    with open(path, "r") as file:
+        return file.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("solverClient.py")
+    parser.add_argument("requests", help="Path to request file.", type=str)
+    parser.add_argument("instance_mode", help="1: discrete line, 2: station locations, 3: distance matrix.", type=int, default=1,choices=[1,2,3])
+    parser.add_argument("--station_locations", help="Path to location / distance file name, in .txt format.", type=str, nargs="?", required=False)
+    parser.add_argument("--model", help="Formulation to solve.", type=str, default="location", choices=["location", "subline", "subline_matrix"])
+    parser.add_argument("--options", help="Keyword arguments of createModel as JSON, e.g. '{\"linearization\": \"indicator\"}'.", type=str, default="{}")
+    parser.add_argument("--time_limit", help="Time limit in minutes.", type=float, default=60)
+    parser.add_argument("--url", help="Address of the solver service.", type=str, default="http://localhost:8765")
+    args = parser.parse_args()
+
+    payload = {"requests": readText(args.requests), "model": args.model, "options": json.loads(args.options), "time_limit": args.time_limit}
+    if args.instance_mode == 2:
+        payload["station_locations"] = readText(args.station_locations)
+    elif args.instance_mode == 3:
+        payload["distance_matrix"] = readText(args.station_locations)
+
+    print(json.dumps(solve(args.url, payload), indent=2))
@@ -0,0 +1,153 @@
+from util import *
+from darpModel import DARPModel
+from sublineModel import SublineModel
+from sublineMatrixModel import SublineMatrixModel
+from travelRequests import TravelRequests
+import hashlib
+import inspect
+import json
+import tempfile
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# long-running solver process: instances are posted as JSON to http://localhost:<port>/solve and the solution is returned as JSON.
+# all models are built in one shared Gurobi environment (the license is checked out once) and the distances of a station / distance file
+# are cached across requests. the server handles one request at a time, so the shared environment is never used concurrently
+
+MODELS = {"location": DARPModel, "subline": SublineModel, "subline_matrix": SublineMatrixModel}
+
+obj_weights = [10,1]
+speed = 1
+time_to_turn = 0.5
+consider_shortcuts = True
+
+def modelOptions(model_class) -> List[str]:
+    # keyword arguments of createModel besides obj_weights, the models ignore others that end up in **kwargs
+    parameters = inspect.signature(model_class.createModel).parameters.values()
+    return [parameter.name for parameter in parameters if (parameter.kind == parameter.POSITIONAL_OR_KEYWORD) and (parameter.name not in ["self", "obj_weights"])]
+
+def toJson(value):
+    # tuple keys and numpy values of the postprocessing results are not serializable as they are
+    if isinstance(value, dict):
+        return {str(key): toJson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [toJson(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+class SolverService:
+    def __init__(self, work_dir: str, params: dict = None):
+        self.env = gp.Env(params=params or {})
+        self.work_dir = work_dir
+        self.distance_cache = {}
+        self.num_solved = 0
+
+    def _writeInput(self, content: str, prefix: str) -> str:
+        # inputs sent as text are stored by content, an unchanged station file keeps its path and hits the distance cache
+        digest = hashlib.sha1(content.encode()).hexdigest()
+        path = os.path.join(self.work_dir, "{0}_{1}.txt".format(prefix, digest))
+        if not os.path.exists(path):
+            with open(path, "w") as file:
+                file.write(content)
+        return path
+
+    def _inputFile(self, payload: dict, name: str) -> str:
+        # every input is either given as a path on this machine or as the file content
+        if payload.get(name + "_file") is not None:
+            if not os.path.exists(payload[name + "_file"]):
+                raise ValueError("Path to {0} file does not exist.".format(name))
+            return payload[name + "_file"]
+        if payload.get(name) is not None:
+            return self._writeInput(payload[name], prefix=name)
+        return None
+
+    def solve(self, payload: dict) -> dict:
+        model_name = payload.get("model", "location")
+        if model_name not in MODELS:
+            raise ValueError("Unknown model {0}, choose from {1}.".format(model_name, list(MODELS)))
+        options = payload.get("options", {})
+        unknown_options = [name for name in options if name not in modelOptions(MODELS[model_name])]
+        if unknown_options:
+            raise ValueError("Unknown options {0} for model {1}, choose from {2}.".format(unknown_options, model_name, modelOptions(MODELS[model_name])))
+
+        request_file = self._inputFile(payload, "requests")
+        if request_file is None:
+            raise ValueError("Expected the requests as 'requests' or 'requests_file'.")
+        station_file = self._inputFile(payload, "station_locations")
+        distance_matrix_file = self._inputFile(payload, "distance_matrix")
+
+        parsed_requests = TravelRequests()
+        number_of_busses, max_time_in_minutes, bus_capacity, number_of_stations, service_time, alpha, beta = parsed_requests.read_file(
+            instance_file=request_file, consider_shortcuts=payload.get("consider_shortcuts", consider_shortcuts),
+            station_location_file=station_file, distance_matrix_file=distance_matrix_file, distance_cache=self.distance_cache)
+
+        model = MODELS[model_name](requests=parsed_requests, num_stations=number_of_stations, num_busses=number_of_busses, timeframe=max_time_in_minutes,
+                                   boarding_time=service_time, Q_max=bus_capacity, speed=payload.get("speed", speed), t_turn=payload.get("t_turn", time_to_turn),
+                                   alpha=alpha, beta=beta, env=self.env)
+        model.createModel(obj_weights=payload.get("obj_weights", obj_weights), **options)
+        params = {"TimeLimit": payload.get("time_limit", 60) * 60}
+        params.update(payload.get("params", {}))
+        model.optimize(verbose=False, params=params)
+        self.num_solved += 1
+
+        result = {"model": model_name, "status": model.model.Status, "Buildtime": model.Buildtime, "Runtime": model.model.Runtime}
+        if model.model.SolCount > 0:
+            model.postprocessing(verbose=False)
+            result.update({"objective": model.model.ObjVal, "MIP Gap": model.model.MIPGap, "passengers accepted": model.num_pax_accepted,
+                           "distance": model.total_distance, "busses": model.z.sum().getValue(), "paths": model.paths})
+        model.model.dispose()
+        return toJson(result)
+
+class SolverRequestHandler(BaseHTTPRequestHandler):
+    def _sendJson(self, code: int, content: dict):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._sendJson(404, {"error": "unknown path {0}".format(self.path)})
+            return
+        self._sendJson(200, {"status": "ok", "solved": self.server.service.num_solved, "cached distances": len(self.server.service.distance_cache)})
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self._sendJson(404, {"error": "unknown path {0}".format(self.path)})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = self.server.service.solve(payload)
+        except (ValueError, SyntaxError, KeyError, TypeError) as e:
+            # invalid instance or options, the service keeps running
+            self._sendJson(400, {"status": "error", "error": repr(e)})
+            return
+        except Exception as e:
+            self._sendJson(500, {"status": "error", "error": repr(e)})
+            return
+        self._sendJson(200, result)
+
+def runService(port: int, threads: int = None):
+    params = {"Threads": threads} if threads else {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = HTTPServer(("localhost", port), SolverRequestHandler)
+        server.service = SolverService(work_dir=work_dir, params=params)
+        print("Solver service listening on http://localhost:{0}".format(port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.service.env.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("solverService.py")
+    parser.add_argument("--port", help="Port on localhost.", type=int, default=8765)
+    parser.add_argument("--threads", help="Threads per solve, all cores if not given.", type=int, required=False)
+    args = parser.parse_args()
+
+    runService(port=args.port, threads=args.threads)
@@ -0,0 +1,328 @@
+from util import *
+from sublineModel import SublineModel
+from model import SolutionStatistics
+
+# branch-and-price for the Subline-Based formulation. a column is the rotation of one bus: its sublines (services) and the requests they serve.
+# the master problem selects at most num_busses rotations such that every request is served at most once. new rotations are priced by the
+# Subline-Based model of a single bus with the duals in its objective, i.e. a resource-constrained shortest path along the line (time windows,
+# capacity, ride times, turns). fractional master solutions are branched on pairs of requests (served by the same bus or not, Ryan-Foster)
+# or on a single request (served or not). all busses are identical here, so the symmetry breaking of the compact model is not needed
+
+class SublineColumnGeneration(SublineModel):
+    def _initModel(self):
+        return gp.Model(self.name + " master", env=self.env)
+
+    def createModel(self, obj_weights: List, linearization: Optional[str] = None, tighten_big_M: bool = False, warm_start: bool = False,
+                    lazy_constraints: bool = False, user_cuts: bool = False, clique_cuts: bool = False):
+        # linearization and tighten_big_M apply to the pricing model. the heuristic plan always gives the first columns,
+        # warm starts, lazy constraints, user cuts and clique cuts of the compact model are not supported
+        if warm_start or lazy_constraints or user_cuts or clique_cuts:
+            raise ValueError("Warm starts, lazy constraints, user cuts and clique cuts are not supported by the column generation, use SublineModel.")
+        start_time = datetime.datetime.now()
+        self.objWeights = obj_weights
+
+        # pricing problem: one bus, the objective is set per iteration
+        self.pricing = SublineModel(requests=self.requests, num_stations=self.num_stations, num_busses=1, Q_max=self.Q_max, timeframe=self.max_travel_minutes,
+                                    alpha=self.alpha, beta=self.beta, speed=self.speed, t_turn=self.t_turn, boarding_time=self.boarding_time, env=self.env)
+        self.pricing.createModel(obj_weights=obj_weights, linearization=linearization, tighten_big_M=tighten_big_M)
+        self.pricing.model.setParam("OutputFlag", 0)
+        self.served = {r: self.pricing.assign_asc.sum(r, "*", 0) for r in self.R_asc}
+        self.served.update({r: self.pricing.assign_desc.sum(r, "*", 0) for r in self.R_desc})
+        self.branching_constrs = []
+
+        # master problem
+        self.columns = []
+        self.column_keys = set()
+        self.cover = {r: self.model.addConstr(gp.LinExpr() <= 1, name="serve_max_once[{0}]".format(r)) for r in self.R}
+        self.num_busses_constr = self.model.addConstr(gp.LinExpr() <= self.num_busses, name="num_busses")
+        self.served_constrs = []
+        self.artificials = []
+        self.model.ModelSense = GRB.MAXIMIZE
+        self.model.setParam("OutputFlag", 0)
+        # penalty of the artificial variables which keep the master feasible when a request has to be served
+        self.penalty = 1 + float(sum((self.objWeights[0] + self.objWeights[1] * self.c_direct[r]) * self.demands[r] for r in self.R))
+
+        # the rotations of the insertion heuristic are the first columns
+        heuristic = self._insertionHeuristic().solve()
+        for k, legs in enumerate(heuristic.routes):
+            if legs:
+                services = [requests for stations, requests in heuristic.getServices(k, legs)]
+                self._addColumn(services, heuristic.ends[k][-1][3])
+
+        end_time = datetime.datetime.now()
+        self.Buildtime = (end_time - start_time).total_seconds()
+
+    def _heuristicOptions(self) -> dict:
+        # busses are identical in the master problem
+        return {"num_services": self.num_services, "horizon": self.T}
+
+    def _addColumn(self, services: List[List[int]], distance: float) -> bool:
+        requests = frozenset(itertools.chain.from_iterable(services))
+        key = (requests, round(distance, 6))
+        if key in self.column_keys:
+            return False
+        self.column_keys.add(key)
+
+        value = sum((self.objWeights[0] + self.objWeights[1] * self.c_direct[r]) * self.demands[r] for r in requests) - self.objWeights[1] * distance
+        constrs = [self.cover[r] for r in requests] + [self.num_busses_constr]
+        # a request that has to be served in the current node
+        constrs += [constr for r, constr, artificial in self.artificials if r in requests]
+        # no upper bound, its dual would be missing in the pricing. a rotation is chosen at most once because of serve_max_once
+        var = self.model.addVar(lb=0, obj=value, column=gp.Column([1] * len(constrs), constrs), name="rotation[{0}]".format(len(self.columns)))
+        self.columns.append({"requests": requests, "services": services, "distance": distance, "value": value, "var": var})
+        return True
+
+    def optimize(self, verbose = True, params: dict = None):
+        verboseprint = print if verbose else lambda *a, **k: None
+        start_time = datetime.datetime.now()
+        params = dict(params or {})
+        self.time_limit = params.pop("TimeLimit", GRB.INFINITY)
+        for key, value in params.items():
+            self.model.setParam(key, value)
+            self.pricing.model.setParam(key, value)
+        self.start_time = start_time
+
+        self.objective, self.best_columns = -GRB.INFINITY, []
+        self.bound = GRB.INFINITY
+        self.num_nodes = 0
+        self.root_bound = None
+        self.num_pricing_iterations = 0
+        self.timed_out = False
+
+        # depth first search, a node is a list of branching decisions with the bound of its parent
+        open_nodes = [([], GRB.INFINITY)]
+        while open_nodes:
+            decisions, parent_bound = open_nodes.pop()
+            if parent_bound <= self.objective + EPSILON:
+                continue
+            self.num_nodes += 1
+            node_bound, solution = self._solveNode(decisions)
+            if self.timed_out:
+                open_nodes.append((decisions, min(parent_bound, node_bound)))
+                break
+            if self.num_nodes == 1:
+                self.root_bound = node_bound
+                self._solveRestrictedMaster()
+            if (solution is None) or (node_bound <= self.objective + EPSILON):
+                continue
+
+            branch = self._branchingCandidate(solution)
+            if branch is None:
+                # fractional rotations only mix rotations serving the same requests, the best of them is at least as good
+                best = {}
+                for column, value in solution:
+                    if (column["requests"] not in best) or (column["value"] > best[column["requests"]]["value"]):
+                        best[column["requests"]] = column
+                self._updateIncumbent(list(best.values()))
+                continue
+            verboseprint("Node {0}: bound {1}, incumbent {2}, columns {3}, branching on {4}".format(self.num_nodes, round(node_bound, 4), round(self.objective, 4), len(self.columns), branch))
+            for decision in branch:
+                open_nodes.append((decisions + [decision], node_bound))
+
+        self._resetDecisions()
+        if self.timed_out:
+            # the restricted master over all columns found so far
+            self._solveRestrictedMaster()
+        self.bound = max([bound for decisions, bound in open_nodes] + [self.objective])
+        self.MIPGap = abs(self.bound - self.objective) / max(abs(self.objective), EPSILON) if self.best_columns else GRB.INFINITY
+        self.Runtime = (datetime.datetime.now() - start_time).total_seconds()
+
+    def _remainingTime(self) -> float:
+        return self.time_limit - (datetime.datetime.now() - self.start_time).total_seconds()
+
+    def _solveNode(self, decisions: List[tuple]) -> tuple:
+        # column generation under the branching decisions. returns an upper bound of the node and the master solution (None if infeasible)
+        self._applyDecisions(decisions)
+        node_bound = GRB.INFINITY
+        while True:
+            if self._remainingTime() <= 0:
+                self.timed_out = True
+                return node_bound, None
+            self.model.setParam("TimeLimit", self._remainingTime())
+            self.model.optimize()
+            if self.model.Status != GRB.OPTIMAL:
+                self.timed_out = self.model.Status == GRB.TIME_LIMIT
+                return node_bound, None
+
+            # pricing: reduced cost of a rotation = value - duals of the served requests - dual of the bus limit
+            duals = {r: self.cover[r].Pi for r in self.R}
+            for r, constr in self.served_constrs:
+                duals[r] += constr.Pi
+            self.pricing.model.setObjective(gp.quicksum(((self.objWeights[0] + self.objWeights[1] * self.c_direct[r]) * self.demands[r] - duals[r]) * self.served[r] for r in self.R)
+                                            - self.objWeights[1] * self.pricing.total_distance - self.num_busses_constr.Pi, GRB.MAXIMIZE)
+            # stop as soon as a rotation improves the master or no rotation can
+            self.pricing.model.setParam("BestObjStop", EPSILON)
+            self.pricing.model.setParam("BestBdStop", EPSILON)
+            self.pricing.model.setParam("TimeLimit", max(self._remainingTime(), 0))
+            self.pricing.model.optimize()
+            self.num_pricing_iterations += 1
+
+            # Lagrangian bound: each of the at most num_busses rotations improves the master by at most the max. reduced cost
+            if self.pricing.model.Status in [GRB.OPTIMAL, GRB.USER_OBJ_LIMIT, GRB.TIME_LIMIT, GRB.SOLUTION_LIMIT, GRB.INTERRUPTED]:
+                node_bound = min(node_bound, self.model.ObjVal + self.num_busses * max(0, self.pricing.model.ObjBound))
+
+            added = self._addPricedColumns()
+            if not added:
+                if self.pricing.model.ObjBound > EPSILON:
+                    # pricing stopped without a new rotation and without a proof
+                    self.timed_out = True
+                    return node_bound, None
+                node_bound = self.model.ObjVal
+                break
+
+        if any(var.X > EPSILON for r, constr, var in self.artificials):
+            # a request that has to be served cannot be served
+            return node_bound, None
+        solution = [(column, column["var"].X) for column in self.columns if column["var"].X > EPSILON]
+        return node_bound, solution
+
+    def _addPricedColumns(self) -> int:
+        added = 0
+        for n in range(self.pricing.model.SolCount):
+            self.pricing.model.setParam("SolutionNumber", n)
+            if self.pricing.model.PoolObjVal <= EPSILON:
+                continue
+            services = [[] for _ in self.S]
+            for assign in [self.pricing.assign_asc, self.pricing.assign_desc]:
+                for (r,s,k), var in assign.items():
+                    if var.Xn > 0.5:
+                        services[s].append(r)
+            distance = sum(self.c[i,j] for (i,j,s,k), var in self.pricing.x.items() if (i != j) and (var.Xn > 0.5))
+            added += self._addColumn(services, distance)
+        return added
+
+    def _applyDecisions(self, decisions: List[tuple]):
+        # master: rotations violating a decision are fixed to 0, pricing: the decisions are added as constraints
+        self._resetDecisions()
+        self.artificials = []
+        for decision in decisions:
+            kind, requests = decision[0], decision[1:]
+            if kind == "together":
+                p, r = requests
+                self.branching_constrs.append(self.pricing.model.addConstr(self.served[p] == self.served[r]))
+            elif kind == "apart":
+                p, r = requests
+                self.branching_constrs.append(self.pricing.model.addConstr(self.served[p] + self.served[r] <= 1))
+            elif kind == "unserved":
+                self.branching_constrs.append(self.pricing.model.addConstr(self.served[requests[0]] == 0))
+            else:
+                r = requests[0]
+                var = self.model.addVar(obj=-self.penalty, name="artificial[{0}]".format(r))
+                constr = self.model.addConstr(gp.quicksum(column["var"] for column in self.columns if r in column["requests"]) + var >= 1, name="served[{0}]".format(r))
+                self.served_constrs.append((r, constr))
+                self.artificials.append((r, constr, var))
+        for column in self.columns:
+            if not all(self._respects(column["requests"], decision) for decision in decisions):
+                column["var"].UB = 0
+
+    def _respects(self, requests: frozenset, decision: tuple) -> bool:
+        kind = decision[0]
+        if kind == "together":
+            return (decision[1] in requests) == (decision[2] in requests)
+        if kind == "apart":
+            return not ((decision[1] in requests) and (decision[2] in requests))
+        if kind == "unserved":
+            return decision[1] not in requests
+        return True
+
+    def _resetDecisions(self):
+        for constr in self.branching_constrs:
+            self.pricing.model.remove(constr)
+        self.branching_constrs = []
+        for r, constr, var in self.artificials:
+            self.model.remove(constr)
+            self.model.remove(var)
+        self.artificials = []
+        self.served_constrs = []
+        for column in self.columns:
+            column["var"].UB = GRB.INFINITY
+        self.model.update()
+        self.pricing.model.update()
+
+    def _branchingCandidate(self, solution: List[tuple]) -> Optional[List[tuple]]:
+        # the pair of requests whose share on a common bus is closest to 1/2, else the request whose coverage is closest to 1/2
+        together = {}
+        coverage = {}
+        for column, value in solution:
+            requests = sorted(column["requests"])
+            for r in requests:
+                coverage[r] = coverage.get(r, 0) + value
+            for pair in itertools.combinations(requests, 2):
+                together[pair] = together.get(pair, 0) + value
+
+        fractional_pairs = [(abs(value - 0.5), pair) for pair, value in together.items() if EPSILON < value < 1 - EPSILON]
+        if fractional_pairs:
+            p, r = min(fractional_pairs)[1]
+            return [("apart", p, r), ("together", p, r)]
+        fractional_requests = [(abs(value - 0.5), r) for r, value in coverage.items() if EPSILON < value < 1 - EPSILON]
+        if fractional_requests:
+            r = min(fractional_requests)[1]
+            return [("unserved", r), ("served", r)]
+        return None
+
+    def _solveRestrictedMaster(self):
+        # integer master over the columns found so far, gives a feasible solution
+        if self._remainingTime() <= 0 and self.best_columns:
+            return
+        variables = [column["var"] for column in self.columns]
+        self.model.setAttr("VType", variables, [GRB.BINARY] * len(variables))
+        self.model.setParam("TimeLimit", max(self._remainingTime(), 1))
+        self.model.optimize()
+        if self.model.SolCount > 0:
+            self._updateIncumbent([column for column in self.columns if column["var"].X > 0.5])
+        self.model.setAttr("VType", variables, [GRB.CONTINUOUS] * len(variables))
+
+    def _updateIncumbent(self, columns: List[dict]):
+        objective = sum(column["value"] for column in columns)
+        if objective > self.objective + EPSILON:
+            self.objective = objective
+            self.best_columns = columns
+
+    def postprocessing(self, verbose = True):
+        verboseprint = print if verbose else lambda *a, **k: None
+
+        self.num_pax_accepted = sum(self.demands[r] for column in self.best_columns for r in column["requests"])
+        self.total_distance = sum(column["distance"] for column in self.best_columns)
+        self.pax_km = sum(self.c_direct[r] * self.demands[r] for column in self.best_columns for r in column["requests"])
+        self.required_busses = len(self.best_columns)
+        self.num_pax_rejected = sum(self.demands) - self.num_pax_accepted
+        # the columns carry no stop times, the time based statistics are not available
+        SolutionStatistics.calculateStatistics(self)
+
+        verboseprint(SEPERATOR)
+        verboseprint("RESULTS")
+        verboseprint(SEPERATOR)
+        verboseprint("Objective Value:", self.objective)
+        verboseprint("Upper bound:", self.bound, "(root: {0})".format(self.root_bound))
+        verboseprint(SEPERATOR)
+        verboseprint("Buildtime:", round(self.Buildtime, 4))
+        verboseprint("Runtime:", round(self.Runtime, 4))
+        verboseprint("MIP Gap:", self.MIPGap)
+        verboseprint("Branch-and-price nodes:", self.num_nodes)
+        verboseprint("Pricing iterations:", self.num_pricing_iterations)
+        verboseprint("Columns:", len(self.columns))
+        verboseprint(SEPERATOR)
+        verboseprint("Number of busses required:", self.required_busses)
+        verboseprint("Number of passengers served overall:", self.num_pax_accepted)
+        verboseprint("Distance driven:", self.total_distance)
+        verboseprint("Passenger km saved:", self.pax_km)
+        for k, column in enumerate(self.best_columns):
+            verboseprint("Bus", k, ":", {s: requests for s, requests in enumerate(column["services"]) if requests})
+
+    def detailed_file(self, path, instance:str):
+        output_path = os.path.join(path, "instance" + "_details.txt")
+
+        try:
+            f = open(output_path, "w")
+        except FileNotFoundError as e:
+            print("Error when opening detail file.")
+            raise e
+        else:
+            f.write(instance + "\n")
+            f.write("total time & model time & nodes & MIP Gap\n")
+            f.write("{0} & {1} & {2} & {3}\n".format(self.Runtime, self.Buildtime, self.num_nodes, self.MIPGap))
+            f.write("obj value & total routing costs & rejected requests & amount of vehicles & direct pax km\n")
+            f.write("{0} & {1} & {2} & {3} & {4}\n".format(self.objective, self.total_distance, self.num_pax_rejected, self.required_busses, self.pax_km))
+            f.close()
+
+        print("Detail file saved succesfully.")
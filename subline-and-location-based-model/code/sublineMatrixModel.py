@@ -0,0 +1,299 @@
+from util import *
+from sublineModel import SublineModel
+import scipy.sparse as sp
+
+class SublineMatrixModel(SublineModel):
+    # Subline-Based model built with Gurobi's matrix API: the variables are MVar blocks indexed by (station, service, vehicle)
+    # and every constraint family of SublineModel.createModel is added in one addMConstr call.
+    # The tupledicts of SublineModel are kept as views on the MVar blocks, so that postprocessing is shared.
+
+    def createModel(self, obj_weights: List, linearization: Optional[str] = None, tighten_big_M: bool = False, warm_start: bool = False, **kwargs):
+        if kwargs.get("lazy_constraints") or kwargs.get("clique_cuts"):
+            raise ValueError("Lazy constraints and clique cuts are not supported by the matrix API build, use SublineModel.")
+        start_time = datetime.datetime.now()
+        self.objWeights = obj_weights
+        self._setLinearization(linearization)
+        self.tighten_big_M = tighten_big_M
+        if self.tighten_big_M:
+            # arrival and departure times are bounded by T
+            self.big_M = self.T
+
+        self._addMatrixVariables()
+        self._setMatrixObjective()
+
+        self._addBusConstraints()
+        self._addRoutingConstraints()
+        for direction in ["asc", "desc"]:
+            self._addServiceConstraints(direction)
+        self._addRequestConstraints()
+
+        end_time = datetime.datetime.now()
+        self.Buildtime = (end_time - start_time).total_seconds()
+
+        if warm_start:
+            self._warmStart()
+
+    def _addMatrixVariables(self):
+        num_H, num_S, num_K = len(self.H), len(self.S), len(self.K)
+        self.R_asc_idx = {r : idx for idx, r in enumerate(self.R_asc)}
+        self.R_desc_idx = {r : idx for idx, r in enumerate(self.R_desc)}
+
+        # stations are indexed by i-1, services of one direction by s // 2
+        blocks = {
+            "y": ((num_H, num_S, num_K), GRB.BINARY, 0, [self.H, self.S, self.K]),
+            "start_node": ((num_H, num_K), GRB.BINARY, 0, [self.H, self.K]),
+            "end_node": ((num_H, num_K), GRB.BINARY, 0, [self.H, self.K]),
+            "x": ((num_H, num_H, num_S, num_K), GRB.BINARY, 0, [self.H, self.H, self.S, self.K]),
+            "z": ((num_K,), GRB.BINARY, 0, [self.K]),
+            "depTime": ((num_H, num_S, num_K), GRB.CONTINUOUS, self.T, [self.H, self.S, self.K]),
+            "arrTime": ((num_H, num_S, num_K), GRB.CONTINUOUS, self.T, [self.H, self.S, self.K]),
+            "assign_asc": ((len(self.R_asc), len(self.S_asc), num_K), GRB.BINARY, 0, [self.R_asc, self.S_asc, self.K]),
+            "assign_desc": ((len(self.R_desc), len(self.S_desc), num_K), GRB.BINARY, 0, [self.R_desc, self.S_desc, self.K]),
+            "w_asc": ((len(self.asc_pairs_sharing_stations), len(self.S_asc), num_K), GRB.BINARY, 0, [self.asc_pairs_sharing_stations, self.S_asc, self.K]),
+            "w_desc": ((len(self.desc_pairs_sharing_stations), len(self.S_desc), num_K), GRB.BINARY, 0, [self.desc_pairs_sharing_stations, self.S_desc, self.K]),
+            "pickupTime": ((self.num_requests,), GRB.CONTINUOUS, self.T, [self.R]),
+            "dropoffTime": ((self.num_requests,), GRB.CONTINUOUS, self.T, [self.R]),
+        }
+
+        mvars = {name : self.model.addMVar(shape, vtype=vtype, ub=(1 if vtype == GRB.BINARY else ub), name=name) for name, (shape, vtype, ub, _) in blocks.items()}
+        self.model.update()
+
+        # column of every variable in the constraint matrix, the variables of one MVar are consecutive
+        self.columns = {}
+        for name, (shape, _, _, index_sets) in blocks.items():
+            variables = mvars[name].reshape(-1).tolist()
+            offset = variables[0].index if variables else 0
+            self.columns[name] = offset + np.arange(int(np.prod(shape))).reshape(shape)
+            keys = [key[0] if len(key) == 1 else key for key in itertools.product(*index_sets)]
+            # w is keyed by (p,r,s,k)
+            if name in ["w_asc", "w_desc"]:
+                keys = [(p, r, s, k) for ((p, r), s, k) in keys]
+            setattr(self, name, gp.tupledict(zip(keys, variables)))
+        self.all_vars = gp.MVar.fromlist(self.model.getVars())
+
+    def _addMConstrs(self, shape: tuple, terms: List[tuple], sense: str, rhs, name: str):
+        # adds one row per element of shape, each term is (coefficients, columns): both broadcast to shape,
+        # trailing axes of columns beyond shape are summed up
+        num_rows = int(np.prod(shape))
+        if num_rows == 0:
+            return
+        rows = np.arange(num_rows).reshape(shape)
+
+        data, row_idx, col_idx = [], [], []
+        for coefficients, columns in terms:
+            columns = np.asarray(columns)
+            extra_axes = (1,) * (columns.ndim - len(shape))
+            r, c, v = np.broadcast_arrays(rows.reshape(shape + extra_axes), columns, np.asarray(coefficients, dtype=float))
+            data.append(v.ravel())
+            row_idx.append(r.ravel())
+            col_idx.append(c.ravel())
+
+        A = sp.csr_matrix((np.concatenate(data), (np.concatenate(row_idx), np.concatenate(col_idx))), shape=(num_rows, self.model.NumVars))
+        A.eliminate_zeros()
+        self.model.addMConstr(A, self.all_vars, sense, np.broadcast_to(np.asarray(rhs, dtype=float), shape).ravel(), name=name)
+
+    def _setMatrixObjective(self):
+        assign = [(self.R_asc, self.assign_asc), (self.R_desc, self.assign_desc)]
+        assign_vars = [var for _, assign_dir in assign for var in assign_dir.values()]
+        self.num_pax_accepted = gp.LinExpr([float(self.demands[r]) for _, assign_dir in assign for (r, s, k) in assign_dir.keys()], assign_vars)
+        self.pax_km = gp.LinExpr([float(self.c_direct[r] * self.demands[r]) for _, assign_dir in assign for (r, s, k) in assign_dir.keys()], assign_vars)
+
+        drive_keys = [(i, j, s, k) for (i, j) in self.drive_edges for s in self.S for k in self.K]
+        self.total_distance = gp.LinExpr([float(self.c[i,j]) for (i, j, s, k) in drive_keys], [self.x[key] for key in drive_keys])
+        self.saved_distance = self.pax_km - self.total_distance
+
+        obj_func = self.objWeights[0] * self.num_pax_accepted + self.objWeights[1] * self.saved_distance
+        self.model.setObjective(obj_func, GRB.MAXIMIZE)
+
+    def _addBusConstraints(self):
+        num_H, num_K = len(self.H), len(self.K)
+        start, end, z = self.columns["start_node"], self.columns["end_node"], self.columns["z"]
+
+        self._addMConstrs((num_K,), [(1, start.T)], GRB.LESS_EQUAL, 1, name="use_each_bus_max_once") # each bus used max. once
+        self._addMConstrs((num_K,), [(1, end.T), (-1, start.T)], GRB.EQUAL, 0, name="bus_origin_=_destination") # each bus ends if it is started
+        self._addMConstrs((num_K,), [(1, z), (-1, start.T)], GRB.EQUAL, 0, name="define_z") # define variable z
+        self._addMConstrs((num_K - 1,), [(1, z[1:]), (-1, z[:-1])], GRB.LESS_EQUAL, 0, name="symm_break_smaller_buses_first") # symmetry breaking: use smaller numbered busses first
+
+        # symmetry breaking: smaller vehicles start at smaller stations, sum over j < i
+        prev_stations = np.tril(np.ones((num_H, num_H)), -1)
+        self._addMConstrs((num_H, num_K - 1), [(1, start[:,:-1]), (-prev_stations[:,None,:], start.T[None,1:,:])], GRB.GREATER_EQUAL, 0,
+                          name="symm_breaking:smaller_vehicles_start_earlier")
+
+    def _addRoutingConstraints(self):
+        num_H, num_S, num_K = len(self.H), len(self.S), len(self.K)
+        y, x, z = self.columns["y"], self.columns["x"], self.columns["z"]
+        start, end = self.columns["start_node"], self.columns["end_node"]
+        dep, arr = self.columns["depTime"], self.columns["arrTime"]
+        turns = x[np.arange(num_H), np.arange(num_H)] # (i, s, k)
+        lower = np.tril(np.ones((num_H, num_H)), -1) # j < i
+        upper = lower.T # j > i
+        x_out_sum = x.transpose(0, 2, 3, 1) # (i, s, k, j) for x[i,j]
+        x_in_sum = x.transpose(1, 2, 3, 0) # (i, s, k, j) for x[j,i]
+        last = num_S - 1
+
+        self._addMConstrs((num_S - 1, num_K), [(1, turns[:,:-1].transpose(1, 2, 0)), (-1, start.T[None])], GRB.EQUAL, 0, name="turn_only_if_started") # ensure all turning busses have been started
+        # as in SublineModel.createModel, this uses the last service of the loop above
+        self._addMConstrs((num_H, num_H, num_K), [(1, z[None,None,:]), (-1, x[:,:,last - 1,:])], GRB.GREATER_EQUAL, 0, name="drive_only_if_used") # vehicle cannot drive if not in use
+
+        self._addMConstrs((num_H, num_K), [(1, turns[:,last])], GRB.EQUAL, 0, name="last_bus_does_not_turn") # last bus does not turn
+        self._addMConstrs((num_H, num_K), [(1, y[:,0]), (-1, start), (-lower[:,None,:], x_in_sum[:,0])], GRB.EQUAL, 0,
+                          name="first_service_has_predecessor_or_is_start_node") # each stop on the first service has predecessor or is start_node
+        self._addMConstrs((num_H, num_K), [(1, y[:,last]), (-1, end), (-lower[:,None,:], x_out_sum[:,last])], GRB.EQUAL, 0,
+                          name="last_service_ends_at_end") # last service ends at end_node
+
+        self._addMConstrs((num_H, num_S, num_K), [(1, dep), (-1, arr)], GRB.GREATER_EQUAL, 0, name="departure_time_consistency") # departure time consistency
+        self._addMConstrs((num_H, num_S, num_K), [(1, z), (-1, y)], GRB.GREATER_EQUAL, 0, name="no_stop_if_unused") # vehicle cannot stop if not in use
+        self._addMConstrs((num_H, num_S, num_K), [(self.big_M, z), (-1, arr)], GRB.GREATER_EQUAL, 0, name="no_arrival_if_unused") # vehicle cannot arrive if not in use
+        self._addMConstrs((num_H, num_S, num_K), [(self.big_M, z), (-1, dep)], GRB.GREATER_EQUAL, 0, name="no_depature_if_unused") # vehicle cannot depart if not in use
+
+        self._addMConstrs((num_H, num_S - 1, num_K), [(1, end[:,None,:]), (-1, turns[:,1:]), (-1, turns[:,:-1])], GRB.GREATER_EQUAL, -1,
+                          name="strengthen_end_after_2_turns") # strengthening: end node is placed after two turns
+        # strengthening: bus stays parked after two turns, for all services s > 0 and s < t < last service
+        s_idx, t_idx = np.nonzero(np.triu(np.ones((num_S, num_S), dtype=bool), 1)[1:,:last])
+        s_idx += 1
+        self._addMConstrs((num_H, len(s_idx), num_K), [(1, turns[:,t_idx]), (-1, turns[:,s_idx]), (-1, turns[:,s_idx - 1])], GRB.GREATER_EQUAL, -1,
+                          name="strengthen_park_after_2_turns")
+
+        S_asc, S_desc = np.array(self.S_asc), np.array(self.S_desc)
+        # subsequent services have successor or turn
+        self._addMConstrs((num_H, len(S_asc), num_K), [(1, y[:,S_asc]), (-1, turns[:,S_asc]), (-upper[:,None,None,:], x_out_sum[:,S_asc])], GRB.EQUAL, 0,
+                          name="services_have_successor_or_turn")
+        self._addMConstrs((num_H, len(S_desc) - 1, num_K), [(1, y[:,S_desc[:-1]]), (-1, turns[:,S_desc[:-1]]), (-lower[:,None,None,:], x_out_sum[:,S_desc[:-1]])], GRB.EQUAL, 0,
+                          name="services_have_successor_or_turn")
+        # subsequent services have predecessor or prev. turns
+        self._addMConstrs((num_H, len(S_asc) - 1, num_K), [(1, y[:,S_asc[1:]]), (-1, turns[:,S_asc[1:] - 1]), (-lower[:,None,None,:], x_in_sum[:,S_asc[1:]])], GRB.EQUAL, 0,
+                          name="services_have_predecessor_or_turn")
+        self._addMConstrs((num_H, len(S_desc), num_K), [(1, y[:,S_desc]), (-1, turns[:,S_desc - 1]), (-upper[:,None,None,:], x_in_sum[:,S_desc])], GRB.EQUAL, 0,
+                          name="services_have_predecesor_or_turn")
+        # arrival time of new service
+        self._addMConstrs((num_H, num_S - 1, num_K), [(1, arr[:,1:]), (-1, dep[:,:-1]), (-self.t_turn, turns[:,:-1])], GRB.GREATER_EQUAL, 0,
+                          name="arrival_time_of_new_service")
+
+    def _addServiceConstraints(self, direction: str):
+        num_K = len(self.K)
+        if direction == "asc":
+            requests, services, pairs = self.R_asc, np.array(self.S_asc), self.asc_pairs_sharing_stations
+            edges, forbidden_edges, request_idx = self.asc_edges, self.desc_edges, self.R_asc_idx
+            capacity_stations = [(i, [r for r in requests if (self.origins[r] <= i) and (self.destinations[r] > i)]) for i in self.H[:-1]]
+        else:
+            requests, services, pairs = self.R_desc, np.array(self.S_desc), self.desc_pairs_sharing_stations
+            edges, forbidden_edges, request_idx = self.desc_edges, self.asc_edges, self.R_desc_idx
+            capacity_stations = [(i, [r for r in requests if (self.origins[r] >= i) and (self.destinations[r] < i)]) for i in self.H[1:]]
+
+        y, x = self.columns["y"], self.columns["x"]
+        dep, arr = self.columns["depTime"], self.columns["arrTime"]
+        assign, w = self.columns["assign_" + direction], self.columns["w_" + direction]
+        pickup, dropoff = self.columns["pickupTime"], self.columns["dropoffTime"]
+        num_R, num_S = len(requests), len(services)
+
+        origins = np.array([self.origins[r] for r in requests], dtype=int) - 1
+        destinations = np.array([self.destinations[r] for r in requests], dtype=int) - 1
+        e_pickup = np.array([self.pickup_time_windows_per_request[r][0] for r in requests], dtype=float)
+        l_dropoff = np.array([self.drop_off_time_windows_per_request[r][1] for r in requests], dtype=float)
+        b = np.array([self.b[r] for r in requests], dtype=float)
+        dropoff_big_M = np.array([self._dropoffBigM(r) for r in requests], dtype=float)
+
+        # ensure the services flow in their direction
+        forbidden_i, forbidden_j = (np.array(v, dtype=int) - 1 for v in zip(*forbidden_edges))
+        self._addMConstrs((len(forbidden_edges), num_S, num_K), [(1, x[forbidden_i, forbidden_j][:,services])], GRB.EQUAL, 0, name="S_{0}_flow".format(direction))
+
+        block = (num_R, num_S, num_K)
+        y_origin, y_destination = y[origins][:,services], y[destinations][:,services]
+        dep_origin, dep_destination = dep[origins][:,services], dep[destinations][:,services]
+        arr_destination = arr[destinations][:,services]
+        self._addMConstrs(block, [(2, assign), (-1, y_origin), (-1, y_destination)], GRB.LESS_EQUAL, 0, name="assign_if_pickup_and_dropoff") # assignment only if pax is picked up and and dropped off
+        self._addMConstrs(block, [((e_pickup + b)[:,None,None], assign), (-1, dep_origin)], GRB.LESS_EQUAL, 0, name="pickup_after_o.e") # pick-up after earliest pick-up time
+        self._addMConstrs(block, [(1, arr_destination), (dropoff_big_M[:,None,None], assign)], GRB.LESS_EQUAL, (l_dropoff + dropoff_big_M)[:,None,None],
+                          name="dropoff_before_d.l") # drop off before latest drop-off time
+
+        # boarding and de-boarding time added for each pax.
+        request_columns = np.array(requests, dtype=int)
+        if self.linearization == "big_M":
+            for departure, time, time_window, name in [(dep_origin, pickup, self.pickup_time_windows_per_request, "boarding_time"),
+                                                      (dep_destination, dropoff, self.drop_off_time_windows_per_request, "de-boarding_time")]:
+                big_M = np.array([time_window[r][1] + self.b[r] for r in requests], dtype=float)[:,None,None]
+                self._addMConstrs(block, [(1, departure), (-1, time[request_columns][:,None,None]), (-big_M, assign)], GRB.GREATER_EQUAL, b[:,None,None] - big_M,
+                                  name="{0}_{1}".format(direction, name))
+        else:
+            # bilinear or indicator constraints have no matrix form
+            assign_vars = getattr(self, "assign_" + direction)
+            for (r, s, k) in assign_vars.keys():
+                self._addConditionalConstr([assign_vars[r,s,k]], self.depTime[self.origins[r], s, k], self.pickupTime[r] + self.b[r],
+                                           big_M = self.pickup_time_windows_per_request[r][1] + self.b[r], name="{0}_boarding_time".format(direction))
+                self._addConditionalConstr([assign_vars[r,s,k]], self.depTime[self.destinations[r], s, k], self.dropoffTime[r] + self.b[r],
+                                           big_M = self.drop_off_time_windows_per_request[r][1] + self.b[r], name="{0}_de-boarding_time".format(direction))
+
+        # indicator variable if two requests are on the same bus service
+        first = np.array([request_idx[p] for (p, r) in pairs], dtype=int)
+        second = np.array([request_idx[r] for (p, r) in pairs], dtype=int)
+        pair_block = (len(pairs), num_S, num_K)
+        self._addMConstrs(pair_block, [(1, w), (-1, assign[first])], GRB.LESS_EQUAL, 0, name="requests_share_service_1")
+        self._addMConstrs(pair_block, [(1, assign[first]), (1, assign[second]), (-1, w)], GRB.LESS_EQUAL, 1, name="requests_share_service_2")
+
+        # capacity restriction
+        on_board = np.zeros((len(capacity_stations), num_R))
+        for idx, (i, relevant_requests) in enumerate(capacity_stations):
+            on_board[idx, [request_idx[r] for r in relevant_requests]] = [self.demands[r] for r in relevant_requests]
+        self._addMConstrs((len(capacity_stations), num_S, num_K), [(on_board[:,None,None,:], assign.transpose(1, 2, 0)[None])], GRB.LESS_EQUAL, self.Q_max,
+                          name="capacity_restriction")
+
+        # arrival time consistency
+        edge_i, edge_j = (np.array(v, dtype=int) - 1 for v in zip(*edges))
+        travel_times = np.array([self.t[(i,j)] for (i,j) in edges], dtype=float)[:,None,None]
+        self._addMConstrs((len(edges), num_S, num_K), [(1, arr[edge_j][:,services]), (-1, dep[edge_i][:,services]), (-travel_times, x[edge_i, edge_j][:,services])],
+                          GRB.GREATER_EQUAL, 0, name="arrival_time_consistency")
+
+        # ordering of requests sharing a station
+        self._addMatrixOrderingConstraints(requests, w, pairs)
+
+        # passengers picked up max. once
+        self._addMConstrs((num_R,), [(1, assign.reshape(num_R, num_S * num_K))], GRB.LESS_EQUAL, 1, name="pax_picked_up_max_once")
+        # as in SublineModel.createModel, this uses the last vehicle of the loop above
+        z = self.columns["z"]
+        self._addMConstrs((num_R, num_S), [(1, z[-1]), (-1, assign[:,:,-1])], GRB.GREATER_EQUAL, 0, name="no_pickup_if_unused") # vehicle cannot pick up passengers if not in use
+
+        # define help variables
+        if self.linearization == "big_M":
+            arr_origin = arr[origins][:,services]
+            e_dropoff = np.array([self.drop_off_time_windows_per_request[r][0] for r in requests], dtype=float)
+            for time, arrival, big_M, name in [(pickup, arr_origin, self.T - e_pickup, "define_pickupTime"), (dropoff, arr_destination, self.T - e_dropoff, "define_dropoffTime")]:
+                self._addMConstrs(block, [(1, time[request_columns][:,None,None]), (-1, arrival), (-big_M[:,None,None], assign)], GRB.GREATER_EQUAL, -big_M[:,None,None],
+                                  name=name)
+        else:
+            for r in requests:
+                self._addDefinitionOfServiceTimes(r, getattr(self, "assign_" + direction), getattr(self, "S_" + direction))
+
+    def _addMatrixOrderingConstraints(self, requests: List[int], w: np.ndarray, pairs: List[tuple]):
+        # b_p + time_p - time_r <= M * (1 - sum of w[p,r,s,k] over all services and busses)
+        pair_idx = {pair : idx for idx, pair in enumerate(pairs)}
+        pickup, dropoff = self.columns["pickupTime"], self.columns["dropoffTime"]
+        pickup_windows, dropoff_windows = self.pickup_time_windows_per_request, self.drop_off_time_windows_per_request
+        families = [(self.origin_requests_to_be_serviced_before_at_origin, pickup, pickup, pickup_windows, pickup_windows, "order_of_pickup_service_at_origin"),
+                    (self.destination_requests_to_be_serviced_before_at_origin, dropoff, pickup, dropoff_windows, pickup_windows, "order_of_dropoff_service_at_origin"),
+                    (self.destination_requests_to_be_serviced_before_at_destination, dropoff, dropoff, dropoff_windows, dropoff_windows, "order_of_dropoff_at_destination"),
+                    (self.origin_requests_to_be_serviced_before_at_destination, pickup, dropoff, pickup_windows, dropoff_windows, "order_of_pickup_at_destination")]
+
+        for requests_before, time_p, time_r, windows_p, windows_r, name in families:
+            family_pairs = [(p, r) for r in requests for p in requests_before[r]]
+            if len(family_pairs) == 0:
+                continue
+            p_idx = np.array([p for (p, r) in family_pairs], dtype=int)
+            r_idx = np.array([r for (p, r) in family_pairs], dtype=int)
+            big_M = np.array([self._orderingBigM(p, windows_p[p], windows_r[r]) for (p, r) in family_pairs], dtype=float)
+            b = np.array([self.b[p] for (p, r) in family_pairs], dtype=float)
+            w_pairs = w[[pair_idx[pair] for pair in family_pairs]].reshape(len(family_pairs), -1)
+            self._addMConstrs((len(family_pairs),), [(1, time_p[p_idx]), (-1, time_r[r_idx]), (big_M[:,None], w_pairs)], GRB.LESS_EQUAL, big_M - b, name=name)
+
+    def _addRequestConstraints(self):
+        pickup, dropoff = self.columns["pickupTime"], self.columns["dropoffTime"]
+        requests = np.array(self.R, dtype=int)
+        max_travel_time = np.array([self.b[r] + self.alpha * self.t[self.origins[r], self.destinations[r]] for r in self.R], dtype=float)
+        pickup_windows = np.array([self.pickup_time_windows_per_request[r] for r in self.R], dtype=float).reshape(-1, 2)
+        dropoff_windows = np.array([self.drop_off_time_windows_per_request[r] for r in self.R], dtype=float).reshape(-1, 2)
+
+        self._addMConstrs((len(requests),), [(1, dropoff), (-1, pickup)], GRB.LESS_EQUAL, max_travel_time, name="max_travel_time") # travel time service promise
+        # time constraints
+        self._addMConstrs((len(requests),), [(1, pickup)], GRB.GREATER_EQUAL, pickup_windows[:,0], name="lb_on_pickup")
+        self._addMConstrs((len(requests),), [(1, pickup)], GRB.LESS_EQUAL, pickup_windows[:,1], name="ub_on_pickup")
+        self._addMConstrs((len(requests),), [(1, dropoff)], GRB.GREATER_EQUAL, dropoff_windows[:,0], name="lb_on_dropoff")
+        self._addMConstrs((len(requests),), [(1, dropoff)], GRB.LESS_EQUAL, dropoff_windows[:,1], name="ub_on_dropoff")
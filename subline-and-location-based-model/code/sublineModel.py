@@ -1,5 +1,6 @@
 from util import *
 from model import Model
+from conflictGraph import ConflictGraph
 
 class SublineModel(Model):
     def __init__(self, boarding_time = 3, *args, **kwargs):
@@ -9,7 +10,7 @@ class SublineModel(Model):
         super(SublineModel, self).__init__(*args, **kwargs)
 
     def _initModel(self): 
-        return gp.Model(self.name)
+        return gp.Model(self.name, env=self.env)
     
     def _calculateConstants(self):
         self.R_asc = self.requests.asc_requests
@@ -25,6 +26,7 @@ class SublineModel(Model):
         self.R = range(self.num_requests)
 
         self.b = {r : self.boarding_time for r in self.R}
+        self.demands = self.requests.demands
 
         self.turn_edges = [(i,i) for i in self.H]
         self.drive_edges = list(itertools.permutations(self.H, 2))
@@ -41,7 +43,7 @@ class SublineModel(Model):
         # time windows
         self._calculate_time_windows()
 
-        self.num_services = 2 * self.num_requests
+        self.num_services = self._calculateNumServices()
 
         self.S = range(self.num_services)
         self.S_asc = range(0,self.num_services,2)
@@ -56,6 +58,46 @@ class SublineModel(Model):
 
         self.origin_requests_to_be_serviced_before_at_origin, self.destination_requests_to_be_serviced_before_at_origin,\
               self.origin_requests_to_be_serviced_before_at_destination, self.destination_requests_to_be_serviced_before_at_destination = self._find_requests_sharing_stations()
+        self.asc_pairs_sharing_stations = self._pairs_sharing_stations(self.R_asc)
+        self.desc_pairs_sharing_stations = self._pairs_sharing_stations(self.R_desc)
+
+    def _calculateNumServices(self) -> int:
+        # upper bound on the services a bus needs, the last service is descending
+        earliest_pick_up = min(time_window[0] for time_window in self.pickup_time_windows_per_request.values())
+        latest_drop_off = max(time_window[1] for time_window in self.drop_off_time_windows_per_request.values())
+
+        # services 1, ..., s each drive at least one edge and are separated by turns, since two consecutive turns park the bus.
+        # if service s drops off a passenger, it arrives no earlier than s * (t_min + t_turn) + b and no later than the latest drop-off time.
+        num_services = 2 * self.num_requests
+        min_drive_time = min(self.t[i,j] for (i,j) in self.drive_edges)
+        if min_drive_time + self.t_turn > 0:
+            max_useful_service = math.floor((latest_drop_off - self.boarding_time) / (min_drive_time + self.t_turn) + EPSILON)
+            num_services = min(num_services, max_useful_service + 1 + (max_useful_service + 1) % 2)
+
+        # if travel times are a metric, two consecutive empty services can be merged into their neighbours without delaying anyone.
+        # a bus then needs at most two services per service carrying passengers, and those carry a request r each, which occupies the bus
+        # for at least b + t(o_r, d_r) + t_turn during [min. earliest pick-up, max. latest drop-off]
+        if self._travelTimesAreMetric():
+            occupation = np.sort([self.b[r] + self.t[self.origins[r], self.destinations[r]] + self.t_turn for r in self.R])
+            max_useful_services = int(np.searchsorted(np.cumsum(occupation), latest_drop_off - earliest_pick_up + self.t_turn + EPSILON, side="right"))
+            num_services = min(num_services, 2 * max_useful_services)
+
+        return max(2, num_services)
+
+    def _travelTimesAreMetric(self) -> bool:
+        travel_times = self.t[1:,1:].copy()
+        np.fill_diagonal(travel_times, 0)
+        shortest_detour = (travel_times[:,:,None] + travel_times[None,:,:]).min(axis=1)
+        return bool(np.all(travel_times <= shortest_detour + EPSILON))
+
+    def _pairs_sharing_stations(self, requests: List[int]) -> List[tuple]:
+        # pairs (p,r) where p has to be serviced before r if both share a service
+        pairs = set()
+        for r in requests:
+            for p in itertools.chain(self.origin_requests_to_be_serviced_before_at_origin[r], self.destination_requests_to_be_serviced_before_at_origin[r],
+                                     self.origin_requests_to_be_serviced_before_at_destination[r], self.destination_requests_to_be_serviced_before_at_destination[r]):
+                pairs.add((p,r))
+        return sorted(pairs)
 
     def _find_requests_sharing_stations(self):
         origin_requests_to_be_serviced_before_at_origin = {}
@@ -119,9 +161,18 @@ class SublineModel(Model):
             self.drop_off_time_windows_per_request[idx] = destination_time_window
             self.service_promises[idx] = service_promise
 
-    def createModel(self, obj_weights: List, **kwargs):
+    def createModel(self, obj_weights: List, linearization: Optional[str] = None, tighten_big_M: bool = False, warm_start: bool = False,
+                    lazy_constraints: bool = False, user_cuts: bool = False, clique_cuts: bool = False, **kwargs):
+        # lazy_constraints: the capacity and station ordering constraints are separated in a callback, user_cuts: also at the tree nodes
+        # clique_cuts: at most one request of a set of pairwise conflicting requests per service
         start_time = datetime.datetime.now()
         self.objWeights = obj_weights
+        self._setLinearization(linearization)
+        self._setLazyConstraints(lazy_constraints, user_cuts)
+        self.tighten_big_M = tighten_big_M
+        if self.tighten_big_M:
+            # arrival and departure times are bounded by T
+            self.big_M = self.T
 
         # define variables
         self.y = self.model.addVars(self.H, self.S, self.K, vtype=GRB.BINARY, name = "y")
@@ -129,8 +180,8 @@ class SublineModel(Model):
         self.end_node = self.model.addVars(self.H, self.K, vtype=GRB.BINARY, name = "end")
         self.x = self.model.addVars(self.edges, self.S, self.K, vtype=GRB.BINARY, name = "x")
         self.z = self.model.addVars(self.K, vtype=GRB.BINARY, name="z") # indicator variable
-        self.w_asc = self.model.addVars(self.R_asc, self.R_asc, self.S_asc, self.K, vtype = GRB.BINARY, name = "w_asc")
-        self.w_desc = self.model.addVars(self.R_desc, self.R_desc, self.S_desc, self.K, vtype = GRB.BINARY, name = "w_desc")
+        self.w_asc = self.model.addVars([(p,r,s,k) for (p,r) in self.asc_pairs_sharing_stations for s in self.S_asc for k in self.K], vtype = GRB.BINARY, name = "w_asc")
+        self.w_desc = self.model.addVars([(p,r,s,k) for (p,r) in self.desc_pairs_sharing_stations for s in self.S_desc for k in self.K], vtype = GRB.BINARY, name = "w_desc")
         self.depTime = self.model.addVars(self.H, self.S, self.K, vtype=GRB.CONTINUOUS, name="depTime", lb = 0, ub=self.T)
         self.arrTime = self.model.addVars(self.H, self.S, self.K, vtype=GRB.CONTINUOUS, name = "arrTime", lb = 0, ub=self.T)
         self.assign_asc = self.model.addVars(self.R_asc, self.S_asc, self.K, vtype = GRB.BINARY, name = "assign_asc")
@@ -154,31 +205,20 @@ class SublineModel(Model):
                 for r in self.R_asc:
                     self.model.addConstr(2 * self.assign_asc[r,s,k] <= self.y[self.origins[r],s,k] + self.y[self.destinations[r],s,k], name="assign_if_pickup_and_dropoff") # assignment only if pax is picked up and and dropped off
                     self.model.addConstr(self.assign_asc[r,s,k] * (self.pickup_time_windows_per_request[r][0] + self.b[r]) <= self.depTime[self.origins[r],s,k], name="pickup_after_o.e") # pick-up after earliest pick-up time
-                    self.model.addConstr(self.drop_off_time_windows_per_request[r][1] + self.T * (1-self.assign_asc[r,s,k]) >= self.arrTime[self.destinations[r],s,k], name="dropoff_before_d.l") # drop off before latest drop-off time
-
-                    # service requests which have to be picked up or dropped off before the current request, at its origin
-                    for p in self.origin_requests_to_be_serviced_before_at_origin[r]:
-                        self.model.addConstr(self.b[p] + self.pickupTime[p] - self.pickupTime[r] <= self.big_M_pickup *(1 - gp.quicksum(self.w_asc[p, r, s, k] for s in self.S_asc for k in self.K)), name="order_of_pickup_service_at_origin")
-                    for p in self.destination_requests_to_be_serviced_before_at_origin[r]:
-                        self.model.addConstr(self.b[p] + self.dropoffTime[p] - self.pickupTime[r] <= self.big_M_pickup *(1 - gp.quicksum(self.w_asc[p, r, s, k] for s in self.S_asc for k in self.K)), name="order_of_dropoff_service_at_origin")
-
-                    # service requests which have to be picked up or dropped off before the current request, at its destination
-                    for p in self.destination_requests_to_be_serviced_before_at_destination[r]:
-                        self.model.addConstr(self.b[p] + self.dropoffTime[p] - self.dropoffTime[r] <= self.big_M_pickup * (1 - gp.quicksum(self.w_asc[p, r, s, k] for s in self.S_asc for k in self.K)), name="order_of_dropoff_at_destination") # de-boarding time for all earlier passengers
-                    for p in self.origin_requests_to_be_serviced_before_at_destination[r]:
-                        self.model.addConstr(self.b[p] + self.pickupTime[p] - self.dropoffTime[r]  <= self.big_M_pickup * (1 - gp.quicksum(self.w_asc[p, r, s, k] for s in self.S_asc for k in self.K)), name="order_of_pickup_at_destination")
-                    
-                    self.model.addConstr(self.depTime[self.origins[r], s, k] >= self.assign_asc[r,s,k] * (self.pickupTime[r] + self.b[r]), name="asc_boarding_time") # boarding time added for each pax.
-                    self.model.addConstr(self.depTime[self.destinations[r], s, k] >= self.assign_asc[r,s,k] * (self.dropoffTime[r] + self.b[r]), name="asc_de-boarding_time") # de-boarding time added for each pax.
+                    self.model.addConstr(self.drop_off_time_windows_per_request[r][1] + self._dropoffBigM(r) * (1-self.assign_asc[r,s,k]) >= self.arrTime[self.destinations[r],s,k], name="dropoff_before_d.l") # drop off before latest drop-off time
+
+                    self._addConditionalConstr([self.assign_asc[r,s,k]], self.depTime[self.origins[r], s, k], self.pickupTime[r] + self.b[r], 
+                                               big_M = self.pickup_time_windows_per_request[r][1] + self.b[r], name="asc_boarding_time") # boarding time added for each pax.
+                    self._addConditionalConstr([self.assign_asc[r,s,k]], self.depTime[self.destinations[r], s, k], self.dropoffTime[r] + self.b[r], 
+                                               big_M = self.drop_off_time_windows_per_request[r][1] + self.b[r], name="asc_de-boarding_time") # de-boarding time added for each pax.
 
-                    for r2 in self.R_asc:
-                        if r == r2: continue
-                        self.model.addConstr(self.w_asc[r, r2, s, k] <= self.assign_asc[r,s,k], name="requests_share_service_1") # indicator variable if two requests are on the same bus service
-                        self.model.addConstr(self.assign_asc[r,s,k] + self.assign_asc[r2,s,k] - 1 <= self.w_asc[r, r2, s, k], name="requests_share_service_2")
+                for (p,r) in self.asc_pairs_sharing_stations:
+                    self.model.addConstr(self.w_asc[p, r, s, k] <= self.assign_asc[p,s,k], name="requests_share_service_1") # indicator variable if two requests are on the same bus service
+                    self.model.addConstr(self.assign_asc[p,s,k] + self.assign_asc[r,s,k] - 1 <= self.w_asc[p, r, s, k], name="requests_share_service_2")
 
                 for i in self.H[:-1]:
                     relevant_asc_requests = [r for r in self.R_asc if (self.origins[r] <= i) and (self.destinations[r] > i)]
-                    self.model.addConstr(gp.quicksum(self.assign_asc[r,s,k] for r in relevant_asc_requests) <= self.Q_max, name="capacity_restriction") # capacity restriction
+                    self._addLazyConstr(gp.quicksum(self.demands[r] * self.assign_asc[r,s,k] for r in relevant_asc_requests) - self.Q_max, name="capacity_restriction") # capacity restriction
 
             for s in self.S_desc:
                 for (i,j) in self.asc_edges:
@@ -186,31 +226,20 @@ class SublineModel(Model):
                 for r in self.R_desc:
                     self.model.addConstr(2 * self.assign_desc[r,s,k] <= self.y[self.origins[r],s,k] + self.y[self.destinations[r],s,k], name="assign_if_pickup_and_dropoff") # assignment only if pax is picked up and and dropped off
                     self.model.addConstr(self.assign_desc[r,s,k] * (self.pickup_time_windows_per_request[r][0] + self.b[r]) <= self.depTime[self.origins[r],s,k], name="pickup_after_o.e") # pick-up after earliest pick-up time plus get-on-time
-                    self.model.addConstr(self.drop_off_time_windows_per_request[r][1] + self.T * (1-self.assign_desc[r,s,k]) >= self.arrTime[self.destinations[r],s,k], name="dropoff_before_d.l") # drop off before latest drop-off time
+                    self.model.addConstr(self.drop_off_time_windows_per_request[r][1] + self._dropoffBigM(r) * (1-self.assign_desc[r,s,k]) >= self.arrTime[self.destinations[r],s,k], name="dropoff_before_d.l") # drop off before latest drop-off time
                     
-                    # service requests which have to be picked up or dropped off before the current request, at its origin
-                    for p in self.origin_requests_to_be_serviced_before_at_origin[r]:
-                        self.model.addConstr(self.b[p] + self.pickupTime[p] - self.pickupTime[r] <= self.big_M_pickup *(1 - gp.quicksum(self.w_desc[p, r, s, k] for s in self.S_desc for k in self.K)), name="order_of_pickup_service_at_origin")
-                    for p in self.destination_requests_to_be_serviced_before_at_origin[r]:
-                        self.model.addConstr(self.b[p] + self.dropoffTime[p] - self.pickupTime[r] <= self.big_M_pickup *(1 - gp.quicksum(self.w_desc[p, r, s, k] for s in self.S_desc for k in self.K)), name="order_of_dropoff_service_at_origin")
-
-                    # service requests which have to be picked up or dropped off before the current request, at its destination
-                    for p in self.destination_requests_to_be_serviced_before_at_destination[r]:
-                        self.model.addConstr(self.b[p] + self.dropoffTime[p] - self.dropoffTime[r] <= self.big_M_pickup * (1 - gp.quicksum(self.w_desc[p, r, s, k] for s in self.S_desc for k in self.K)), name="order_of_dropoff_at_destination") # de-boarding time for all earlier passengers
-                    for p in self.origin_requests_to_be_serviced_before_at_destination[r]:
-                        self.model.addConstr(self.b[p] + self.pickupTime[p] - self.dropoffTime[r]  <= self.big_M_pickup * (1 - gp.quicksum(self.w_desc[p, r, s, k] for s in self.S_desc for k in self.K)), name="order_of_pickup_at_destination")
-
-                    self.model.addConstr(self.depTime[self.origins[r], s, k] >= self.assign_desc[r,s,k] * (self.pickupTime[r] + self.b[r]), name="desc_boarding_time") # boarding time added for each pax.
-                    self.model.addConstr(self.depTime[self.destinations[r], s, k] >= self.assign_desc[r,s,k] * (self.dropoffTime[r] + self.b[r]), name="desc_de-boarding_time") # de-boarding time added for each pax.
-
-                    for r2 in self.R_desc:
-                        if r == r2: continue
-                        self.model.addConstr(self.w_desc[r, r2, s, k] <= self.assign_desc[r,s,k], name="requests_share_service_1") # indicator variable if two requests are on the same bus service
-                        self.model.addConstr(self.assign_desc[r,s,k] + self.assign_desc[r2,s,k] - 1 <= self.w_desc[r, r2, s, k], name="requests_share_service_2")
+                    self._addConditionalConstr([self.assign_desc[r,s,k]], self.depTime[self.origins[r], s, k], self.pickupTime[r] + self.b[r], 
+                                               big_M = self.pickup_time_windows_per_request[r][1] + self.b[r], name="desc_boarding_time") # boarding time added for each pax.
+                    self._addConditionalConstr([self.assign_desc[r,s,k]], self.depTime[self.destinations[r], s, k], self.dropoffTime[r] + self.b[r], 
+                                               big_M = self.drop_off_time_windows_per_request[r][1] + self.b[r], name="desc_de-boarding_time") # de-boarding time added for each pax.
+
+                for (p,r) in self.desc_pairs_sharing_stations:
+                    self.model.addConstr(self.w_desc[p, r, s, k] <= self.assign_desc[p,s,k], name="requests_share_service_1") # indicator variable if two requests are on the same bus service
+                    self.model.addConstr(self.assign_desc[p,s,k] + self.assign_desc[r,s,k] - 1 <= self.w_desc[p, r, s, k], name="requests_share_service_2")
 
                 for i in self.H[1:]:
                     relevant_desc_requests = [r for r in self.R_desc if (self.origins[r] >= i) and (self.destinations[r] < i)]
-                    self.model.addConstr(gp.quicksum(self.assign_desc[r,s,k] for r in relevant_desc_requests) <= self.Q_max, name="capacity_restriction") # capacity restriction
+                    self._addLazyConstr(gp.quicksum(self.demands[r] * self.assign_desc[r,s,k] for r in relevant_desc_requests) - self.Q_max, name="capacity_restriction") # capacity restriction
 
             for s in self.S_asc:
                 for (i,j) in self.asc_edges:
@@ -262,19 +291,20 @@ class SublineModel(Model):
                 for s in self.S_desc[:-1]:
                     self.model.addConstr(self.y[i,s,k] == self.x[i,i,s,k] + gp.quicksum(self.x[i,j,s,k] for j in stations_desc_from_i), name="services_have_successor_or_turn") # subsequent services have successor or turn
 
+        self._addOrderingConstraints(self.R_asc, self.S_asc, self.w_asc)
+        self._addOrderingConstraints(self.R_desc, self.S_desc, self.w_desc)
+
         for r in self.R_asc:
             self.model.addConstr(gp.quicksum(self.assign_asc[r,s,k] for s in self.S_asc for k in self.K) <= 1, name="pax_picked_up_max_once") # passengers picked up max. once
             self.model.addConstr(self.dropoffTime[r] - self.b[r] - self.pickupTime[r] <= self.alpha * self.t[self.origins[r], self.destinations[r]], name="max_travel_time") # travel time service promise
-            self.model.addConstr(self.pickupTime[r] >= gp.quicksum(self.assign_asc[r,s,k] * self.arrTime[self.origins[r], s,k] for s in self.S_asc for k in self.K), name="define_pickupTime") # define help variable
-            self.model.addConstr(self.dropoffTime[r] >= gp.quicksum(self.assign_asc[r,s,k] * self.arrTime[self.destinations[r], s,k] for s in self.S_asc for k in self.K), name="define_dropoffTime") # define help variable
+            self._addDefinitionOfServiceTimes(r, self.assign_asc, self.S_asc)
             for s in self.S_asc:
                 self.model.addConstr(self.z[k] >= self.assign_asc[r,s,k], name="no_pickup_if_unused") # vehicle cannot pick up passengers if not in use
 
         for r in self.R_desc:
             self.model.addConstr(gp.quicksum(self.assign_desc[r,s,k] for s in self.S_desc for k in self.K) <= 1, name="pax_picked_up_max_once") # passengers picked up max. once
             self.model.addConstr(self.dropoffTime[r] - self.b[r] - self.pickupTime[r] <= self.alpha * self.t[self.origins[r], self.destinations[r]], name="max_travel_time") # travel time service promise
-            self.model.addConstr(self.pickupTime[r] >= gp.quicksum(self.assign_desc[r,s,k] * self.arrTime[self.origins[r], s,k] for s in self.S_desc for k in self.K), name="define_pickupTime") # define help variable
-            self.model.addConstr(self.dropoffTime[r] >= gp.quicksum(self.assign_desc[r,s,k] * self.arrTime[self.destinations[r], s,k] for s in self.S_desc for k in self.K), name="define_dropoffTime") # define help variable
+            self._addDefinitionOfServiceTimes(r, self.assign_desc, self.S_desc)
             for s in self.S_desc:
                 self.model.addConstr(self.z[k] >= self.assign_desc[r,s,k], name="no_pickup_if_unused") # vehicle cannot pick up passengers if not in use
 
@@ -290,16 +320,121 @@ class SublineModel(Model):
             for k in self.K[:-1]:
                 self.model.addConstr(self.start_node[i,k] >= gp.quicksum(self.start_node[j,k+1] for j in prev_stations), name="symm_breaking:smaller_vehicles_start_earlier") # symmetry breaking: smaller vehicles start at smaller stations
     
+        if clique_cuts:
+            self._addCliqueCuts()
+
+        self._prepareLazyConstraints()
         end_time = datetime.datetime.now()
         self.Buildtime = (end_time - start_time).total_seconds()
 
+        if warm_start:
+            self._warmStart()
+
+    def _warmStart(self):
+        self.heuristic = self._insertionHeuristic().solve()
+        self._setStartFromHeuristic(self.heuristic)
+
+    def _heuristicOptions(self) -> dict:
+        # symm_breaking:smaller_vehicles_start_earlier only lets the first bus start before the second to last station, the others start at the last station
+        start_stations = [None] + [self.H[-1]] * (self.num_busses - 1)
+        return {"num_services": self.num_services, "horizon": self.T, "start_stations": start_stations}
+
+    def _setStartFromHeuristic(self, heuristic):
+        # binary part of the MIP start, Gurobi completes the times
+        binaries = {"y": self.y, "start_node": self.start_node, "end_node": self.end_node, "x": self.x, "z": self.z,
+                    "assign_asc": self.assign_asc, "assign_desc": self.assign_desc, "w_asc": self.w_asc, "w_desc": self.w_desc}
+        start = {name: dict.fromkeys(variables.keys(), 0) for name, variables in binaries.items()}
+
+        # the heuristic fills the busses in order
+        for k, legs in enumerate(heuristic.routes):
+            if not legs:
+                continue
+            services = heuristic.getServices(k, legs)
+            # the bus parks at its last station, turning once per remaining service
+            end_station = services[-1][0][-1]
+            services += [([end_station], []) for _ in range(self.num_services - len(services))]
+
+            start["z"][k] = 1
+            start["start_node"][services[0][0][0], k] = 1
+            start["end_node"][end_station, k] = 1
+            for s, (stations, requests) in enumerate(services):
+                for i in stations:
+                    start["y"][i,s,k] = 1
+                for (i,j) in zip(stations[:-1], stations[1:]):
+                    start["x"][i,j,s,k] = 1
+                if s < self.S[-1]:
+                    start["x"][stations[-1], stations[-1], s, k] = 1
+                for r in requests:
+                    start["assign_asc" if s in self.S_asc else "assign_desc"][r,s,k] = 1
+
+        for (w, assign) in [("w_asc", "assign_asc"), ("w_desc", "assign_desc")]:
+            for (p,r,s,k) in start[w]:
+                start[w][p,r,s,k] = start[assign][p,s,k] * start[assign][r,s,k]
+
+        for name, variables in binaries.items():
+            self._setStartValues(variables, start[name])
+
+    def _addCliqueCuts(self):
+        conflict_graph = ConflictGraph(self.requests, pickup_windows=[self.pickup_time_windows_per_request[r] for r in self.R],
+                                       dropoff_windows=[self.drop_off_time_windows_per_request[r] for r in self.R], speed=self.speed, boarding_time=self.boarding_time)
+        conflicts = conflict_graph.service_conflicts()
+        self.cliques = []
+        for (requests, services, assign) in [(self.R_asc, self.S_asc, self.assign_asc), (self.R_desc, self.S_desc, self.assign_desc)]:
+            cliques = conflict_graph.maximal_cliques(conflicts, requests)
+            for clique in cliques:
+                self.model.addConstrs((gp.quicksum(assign[r,s,k] for r in clique) <= 1 for s in services for k in self.K), name="clique")
+            self.cliques += cliques
+
+    def _addOrderingConstraints(self, requests: List[int], services: range, w: dict):
+        # added once per pair of requests sharing a station, the pair may share any service of any bus
+        pickup = self.pickup_time_windows_per_request
+        dropoff = self.drop_off_time_windows_per_request
+        for r in requests:
+            # service requests which have to be picked up or dropped off before the current request, at its origin
+            for p in self.origin_requests_to_be_serviced_before_at_origin[r]:
+                self._addLazyConstr(self.b[p] + self.pickupTime[p] - self.pickupTime[r] - self._orderingBigM(p, pickup[p], pickup[r]) *(1 - gp.quicksum(w[p, r, s, k] for s in services for k in self.K)), name="order_of_pickup_service_at_origin")
+            for p in self.destination_requests_to_be_serviced_before_at_origin[r]:
+                self._addLazyConstr(self.b[p] + self.dropoffTime[p] - self.pickupTime[r] - self._orderingBigM(p, dropoff[p], pickup[r]) *(1 - gp.quicksum(w[p, r, s, k] for s in services for k in self.K)), name="order_of_dropoff_service_at_origin")
+
+            # service requests which have to be picked up or dropped off before the current request, at its destination
+            for p in self.destination_requests_to_be_serviced_before_at_destination[r]:
+                self._addLazyConstr(self.b[p] + self.dropoffTime[p] - self.dropoffTime[r] - self._orderingBigM(p, dropoff[p], dropoff[r]) * (1 - gp.quicksum(w[p, r, s, k] for s in services for k in self.K)), name="order_of_dropoff_at_destination") # de-boarding time for all earlier passengers
+            for p in self.origin_requests_to_be_serviced_before_at_destination[r]:
+                self._addLazyConstr(self.b[p] + self.pickupTime[p] - self.dropoffTime[r] - self._orderingBigM(p, pickup[p], dropoff[r]) * (1 - gp.quicksum(w[p, r, s, k] for s in services for k in self.K)), name="order_of_pickup_at_destination")
+
+    def _orderingBigM(self, p: int, time_window_p: List[float], time_window_r: List[float]) -> float:
+        # b_p + time_p - time_r is at most b_p + latest time_p - earliest time_r
+        if self.tighten_big_M:
+            return max(0, self.b[p] + time_window_p[1] - time_window_r[0])
+        return self.big_M_pickup
+
+    def _dropoffBigM(self, r: int) -> float:
+        # arrival times are bounded by T
+        if self.tighten_big_M:
+            return max(0, self.T - self.drop_off_time_windows_per_request[r][1])
+        return self.T
+
+    def _addDefinitionOfServiceTimes(self, r: int, assign: dict, services: range):
+        if self.linearization is None:
+            self.model.addConstr(self.pickupTime[r] >= gp.quicksum(assign[r,s,k] * self.arrTime[self.origins[r], s,k] for s in services for k in self.K), name="define_pickupTime") # define help variable
+            self.model.addConstr(self.dropoffTime[r] >= gp.quicksum(assign[r,s,k] * self.arrTime[self.destinations[r], s,k] for s in services for k in self.K), name="define_dropoffTime") # define help variable
+            return
+
+        # arrival times are bounded by T, pick-up and drop-off times by the time windows of request r
+        for s in services:
+            for k in self.K:
+                self._addConditionalConstr([assign[r,s,k]], self.pickupTime[r], self.arrTime[self.origins[r], s,k], 
+                                           big_M = self.T - self.pickup_time_windows_per_request[r][0], name="define_pickupTime") # define help variable
+                self._addConditionalConstr([assign[r,s,k]], self.dropoffTime[r], self.arrTime[self.destinations[r], s,k], 
+                                           big_M = self.T - self.drop_off_time_windows_per_request[r][0], name="define_dropoffTime") # define help variable
+
     def _setObjective(self):
-        self.num_pax_accepted =  gp.quicksum(self.assign_asc[r,s,k] for r in self.R_asc for s in self.S_asc for k in self.K) + \
-                        gp.quicksum(self.assign_desc[r,s,k] for r in self.R_desc for s in self.S_desc for k in self.K)
+        self.num_pax_accepted =  gp.quicksum(self.demands[r] * self.assign_asc[r,s,k] for r in self.R_asc for s in self.S_asc for k in self.K) + \
+                        gp.quicksum(self.demands[r] * self.assign_desc[r,s,k] for r in self.R_desc for s in self.S_desc for k in self.K)
         
-        self.pax_km = gp.quicksum(self.assign_asc[r,s,k] * self.c_direct[r] 
+        self.pax_km = gp.quicksum(self.assign_asc[r,s,k] * self.c_direct[r] * self.demands[r]
                              for r in self.R_asc for s in self.S_asc for k in self.K) + \
-                             gp.quicksum(self.assign_desc[r,s,k] * self.c_direct[r] 
+                             gp.quicksum(self.assign_desc[r,s,k] * self.c_direct[r] * self.demands[r]
                              for r in self.R_desc for s in self.S_desc for k in self.K)
         self.total_distance = gp.quicksum(self.x[i,j,s,k] * self.c[i,j] for k in self.K for s in self.S for (i,j) in self.drive_edges)
 
@@ -330,6 +465,11 @@ class SublineModel(Model):
             self.required_busses = self.z.sum().getValue()
             self.pax_km = self.pax_km.getValue()
 
+            # one query per variable block, the postprocessing reads the values from these lists
+            self.pickup_time_values = self._solutionValues(self.pickupTime).tolist()
+            self.dropoff_time_values = self._solutionValues(self.dropoffTime).tolist()
+            self.z_values = self._solutionValues(self.z).tolist()
+
             self.passenger_assignment, self.bus_assignment = self._calculateAssignment()
             self.waiting_time_per_pax = self._calculateWaitingTimes()
             self.num_empty_services = self._calculateEmptyServices()
@@ -348,6 +488,7 @@ class SublineModel(Model):
             verboseprint("Objective Value:", self.model.getObjective().getValue())
             verboseprint(SEPERATOR)
             verboseprint("Buildtime:", round(self.Buildtime,4))
+            self._printCuts(verboseprint)
             verboseprint("Runtime:", round(self.model.Runtime, 4))
             verboseprint("MIP Gap:", self.model.MIPGap)
             verboseprint(SEPERATOR)
@@ -368,7 +509,7 @@ class SublineModel(Model):
                 verboseprint(SEPERATOR)
                 verboseprint("SOLUTION FOR BUS", k)
                 verboseprint(SEPERATOR)
-                if self.z[k].X == 0:
+                if self.z_values[k] == 0:
                     verboseprint("Bus parked.")
                     continue
 
@@ -393,15 +534,15 @@ class SublineModel(Model):
 
         for r in self.R:
             if self.passenger_assignment[r] is not None:
-                avg_waiting_time += self.waiting_time_per_pax[r]
-                avg_ride_time += self.dropoffTime[r].X - self.pickupTime[r].X
-                avg_transportation_time += self.dropoffTime[r].X - self.pickup_time_windows_per_request[r][0]
+                avg_waiting_time += self.demands[r] * self.waiting_time_per_pax[r]
+                avg_ride_time += self.demands[r] * (self.dropoff_time_values[r] - self.pickup_time_values[r])
+                avg_transportation_time += self.demands[r] * (self.dropoff_time_values[r] - self.pickup_time_windows_per_request[r][0])
 
         self.avg_waiting_time = round(avg_waiting_time / self.num_pax_accepted, 2)
         self.avg_ride_time = round(avg_ride_time / self.num_pax_accepted, 2)
         self.avg_transportation_time = round(avg_transportation_time / self.num_pax_accepted, 2)
 
-        # Note: the following calculations will have to change when implementing shortcuts or loads != 1.
+        # Note: the following calculations will have to change when implementing shortcuts.
 
         for k in self.K:
             for s in self.S:
@@ -409,8 +550,8 @@ class SublineModel(Model):
                     empty_mileage += sum(self.c[e] for e in self.paths[k][s])
                 else:
                     pax_on_service = self.bus_assignment[k][s]
-                    pax_km_booked += sum(self.c[(self.origins[pax],self.destinations[pax])] for pax in pax_on_service)
-                    pooling_factor += sum(self.c[(self.origins[pax],self.destinations[pax])] for pax in pax_on_service)
+                    pax_km_booked += sum(self.demands[pax] * self.c[(self.origins[pax],self.destinations[pax])] for pax in pax_on_service)
+                    pooling_factor += sum(self.demands[pax] * self.c[(self.origins[pax],self.destinations[pax])] for pax in pax_on_service)
                     for e in self.paths[k][s]:
                         i,j = e
                         num_pax_on_board = 0
@@ -418,10 +559,10 @@ class SublineModel(Model):
                             if s in self.S_asc:
                                 if (self.origins[pax] <= i) and (self.destinations[pax] >= j) and (i != j):
                                     # pax on board
-                                    num_pax_on_board += 1
+                                    num_pax_on_board += self.demands[pax]
                             elif s in self.S_desc:
                                 if (self.origins[pax] >= i) and (self.destinations[pax] <= j) and (i != j):
-                                    num_pax_on_board += 1
+                                    num_pax_on_board += self.demands[pax]
 
                         if num_pax_on_board == 0:
                             empty_mileage += self.c[e]
@@ -458,9 +599,8 @@ class SublineModel(Model):
         return assignment
 
     def _getNonzeroAssignment(self, assignment: dict, assignment_vars: dict):
-        for (r,s,b), var in assignment_vars.items():
-            if round(var.X) == 1:
-                assignment[r] = (b,s)
+        for (r,s,b) in self._selectedKeys(assignment_vars):
+            assignment[r] = (b,s)
         return assignment
     
     def _calculateBusAssignment(self, passenger_assignment):
@@ -472,6 +612,15 @@ class SublineModel(Model):
 
         return assignment
     
+    def requestSchedule(self) -> dict:
+        schedule = {}
+        pickup_times = self._solutionValues(self.pickupTime).tolist()
+        dropoff_times = self._solutionValues(self.dropoffTime).tolist()
+        for r, assignment in self._calculatePassengerAssignment().items():
+            if assignment is not None:
+                schedule[r] = (assignment[0], pickup_times[r], dropoff_times[r])
+        return schedule
+
     def _calculateEmptyServices(self):
         num_empty_services = 0
         for k in self.K:
@@ -479,33 +628,45 @@ class SublineModel(Model):
         return num_empty_services
     
     def _calculateNode(self, var):
-        return {k:i for k in self.K for i in self.H if round(var[i,k].X, 0) == 1}
+        node = {}
+        for (i,k) in self._selectedKeys(var):
+            node[k] = i
+        return {k:node[k] for k in self.K if k in node}
     
     def _calculatePath(self):
+        # edges of a service are sorted by station in the direction of the service, ties keep the order of self.edges
+        edge_position = {e: position for position, e in enumerate(self.edges)}
+        edges = {(k,s): [] for k in self.K for s in self.S}
+        for (i,j,s,k) in self._selectedKeys(self.x):
+            if (i,j) in edge_position:
+                edges[k,s].append((i,j))
+
         path = {}
         for k in self.K:
             desc_service = False
             path[k] = {}
             for s in self.S:
-                edges = [(i,j) for (i,j) in self.edges if round(self.x[i,j,s,k].X) == 1]
-                sorted_edges = sorted(edges, key = lambda x: x[0], reverse = desc_service)
+                sorted_edges = sorted(edges[k,s], key = lambda e: (-e[0] if desc_service else e[0], edge_position[e]))
                 path[k][s] = sorted_edges
                 desc_service = not desc_service
         return path
 
     def _calculateWaitingTimes(self):
         pax_wait_time = {}
+        # arrival time of the bus of every served pax at its origin station, one query for all of them
+        served = [r for r in self.R if self.passenger_assignment[r]]
+        arrival_variables = [self.arrTime[self.origins[r], self.passenger_assignment[r][1], self.passenger_assignment[r][0]] for r in served]
+        arrival_times = dict(zip(served, self.model.getAttr("X", arrival_variables)))
         for r in self.R:
             # calculate only if pax was picked up
             if self.passenger_assignment[r]:
-                b,s = self.passenger_assignment[r]
-                bus_arrival_time = self.arrTime[self.origins[r], s, b].X
+                bus_arrival_time = arrival_times[r]
 
                 if self.service_promises[r][0] and (self.pickup_time_windows_per_request[r][0] < bus_arrival_time): # pax must wait at origin station
-                    pax_on_board_time = self.pickupTime[r].X
+                    pax_on_board_time = self.pickup_time_values[r]
                     pax_wait_time[r] = pax_on_board_time - self.pickup_time_windows_per_request[r][0]
                 elif self.service_promises[r][1] and (self.drop_off_time_windows_per_request[r][1] > bus_arrival_time): # pax is early at destination station
-                    pax_off_board_time = self.dropoffTime[r].X
+                    pax_off_board_time = self.dropoff_time_values[r]
                     pax_wait_time[r] = self.drop_off_time_windows_per_request[r][1] - pax_off_board_time
                 else:
                     pax_wait_time[r] = 0
@@ -528,7 +689,7 @@ class SublineModel(Model):
         return active_services_by_bus
 
     def _prepareOutput(self, id):
-        self.total_waiting_time = sum(self.waiting_time_per_pax.values())
+        self.total_waiting_time = sum(self.demands[r] * waiting_time for r, waiting_time in self.waiting_time_per_pax.items())
         if self.num_pax_accepted == 0:
             self.avg_waiting_time = 0
         else:
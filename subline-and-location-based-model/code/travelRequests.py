@@ -1,17 +1,38 @@
 from util import *
+import copy
+import hashlib
 
 # nodeset: assignment from physical station to DARP station => nodeset[DARP station] = physical station
 
 # TODO: seperate Requests into Request class, make travelRequest a collection of Request?
 
+COMPILED_INSTANCE_VERSION = 1 # part of the key of compiled instances, increase when their content changes
+
+# squares elementwise with python's float ** 2 (libm pow). numpy's ** 2 computes x*x, which can differ in the last bit,
+# the distances stay bit-identical to the per-pair formula
+_square = np.frompyfunc(lambda value: value ** 2, 1, 1)
+
+def _euclidean_norm(dx: np.ndarray, dy: np.ndarray) -> np.ndarray:
+    return np.sqrt(_square(dx).astype(float) + _square(dy).astype(float))
+
 class TravelRequests:
     def _initialize(self):
         self.generate_directional_requests()
 
-    def read_requests(self, requests: REQUEST_LIST_TYPE, num_stations: int) -> None:
+        # the requests as arrays, missing times are nan. time windows are computed from them on demand
+        requests = np.array(self.requests, dtype=float).reshape(-1, 4)
+        self.request_origins = requests[:, ORIGIN_IDX].astype(int)
+        self.request_destinations = requests[:, DESTINATION_IDX].astype(int)
+        self.earliest_pick_ups = requests[:, EARLIEST_START_TIME_IDX]
+        self.latest_drop_offs = requests[:, LATEST_ARRIVAL_TIME_IDX]
+        self._time_window_cache = {}
+
+    def read_requests(self, requests: REQUEST_LIST_TYPE, num_stations: int, demands: Optional[List[int]] = None) -> None:
+        # demands: passengers per request, 1 if not given
         self.num_stations = num_stations
         self.requests = requests
         self.num_requests = len(requests)
+        self.demands = [1] * self.num_requests if demands is None else list(demands)
         self._initialize()
 
     def _transform_line(self, line: str, int_idx: List = []) -> List:
@@ -21,188 +42,266 @@ class TravelRequests:
             values[i] = int(values[i])
         return values
 
-    def _read_input_file(self, infile: str):
-        file = open(infile, "r")
-        first_line = file.readline()
+    def _load_rows(self, file, num_columns: int) -> np.ndarray:
+        # remaining lines of the file as a float array with num_columns columns, "nan" is read as NaN
+        with warnings.catch_warnings():
+            # empty files are checked by the callers
+            warnings.simplefilter("ignore", UserWarning)
+            rows = np.loadtxt(file, ndmin=2)
+        if rows.size == 0:
+            return np.empty((0, num_columns))
+        if rows.shape[1] != num_columns:
+            raise ValueError("Expected {0} values per line in {1}.".format(num_columns, getattr(file, "name", file)))
+        return rows
 
-        overall_service_time = 10**6
+    def _read_input_file(self, infile: str):
+        with open(infile, "r") as file:
+            first_line = file.readline()
+            rows = self._load_rows(file, num_columns=7)
 
         num_vehicles, self.num_requests, self.num_stations, max_time, \
             vehicle_capacity, alpha, beta = self._transform_line(first_line, [0, 1, 2, 4])
-        raw_requests = [[0, 0, None, None] for _ in range(self.num_requests)]
-
-        count = 0
-
-        for line in file.readlines():
-            idx, origin, destination, service_time, demand, \
-                earliest_start_time, latest_arrival_time = self._transform_line(line, [0,1,2,4])
-
-            if idx > self.num_requests:
-                raise ValueError(
-                    "More requests read from file than indicated.")
-            
-            if (service_time < 0):
-                raise ValueError("Invalid service time.")
-            else:
-                overall_service_time = min(overall_service_time, service_time)
-
-            if (origin < 0) or (origin > self.num_stations):
-                raise ValueError(
-                    "Origin of request {0} is out of range at location {1}".format(idx, origin))
-            if (destination < 0) or (destination > self.num_stations):
-                raise ValueError(
-                    "Destination of request {0} is out of range at location {1}".format(idx, destination))
-            if demand > 1:
-                raise ValueError("Demand > 1 is not yet implemented.")
-
-            raw_requests[idx][ORIGIN_IDX] = origin
-            raw_requests[idx][DESTINATION_IDX] = destination
-
-            if not isvalid(earliest_start_time) and not isvalid(latest_arrival_time):
-                raise ValueError(
-                    "Request {0} does not have any time information.".format(idx))
-
-            if earliest_start_time < 0:
-                raise ValueError("Start time of request {0} is before time 0.".format(idx))
-            else:
-                raw_requests[idx][EARLIEST_START_TIME_IDX] = earliest_start_time
 
-            if (latest_arrival_time < 0):
-                raise ValueError(
-                    "End time of request {0} is after the max time.".format(idx))
-            else:
-                raw_requests[idx][LATEST_ARRIVAL_TIME_IDX] = latest_arrival_time                
-
-            count += 1
-
-        if count != self.num_requests:
+        idx, origin, destination, demand = (rows[:, column].astype(int) for column in [0, 1, 2, 4])
+        service_time, earliest_start_time, latest_arrival_time = rows[:, 3], rows[:, 5], rows[:, 6]
+
+        # all lines are checked at once, the first invalid line of the file raises the first error it fails
+        checks = [(idx >= self.num_requests, lambda row: "More requests read from file than indicated."),
+                  (service_time < 0, lambda row: "Invalid service time."),
+                  ((origin < 0) | (origin > self.num_stations), lambda row: "Origin of request {0} is out of range at location {1}".format(idx[row], origin[row])),
+                  ((destination < 0) | (destination > self.num_stations), lambda row: "Destination of request {0} is out of range at location {1}".format(idx[row], destination[row])),
+                  (demand < 1, lambda row: "Invalid demand of request {0}.".format(idx[row])),
+                  (np.isnan(earliest_start_time) & np.isnan(latest_arrival_time), lambda row: "Request {0} does not have any time information.".format(idx[row])),
+                  (earliest_start_time < 0, lambda row: "Start time of request {0} is before time 0.".format(idx[row])),
+                  (latest_arrival_time < 0, lambda row: "End time of request {0} is after the max time.".format(idx[row]))]
+        failed = np.column_stack([mask for mask, _ in checks]) if len(rows) > 0 else np.zeros((0, len(checks)), dtype=bool)
+        if failed.any():
+            row = np.flatnonzero(failed.any(axis=1))[0]
+            raise ValueError(checks[np.flatnonzero(failed[row])[0]][1](row))
+
+        if len(rows) != self.num_requests:
             raise ValueError("Less requests read from file than indicated.")
 
-        file.close()
+        overall_service_time = min([10**6] + service_time.tolist())
+
+        raw_requests = [[0, 0, None, None] for _ in range(self.num_requests)]
+        self.demands = [1] * self.num_requests
+        for request_idx, request in zip(idx.tolist(), zip(origin.tolist(), destination.tolist(), earliest_start_time.tolist(), latest_arrival_time.tolist())):
+            raw_requests[request_idx] = list(request)
+        for request_idx, request_demand in zip(idx.tolist(), demand.tolist()):
+            self.demands[request_idx] = request_demand
 
         self.requests = raw_requests
         self._initialize()
 
         return num_vehicles, max_time, vehicle_capacity, self.num_stations, overall_service_time, alpha, beta
 
-    def read_file(self, instance_file: str, consider_shortcuts: bool, station_location_file: str = None, distance_matrix_file: str = None) -> List[int]:
-        output = self._read_input_file(infile=instance_file)
-        
+    def read_file(self, instance_file: str, consider_shortcuts: bool, station_location_file: str = None, distance_matrix_file: str = None,
+                  distance_cache: dict = None, instance_cache: Optional[str] = None) -> List[int]:
+        # distance_cache: optional dict shared between calls, the distances of an unchanged station / distance file are only computed once
+        # instance_cache: optional directory of compiled instances, keyed by the content of the input files. a cached instance is loaded without parsing
         if all([station_location_file, distance_matrix_file]):
             raise ValueError("Too many distance inputs given.")
 
+        if instance_cache is not None:
+            compiled_file = self._compiled_instance_file(instance_cache, instance_file, consider_shortcuts, station_location_file, distance_matrix_file)
+            if os.path.exists(compiled_file):
+                return self._load_compiled_instance(compiled_file)
+
+        output = self._read_input_file(infile=instance_file)
+
         if (station_location_file is not None):
-            self._read_station_locations(infile=station_location_file, consider_shortcuts=consider_shortcuts)
+            self._read_station_locations(infile=station_location_file, consider_shortcuts=consider_shortcuts, distance_cache=distance_cache)
         elif (distance_matrix_file is not None):
-            self._read_distance_matrix(infile=distance_matrix_file)
+            self._read_distance_matrix(infile=distance_matrix_file, distance_cache=distance_cache)
         else:
             self.generate_line_distances()
         
         if self.distances.sum() == 0:
             raise SyntaxError("Distances could not be initialized.")
 
+        if instance_cache is not None:
+            self._save_compiled_instance(compiled_file, output)
         return output
 
+    def _compiled_instance_file(self, instance_cache: str, instance_file: str, consider_shortcuts: bool, station_location_file: Optional[str],
+                                distance_matrix_file: Optional[str]) -> str:
+        content_hash = hashlib.sha256(repr((COMPILED_INSTANCE_VERSION, consider_shortcuts, station_location_file is not None, distance_matrix_file is not None)).encode())
+        for infile in [instance_file, station_location_file, distance_matrix_file]:
+            if infile is not None:
+                with open(infile, "rb") as file:
+                    content_hash.update(file.read())
+                content_hash.update(b"\0")
+        return os.path.join(instance_cache, content_hash.hexdigest() + ".npz")
+
+    def _save_compiled_instance(self, compiled_file: str, output: tuple):
+        # written to a temporary file first, parallel jobs may compile the same instance
+        os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+        temporary_file = "{0}.{1}.tmp".format(compiled_file, os.getpid())
+        with open(temporary_file, "wb") as file:
+            np.savez(file, header=np.array(output, dtype=float), requests=np.array(self.requests, dtype=float).reshape(-1, 4), demands=np.array(self.demands, dtype=int),
+                     distances=self.distances, direct_distances=self.direct_distances)
+        os.replace(temporary_file, compiled_file)
+
+    def _load_compiled_instance(self, compiled_file: str) -> tuple:
+        with np.load(compiled_file) as compiled:
+            num_vehicles, max_time, vehicle_capacity, num_stations, overall_service_time, alpha, beta = compiled["header"].tolist()
+            requests = compiled["requests"].tolist()
+            self.demands = compiled["demands"].tolist()
+            self.distances = compiled["distances"]
+            self.direct_distances = compiled["direct_distances"]
+
+        self.num_stations = int(num_stations)
+        self.num_requests = len(requests)
+        self.requests = [[int(origin), int(destination), earliest_start_time, latest_arrival_time] for origin, destination, earliest_start_time, latest_arrival_time in requests]
+        self._initialize()
+        return int(num_vehicles), max_time, int(vehicle_capacity), self.num_stations, overall_service_time, alpha, beta
+
+    def _cacheKey(self, infile: str, *args) -> tuple:
+        # a file is identified by its path and modification time, so edited files are read again
+        return (os.path.abspath(infile), os.path.getmtime(infile), self.num_stations) + args
+
     def generate_line_distances(self):
         # assuming stations are on a 1D line with distance 1 between each station
         stations = {i : (i, 0) for i in range(1, self.num_stations+1)}
         self._generate_euclidean_line_distances(stations, consider_shortcuts=False)
 
     def _generate_euclidean_line_distances(self, locs: dict, consider_shortcuts:bool):
-        self.distances = np.zeros(shape = (self.num_stations+1, self.num_stations+1))
-        self.direct_distances = np.zeros(shape = self.num_requests)
-        for i in range(1,self.num_stations+1):
-            for j in range(1,self.num_stations+1):#
-                if (i == j):
-                    self.distances[i][j] == 0
-                else:
-                    if consider_shortcuts:
-                        self.distances[i][j] = math.sqrt((locs[j][0] - locs[i][0])**2 + (locs[j][1] - locs[i][1])**2)
-                    else:
-                        if abs(i - j) == 1:
-                            self.distances[i][j] = math.sqrt((locs[j][0] - locs[i][0])**2 + (locs[j][1] - locs[i][1])**2)
-                        else:
-                            dist = 0
-                            start = min(i,j)
-                            end = max(i,j)
-                            for k in range(start, end):
-                                dist += math.sqrt((locs[k+1][0] - locs[k][0])**2 + (locs[k+1][1] - locs[k][1])**2)
-                            self.distances[i][j] = dist
-        for idx, r in enumerate(self.requests):
-            i = r[ORIGIN_IDX]
-            j = r[DESTINATION_IDX]
-            self.direct_distances[idx] = math.sqrt((locs[j][0] - locs[i][0])**2 + (locs[j][1] - locs[i][1])**2)
-
-    def _read_station_locations(self, infile: str, consider_shortcuts: bool):
-        station_location = {}
-        i = 0
-        with open(infile, "r+") as file:
-            for line in file:
-                id, x, y = self._transform_line(line, int_idx = [0])
-                station_location[id] = (x,y)
-                i += 1
-        if i < self.num_stations:
+        self.distances = self._euclidean_distance_matrix(locs, consider_shortcuts)
+        self._set_euclidean_direct_distances(locs)
+
+    def _euclidean_distance_matrix(self, locs: dict, consider_shortcuts:bool) -> np.ndarray:
+        distances = np.zeros(shape = (self.num_stations+1, self.num_stations+1))
+        x, y = np.array([locs[i] for i in range(1, self.num_stations+1)], dtype=float).reshape(-1, 2).T
+        if consider_shortcuts:
+            distances[1:,1:] = _euclidean_norm(x[None,:] - x[:,None], y[None,:] - y[:,None])
+        else:
+            # along the line: the segments from the smaller station on are summed up in order, one cumulative sum per start station
+            segments = _euclidean_norm(x[1:] - x[:-1], y[1:] - y[:-1])
+            for i in range(1, self.num_stations):
+                distances[i, i+1:] = np.cumsum(segments[i-1:])
+            distances = distances + distances.T
+        return distances
+
+    def _set_euclidean_direct_distances(self, locs: dict):
+        # straight line between origin and destination, also without shortcuts
+        stations = np.concatenate([self.request_origins, self.request_destinations])
+        missing = np.setdiff1d(stations, list(locs))
+        if len(missing) > 0:
+            raise KeyError(int(missing[0]))
+        coordinates = np.zeros((max(max(locs), stations.max(initial=0)) + 1, 2))
+        coordinates[list(locs)] = list(locs.values())
+        origins, destinations = coordinates[self.request_origins], coordinates[self.request_destinations]
+        self.direct_distances = _euclidean_norm(destinations[:,0] - origins[:,0], destinations[:,1] - origins[:,1])
+
+    def _read_station_locations(self, infile: str, consider_shortcuts: bool, distance_cache: dict = None):
+        key = self._cacheKey(infile, "locations", consider_shortcuts) if distance_cache is not None else None
+        if key in (distance_cache or {}):
+            station_location, self.distances = distance_cache[key]
+            self.distances = self.distances.copy()
+            self._set_euclidean_direct_distances(station_location)
+            return
+
+        with open(infile, "r") as file:
+            locations = self._load_rows(file, num_columns=3)
+        station_location = {int(id): (x,y) for id, x, y in locations.tolist()}
+        if len(locations) < self.num_stations:
             raise ValueError("Number of stations in distance file is not sufficient for request file.")
         self._generate_euclidean_line_distances(station_location, consider_shortcuts)
 
-    def _read_distance_matrix(self, infile:str):
-        self.distances = np.zeros(shape = (self.num_stations+1, self.num_stations+1))
-        self.direct_distances = np.zeros(shape = (self.num_requests))
-        i = 1
-        with open(infile, "r+") as file:
-            for line in file:
-                self.distances[i] = [0] + self._transform_line(line=line)
-                i += 1
-        if i != self.num_stations + 1:
-            raise ValueError("Not enough distances input, please check matrix.")
-        for idx, r in enumerate(self.requests):
-            self.direct_distances[idx] = self.distances[r[ORIGIN_IDX]][r[DESTINATION_IDX]]
+        if key is not None:
+            distance_cache[key] = (station_location, self.distances.copy())
 
-    def generate_time_windows(self, travel_speed: float, boarding_time: float,
-                              max_time: float,
-                              alpha: float, beta: float) -> List:
-        time_windows = []
-        for request in self.requests:
-            service_promise_made = [False, False]  # pick-up, drop-off
-            origin, destination, earliest_pick_up, latest_drop_off = request
-            direct_travel_time = self.distances[origin][destination] * travel_speed
-            max_travel_time = alpha * direct_travel_time
-
-            if isvalid(earliest_pick_up) and not isvalid(latest_drop_off):
-                # inbound requests
-                service_promise_made[0] = True
-
-                latest_pick_up = earliest_pick_up + beta
-                earliest_drop_off = max(0, earliest_pick_up + boarding_time + direct_travel_time)
-                latest_drop_off = min(max_time, latest_pick_up + max_travel_time + boarding_time)
-                
-            elif not isvalid(earliest_pick_up) and isvalid(latest_drop_off):
-                # outbound requests
-                service_promise_made[1] = True
-
-                earliest_drop_off = latest_drop_off - beta
-                earliest_pick_up = max(0, earliest_drop_off - max_travel_time - boarding_time)
-                latest_pick_up = min(max_time, latest_drop_off - direct_travel_time - boarding_time)
-                
-            else:
-                # no waiting time promise made for these passengers
-                latest_pick_up = latest_drop_off - direct_travel_time - boarding_time
-                earliest_drop_off = earliest_pick_up + direct_travel_time + boarding_time
-
-            if earliest_pick_up > max_time:
+    def _read_distance_matrix(self, infile:str, distance_cache: dict = None):
+        key = self._cacheKey(infile, "matrix") if distance_cache is not None else None
+        if key in (distance_cache or {}):
+            self.distances = distance_cache[key].copy()
+        else:
+            self.distances = np.zeros(shape = (self.num_stations+1, self.num_stations+1))
+            with open(infile, "r") as file:
+                matrix = self._load_rows(file, num_columns=self.num_stations)
+            if len(matrix) != self.num_stations:
+                raise ValueError("Not enough distances input, please check matrix.")
+            self.distances[1:, 1:] = matrix
+            if key is not None:
+                distance_cache[key] = self.distances.copy()
+
+        self.direct_distances = self.distances[self.request_origins, self.request_destinations]
+
+    def time_window_arrays(self, travel_speed: float, boarding_time: float, max_time: float, alpha: float, beta: float) -> dict:
+        # pick-up and drop-off windows and service promises of all requests as read-only arrays, memoized per parameter set
+        key = (travel_speed, boarding_time, max_time, alpha, beta)
+        if key not in self._time_window_cache:
+            self._time_window_cache[key] = self._calculate_time_windows(*key)
+        return self._time_window_cache[key]
+
+    def _calculate_time_windows(self, travel_speed: float, boarding_time: float, max_time: float, alpha: float, beta: float) -> dict:
+        direct_travel_time = self.distances[self.request_origins, self.request_destinations] * travel_speed
+        max_travel_time = alpha * direct_travel_time
+        earliest_pick_up, latest_drop_off = self.earliest_pick_ups, self.latest_drop_offs
+
+        # inbound requests promise the pick-up, outbound requests the drop-off. no waiting time promise is made for the others
+        inbound = ~np.isnan(earliest_pick_up) & np.isnan(latest_drop_off)
+        outbound = np.isnan(earliest_pick_up) & ~np.isnan(latest_drop_off)
+
+        # no promise
+        latest_pick_up = latest_drop_off - direct_travel_time - boarding_time
+        earliest_drop_off = earliest_pick_up + direct_travel_time + boarding_time
+
+        # inbound requests
+        latest_pick_up = np.where(inbound, earliest_pick_up + beta, latest_pick_up)
+        earliest_drop_off = np.where(inbound, np.maximum(0, earliest_pick_up + boarding_time + direct_travel_time), earliest_drop_off)
+        latest_drop_off = np.where(inbound, np.minimum(max_time, latest_pick_up + max_travel_time + boarding_time), latest_drop_off)
+
+        # outbound requests
+        earliest_drop_off = np.where(outbound, latest_drop_off - beta, earliest_drop_off)
+        earliest_pick_up = np.where(outbound, np.maximum(0, earliest_drop_off - max_travel_time - boarding_time), earliest_pick_up)
+        latest_pick_up = np.where(outbound, np.minimum(max_time, latest_drop_off - direct_travel_time - boarding_time), latest_pick_up)
+
+        pick_up_late, drop_off_late = earliest_pick_up > max_time, earliest_drop_off > max_time
+        if (pick_up_late | drop_off_late).any():
+            if pick_up_late[np.flatnonzero(pick_up_late | drop_off_late)[0]]:
                 raise ValueError(
                     "Earliest pick up time is past the time frame.")
-            if earliest_drop_off > max_time:
-                raise ValueError(
-                    "Earliest drop off time is past the time frame.")
+            raise ValueError(
+                "Earliest drop off time is past the time frame.")
 
-            request_origin_time_window = [earliest_pick_up, latest_pick_up]
-            request_destination_time_window = [
-                earliest_drop_off, latest_drop_off]
-            time_windows.append(
-                [request_origin_time_window, request_destination_time_window, service_promise_made])
+        time_windows = {"pick_up": np.stack([earliest_pick_up, latest_pick_up], axis=1), "drop_off": np.stack([earliest_drop_off, latest_drop_off], axis=1),
+                        "service_promise": np.stack([inbound, outbound], axis=1)}
+        for array in time_windows.values():
+            array.setflags(write=False)
         return time_windows
 
+    def generate_time_windows(self, travel_speed: float, boarding_time: float,
+                              max_time: float,
+                              alpha: float, beta: float) -> List:
+        # [[earliest pick-up, latest pick-up], [earliest drop-off, latest drop-off], [pick-up promised, drop-off promised]] per request, as new lists
+        time_windows = self.time_window_arrays(travel_speed=travel_speed, boarding_time=boarding_time, max_time=max_time, alpha=alpha, beta=beta)
+        return [list(time_window) for time_window in zip(time_windows["pick_up"].tolist(), time_windows["drop_off"].tolist(), time_windows["service_promise"].tolist())]
+
+    def subset(self, indices: List[int]):
+        # requests with the given indices as a new instance, numbered 0, 1, ... in the given order. stations and distances are shared
+        subset = copy.copy(self)
+        subset.requests = [self.requests[idx] for idx in indices]
+        subset.num_requests = len(indices)
+        subset.demands = [self.demands[idx] for idx in indices]
+        subset.direct_distances = self.direct_distances[indices]
+        subset._initialize()
+        return subset
+
+    def aggregate_identical(self):
+        # requests with the same origin, destination and time information as one request whose demand is the sum of their demands.
+        # returns the aggregated instance and the original requests of each aggregated request. a group is served as a whole
+        groups = {}
+        for idx, request in enumerate(self.requests):
+            key = tuple(value if isvalid(value) else None for value in request)
+            groups.setdefault(key, []).append(idx)
+
+        members = list(groups.values())
+        aggregated = self.subset([indices[0] for indices in members])
+        aggregated.demands = [sum(self.demands[idx] for idx in indices) for indices in members]
+        return aggregated, members
+
     def generate_directional_requests(self):
         self.asc_requests = []
         self.desc_requests = []
@@ -9,6 +9,7 @@ import argparse
 import pandas as pd
 import numpy as np
 import itertools
+import contextlib
 import gurobipy as gp
 from gurobipy import GRB
 from darpNode import DarpNode